@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+'''
+Measure how many salt-api events per second the SSE decoder handles
+
+Builds the ``/events`` stream of a busy master, where job returns are a
+fraction of the events, and times decoding it in network sized chunks with the
+line based ``str`` decoder pepper used before, with the ``bytes`` decoder, and
+with the ``bytes`` decoder only decoding the events matching a tag filter::
+
+    python benchmarks/bench_events.py --events 50000 --tags 'salt/job/*/ret/*'
+
+'''
+from __future__ import print_function
+import argparse
+import codecs
+import fnmatch
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pepper import codec  # noqa: E402
+from pepper.events import SSEDecoder, TagMatcher  # noqa: E402
+
+
+class LineDecoder(object):
+    '''
+    The ``str`` based decoder, splitting every chunk into lines
+    '''
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._data = []
+
+    def feed(self, chunk):
+        lines = (self._buffer + self._decoder.decode(chunk)).split('\n')
+        self._buffer = lines.pop()
+        events = []
+        for line in lines:
+            line = line.rstrip('\r')
+            if not line:
+                if self._data:
+                    data, self._data = '\n'.join(self._data), []
+                    events.append(codec.loads(data))
+                continue
+            field, _, value = line.partition(':')
+            if field == 'data':
+                self._data.append(value[1:] if value.startswith(' ') else value)
+        return events
+
+
+def event_stream(count):
+    '''
+    A stream in which one event in four is a job return
+    '''
+    events = []
+    for i in range(count):
+        jid = '2018041419390415{0:04d}'.format(i // 100)
+        minion = 'minion-{0:05d}.example.com'.format(i % 1000)
+        kind = i % 4
+        if kind == 0:
+            tag = 'salt/job/{0}/ret/{1}'.format(jid, minion)
+            data = {'id': minion, 'jid': jid, 'fun': 'state.apply', 'retcode': 0, 'success': True,
+                    'return': {'file_|-/etc/motd_|-/etc/motd_|-managed': {'result': True, 'changes': {}}}}
+        elif kind == 1:
+            tag = 'salt/job/{0}/new'.format(jid)
+            data = {'jid': jid, 'tgt': '*', 'fun': 'state.apply', 'minions': [minion], 'user': 'saltdev'}
+        elif kind == 2:
+            tag = 'salt/beacon/{0}/load/'.format(minion)
+            data = {'id': minion, '1m': 0.42, '5m': 0.37, '15m': 0.31}
+        else:
+            tag = 'minion/refresh/{0}'.format(minion)
+            data = {'Minion data cache refresh': minion}
+        data['_stamp'] = '2018-04-14T19:39:04.158892'
+        events.append('tag: {0}\ndata: {1}\n\n'.format(
+            tag, codec.dumps({'tag': tag, 'data': data}).decode('utf-8')))
+    return ''.join(events).encode('utf-8')
+
+
+def run(decoder, chunks, tags=None):
+    '''
+    Return the number of events decoded and the seconds it took
+    '''
+    count = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        events = decoder.feed(chunk)
+        if tags is not None:
+            events = [event for event in events if any(fnmatch.fnmatchcase(event['tag'], tag) for tag in tags)]
+        count += len(events)
+    return count, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=16384)
+    parser.add_argument('--tags', nargs='+', default=['salt/job/*/ret/*'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    stream = event_stream(args.events)
+    chunks = [stream[i:i + args.chunk_size] for i in range(0, len(stream), args.chunk_size)]
+    cases = (
+        ('str lines, every event', lambda: run(LineDecoder(), chunks)),
+        ('str lines, filtered once decoded', lambda: run(LineDecoder(), chunks, args.tags)),
+        ('bytes, every event', lambda: run(SSEDecoder(), chunks)),
+        ('bytes, filtered before decoding', lambda: run(SSEDecoder(TagMatcher(args.tags)), chunks)),
+    )
+    print('{0} events, {1:.1f} MB, {2} backend'.format(args.events, len(stream) / 1e6, codec.get_backend().name))
+    print('  {0:<36} {1:>9} {2:>12}'.format('decoder', 'events', 'events/s'))
+    for name, func in cases:
+        count, elapsed = min((func() for _ in range(args.repeat)), key=lambda result: result[1])
+        print('  {0:<36} {1:>9} {2:>12,.0f}'.format(name, count, args.events / elapsed))
+
+
+if __name__ == '__main__':
+    main()
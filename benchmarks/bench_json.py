@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+'''
+Compare the JSON backends of pepper.codec on Salt shaped returns
+
+Builds a ``state.apply`` return and a ``grains.items`` return for many minions
+and times decoding the response body, encoding a lowstate list and pretty
+printing the result the way the CLI does::
+
+    python benchmarks/bench_json.py --minions 500 --states 40
+
+'''
+from __future__ import print_function
+import argparse
+import timeit
+
+from pepper import codec
+
+
+def highstate_return(minions, states):
+    '''
+    A ``state.apply`` return with full_return enabled
+    '''
+    ret = {}
+    for minion in range(minions):
+        chunks = {}
+        for state in range(states):
+            name = '/etc/app/conf.d/{0}.conf'.format(state)
+            chunks['file_|-{0}_|-{0}_|-managed'.format(name)] = {
+                'name': name,
+                'changes': {'diff': '--- \n+++ \n@@ -1,3 +1,3 @@\n-listen 80\n+listen 8080\n'} if state % 5 else {},
+                'comment': 'File {0} is in the correct state'.format(name),
+                'result': True,
+                '__sls__': 'app.config',
+                '__run_num__': state,
+                '__id__': name,
+                'start_time': '10:12:13.{0:06d}'.format(state),
+                'duration': 4.187 + state,
+            }
+        ret['minion-{0:05d}.example.com'.format(minion)] = {
+            'ret': chunks, 'retcode': 0, 'jid': '20180414193904158892', 'out': 'highstate',
+        }
+    return {'return': [ret]}
+
+
+def grains_return(minions):
+    '''
+    A ``grains.items`` return
+    '''
+    ret = {}
+    for minion in range(minions):
+        ret['minion-{0:05d}.example.com'.format(minion)] = {
+            'ret': {
+                'id': 'minion-{0:05d}.example.com'.format(minion),
+                'os': 'Ubuntu', 'os_family': 'Debian', 'osrelease': '22.04',
+                'kernelrelease': '5.15.0-72-generic', 'num_cpus': 8, 'mem_total': 32096,
+                'ipv4': ['10.0.{0}.{1}'.format(minion // 250, minion % 250), '127.0.0.1'],
+                'ip_interfaces': {'eth0': ['10.0.0.1', 'fe80::1'], 'lo': ['127.0.0.1', '::1']},
+                'cpu_flags': ['fpu', 'vme', 'de', 'pse', 'tsc', 'msr', 'pae', 'mce', 'cx8', 'apic'] * 8,
+                'saltversion': '3006.0', 'saltversioninfo': [3006, 0],
+                'selinux': {'enabled': False, 'enforced': 'Disabled'},
+            },
+            'retcode': 0,
+            'jid': '20180414193904158893',
+        }
+    return {'return': [ret]}
+
+
+def bench(name, payload, repeat):
+    body = codec.StdlibCodec.dumps(payload)
+    lowstate = [{'client': 'local', 'tgt': minion, 'fun': 'state.apply', 'arg': ['app'], 'full_return': True}
+                for minion in payload['return'][0]]
+    print('{0}: {1:.1f} MB response, {2} minions'.format(name, len(body) / 1e6, len(payload['return'][0])))
+    print('  {0:<8} {1:>12} {2:>12} {3:>12}'.format('backend', 'decode ms', 'encode ms', 'pretty ms'))
+    for backend in codec.available_backends():
+        codec.set_backend(backend)
+        timings = [
+            min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+            for func in (
+                lambda: codec.loads(body),
+                lambda: codec.dumps(lowstate),
+                lambda: codec.dumps_pretty(payload),
+            )
+        ]
+        print('  {0:<8} {1:>12.1f} {2:>12.1f} {3:>12.1f}'.format(backend, *timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--minions', type=int, default=500)
+    parser.add_argument('--states', type=int, default=40)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    bench('state.apply', highstate_return(args.minions, args.states), args.repeat)
+    bench('grains.items', grains_return(args.minions * 4), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
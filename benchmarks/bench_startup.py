@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+'''
+Measure pepper's cold start and fail when it is over budget
+
+Runs ``python -X importtime -c "import pepper.script"`` to report the slowest
+imports, and times ``pepper --out json '*' test.ping`` end to end against a
+local stand-in salt-api. Exits non-zero when modules which must be imported
+lazily show up, or when the fastest of ``--runs`` measurements exceeds its
+budget by more than ``--tolerance`` percent. The fastest run is the one least
+disturbed by whatever else the machine is doing, so it varies far less between
+invocations than the median. ``tox -e startup`` runs it::
+
+    python benchmarks/bench_startup.py --import-budget 150 --run-budget 400 --tolerance 25
+
+'''
+from __future__ import print_function
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPT = os.path.join(ROOT, 'scripts', 'pepper')
+
+# modules a plain ``--out json`` run must not import
+LAZY_MODULES = ('salt', 'pkg_resources', 'requests', 'asyncio')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.path.startswith('/login'):
+            body = {'return': [{'token': 'benchtoken', 'expire': time.time() + 3600, 'perms': ['.*']}]}
+        else:
+            body = {'return': [{'minion-{0}'.format(i): {'ret': True, 'retcode': 0, 'jid': '1'} for i in range(50)}]}
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def import_times():
+    '''
+    Return ``{module: cumulative microseconds}`` for ``import pepper.script``
+
+    Only modules imported by pepper are counted, not the ones ``site``
+    imports at interpreter startup.
+    '''
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import pepper.script'],
+        stderr=subprocess.PIPE, universal_newlines=True, check=True, cwd=ROOT)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative)
+        # -X importtime lists a module after its imports; top level imports
+        # are not indented
+        if not name.startswith('  '):
+            if name.strip() == 'pepper.script':
+                return times
+            times = {}
+    raise RuntimeError('pepper.script missing from -X importtime output')
+
+
+def run_times(runs):
+    '''
+    Time complete ``pepper --out json`` runs against the stand-in salt-api
+    '''
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    cachedir = tempfile.mkdtemp()
+    env = dict(os.environ, PEPPERCACHE=os.path.join(cachedir, 'token'), MASTER_CONFIG=os.path.join(cachedir, 'master'))
+    cmd = [sys.executable, SCRIPT, '-u', 'http://127.0.0.1:{0}'.format(server.server_port),
+           '--username', 'bench', '--password', 'bench', '--eauth', 'auto', '--out', 'json', '*', 'test.ping']
+    timings = []
+    try:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True, env=env, cwd=cachedir)
+            timings.append((time.time() - start) * 1000)
+    finally:
+        server.shutdown()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--import-budget', type=float, default=150, help='milliseconds for import pepper.script')
+    parser.add_argument('--run-budget', type=float, default=400, help='milliseconds for a complete run')
+    parser.add_argument('--runs', type=int, default=7, help='measurements of which the fastest is kept')
+    parser.add_argument('--tolerance', type=float, default=25, help='percent over budget still accepted')
+    parser.add_argument('--top', type=int, default=10, help='number of slowest imports to show')
+    args = parser.parse_args()
+
+    failures = []
+    margin = 1 + args.tolerance / 100
+
+    samples = [import_times() for _ in range(args.runs)]
+    fastest = min(samples, key=lambda sample: sample['pepper.script'])
+    import_ms = fastest['pepper.script'] / 1000
+    print('import pepper.script: {0:.1f} ms (budget {1:.0f} ms)'.format(import_ms, args.import_budget))
+    for name, usec in sorted(fastest.items(), key=lambda item: -item[1])[:args.top]:
+        print('  {0:>8.1f} ms  {1}'.format(usec / 1000, name))
+    if import_ms > args.import_budget * margin:
+        failures.append('import pepper.script is over budget')
+    eager = sorted(name for name in fastest if name.split('.')[0] in LAZY_MODULES)
+    if eager:
+        failures.append('imported eagerly: {0}'.format(', '.join(eager[:5])))
+
+    run_ms = min(run_times(args.runs))
+    print("pepper --out json '*' test.ping: {0:.1f} ms (budget {1:.0f} ms)".format(run_ms, args.run_budget))
+    if run_ms > args.run_budget * margin:
+        failures.append('pepper run is over budget')
+
+    for failure in failures:
+        print('FAIL: {0}'.format(failure), file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+'''
+Measure the time saved on TLS handshakes against a local HTTPS stand-in
+
+Sends the same lowstate over new connections with a new SSL context for every
+request (what pepper used to do), with one shared SSL context, with a shared
+context resuming the TLS session, and over a kept-alive connection::
+
+    python benchmarks/bench_tls.py --requests 200
+
+'''
+from __future__ import print_function
+import argparse
+import http.client
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pepper.transport import ConnectionPool, create_ssl_context  # noqa: E402
+
+LOWSTATE = json.dumps([{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        data = json.dumps({'return': [{'minion-0': True}]}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.server.close_connections:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def make_certificate(directory):
+    '''
+    Create a self-signed RSA certificate for 127.0.0.1
+    '''
+    key, cert = os.path.join(directory, 'key.pem'), os.path.join(directory, 'cert.pem')
+    subprocess.check_call([
+        'openssl', 'req', '-x509', '-nodes', '-days', '1', '-newkey', 'rsa:2048',
+        '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1',
+        '-keyout', key, '-out', cert,
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert, key
+
+
+def serve(cert, key):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.close_connections = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def per_request_context(port, cert, requests):
+    for _ in range(requests):
+        context = ssl.create_default_context(cafile=cert)
+        conn = http.client.HTTPSConnection('127.0.0.1', port, context=context)
+        conn.request('POST', '/', LOWSTATE, {'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        conn.close()
+
+
+def shared_context(port, cert, requests):
+    context = create_ssl_context(ca_bundle=cert)
+    for _ in range(requests):
+        conn = http.client.HTTPSConnection('127.0.0.1', port, context=context)
+        conn.request('POST', '/', LOWSTATE, {'Content-Type': 'application/json'})
+        conn.getresponse().read()
+        conn.close()
+
+
+def pooled(port, cert, requests):
+    pool = ConnectionPool(ssl_context=create_ssl_context(ca_bundle=cert))
+    url = 'https://127.0.0.1:{0}/'.format(port)
+    for _ in range(requests):
+        with pool.urlopen('POST', url, LOWSTATE, {'Content-Type': 'application/json'}) as resp:
+            resp.read()
+    pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    try:
+        cert, key = make_certificate(directory)
+        server = serve(cert, key)
+        port = server.server_address[1]
+        cases = (
+            ('new SSL context per request', True, per_request_context),
+            ('shared SSL context', True, shared_context),
+            ('shared SSL context, resumed sessions', True, pooled),
+            ('kept-alive connection', False, pooled),
+        )
+        print('{0} requests, ms per request'.format(args.requests))
+        baseline = None
+        for name, close_connections, func in cases:
+            server.close_connections = close_connections
+            func(port, cert, 5)
+            start = time.time()
+            func(port, cert, args.requests)
+            elapsed = (time.time() - start) * 1000 / args.requests
+            baseline = baseline or elapsed
+            print('  {0:<40} {1:>7.2f}  ({2:.1f}x)'.format(name, elapsed, baseline / elapsed))
+        server.shutdown()
+    finally:
+        shutil.rmtree(directory)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
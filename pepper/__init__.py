@@ -1,17 +1,29 @@
 '''
 Pepper is a CLI front-end to salt-api
 '''
-import pkg_resources
+from pepper.libpepper import EventHub, JobTracker, Pepper, PepperException, TokenManager
 
-from pepper.libpepper import Pepper, PepperException
+try:
+    from importlib import metadata
+except ImportError:
+    # python < 3.8, pkg_resources is slow to import so only use it here
+    metadata = None
 
-__all__ = ('__version__', 'Pepper', 'PepperException')
+__all__ = ('__version__', 'EventHub', 'JobTracker', 'Pepper', 'PepperException', 'TokenManager')
 
-try:
-    __version__ = pkg_resources.get_distribution('salt_pepper').version
-except pkg_resources.DistributionNotFound:
-    # package is not installed
-    __version__ = None
+if metadata is not None:
+    try:
+        __version__ = metadata.version('salt_pepper')
+    except metadata.PackageNotFoundError:
+        # package is not installed
+        __version__ = None
+else:
+    import pkg_resources
+    try:
+        __version__ = pkg_resources.get_distribution('salt_pepper').version
+    except pkg_resources.DistributionNotFound:
+        # package is not installed
+        __version__ = None
 
 # For backwards compatibility
 version = __version__
@@ -0,0 +1,528 @@
+'''
+An asyncio client for Salt's REST API
+
+:class:`AsyncPepper` mirrors :class:`pepper.libpepper.Pepper` with coroutines
+so a single event loop can drive many salt-api calls at once.
+
+'''
+import asyncio
+import collections
+import http.client
+import io
+import logging
+import time
+import urllib.parse as urlparse
+from urllib.error import HTTPError, URLError
+
+from pepper import codec
+from pepper.events import SSEDecoder, TagMatcher
+from pepper.exceptions import PepperException
+from pepper.libpepper import PepperBase
+from pepper.poll import Backoff
+from pepper.retry import RetryPolicy
+from pepper.transport import IDEMPOTENT_METHODS, create_ssl_context
+from pepper.websocket import READY, AsyncWebSocket, WebSocketClosed, decode_event
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncResponse(object):
+    '''
+    An HTTP response read from a pooled asyncio stream
+
+    The connection goes back to the pool once the body has been read to the
+    end; closing the response earlier drops the connection.
+    '''
+    def __init__(self, pool, key, reader, writer, status, reason, headers, keep_alive):
+        self._pool = pool
+        self._key = key
+        self._reader = reader
+        self._writer = writer
+        self._keep_alive = keep_alive
+        self._done = False
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+
+        self._chunked = 'chunked' in headers.get('Transfer-Encoding', '').lower()
+        self._remaining = None
+        if not self._chunked and headers.get('Content-Length') is not None:
+            self._remaining = int(headers['Content-Length'])
+            if not self._remaining:
+                self._finish()
+
+    async def read_chunk(self):
+        '''
+        Return the next piece of the body or ``b''`` once it is exhausted
+        '''
+        if self._done:
+            return b''
+        reader = self._reader
+        try:
+            if self._chunked:
+                size = int((await reader.readline()).split(b';')[0].strip(), 16)
+                if not size:
+                    # skip the trailers
+                    while (await reader.readline()).strip():
+                        pass
+                    self._finish()
+                    return b''
+                data = await reader.readexactly(size)
+                await reader.readexactly(2)
+                return data
+
+            if self._remaining is None:
+                # no framing; the body ends when the server closes the connection
+                data = await reader.read(65536)
+                if not data:
+                    self._keep_alive = False
+                    self._finish()
+                return data
+
+            data = await reader.read(min(65536, self._remaining))
+            if not data:
+                raise asyncio.IncompleteReadError(b'', self._remaining)
+            self._remaining -= len(data)
+            if not self._remaining:
+                self._finish()
+            return data
+        except BaseException:
+            self.close()
+            raise
+
+    async def read(self):
+        '''
+        Read the whole body
+        '''
+        chunks = []
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    async def __aiter__(self):
+        while True:
+            chunk = await self.read_chunk()
+            if not chunk:
+                return
+            yield chunk
+
+    def _finish(self):
+        self._done = True
+        if self._keep_alive:
+            self._pool._put_conn(self._key, self._reader, self._writer)
+        else:
+            self._writer.close()
+        self._pool._release()
+
+    def close(self):
+        if self._done:
+            return
+        self._done = True
+        self._writer.close()
+        self._pool._release()
+
+
+class AsyncConnectionPool(object):
+    '''
+    A pool of persistent HTTP/1.1 connections for asyncio
+
+    At most ``max_connections`` requests are in flight at once; further
+    requests wait for a free slot. Up to ``maxsize`` idle connections are kept
+    per ``(scheme, host, port)`` for ``idle_timeout`` seconds.
+    '''
+    def __init__(self, maxsize=10, idle_timeout=60, max_connections=100, timeout=None, ssl_context=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.ssl_context = ssl_context
+        self._idle = {}
+        self._semaphore = None
+
+    async def _open(self, key):
+        scheme, host, port = key
+        kwargs = {}
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = create_ssl_context()
+            kwargs['ssl'] = self.ssl_context
+            kwargs['server_hostname'] = host
+        return await asyncio.open_connection(host, port or (443 if scheme == 'https' else 80), **kwargs)
+
+    def _evict(self, now):
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0][2] >= self.idle_timeout:
+                idle.popleft()[1].close()
+            if not idle:
+                del self._idle[key]
+
+    def _get_conn(self, key):
+        self._evict(time.time())
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer, _ = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _put_conn(self, key, reader, writer):
+        now = time.time()
+        self._evict(now)
+        idle = self._idle.setdefault(key, collections.deque())
+        if len(idle) < self.maxsize:
+            idle.append((reader, writer, now))
+        else:
+            writer.close()
+
+    def _release(self):
+        self._semaphore.release()
+
+    async def _send(self, key, conn, method, selector, netloc, body, headers, sent):
+        reader, writer = conn
+        lines = ['{0} {1} HTTP/1.1'.format(method, selector), 'Host: {0}'.format(netloc)]
+        if body is not None:
+            headers.setdefault('Content-Length', str(len(body)))
+        lines.extend('{0}: {1}'.format(name, value) for name, value in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        if body is not None:
+            writer.write(body)
+        await writer.drain()
+        sent.append(True)
+
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionResetError('Connection closed by the server')
+            version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            raw_headers = []
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                raw_headers.append(line)
+            if int(status) != 100:
+                break
+        response_headers = http.client.parse_headers(io.BytesIO(b''.join(raw_headers)))
+        keep_alive = version == 'HTTP/1.1' and response_headers.get('Connection', '').lower() != 'close'
+        return AsyncResponse(self, key, reader, writer, int(status), reason, response_headers, keep_alive)
+
+    async def urlopen(self, method, url, body=None, headers=None, idempotent=None):
+        '''
+        Send a request over a pooled connection
+
+        Like :meth:`pepper.transport.ConnectionPool.urlopen`, a request which
+        failed after it was sent on a kept-alive connection is only sent again
+        if it is ``idempotent``, by default if its method is ``GET``, ``HEAD``
+        or ``OPTIONS``.
+
+        :rtype: :class:`AsyncResponse`
+        '''
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        split = urlparse.urlsplit(url)
+        key = (split.scheme, split.hostname, split.port)
+        selector = split.path or '/'
+        if split.query:
+            selector = '{0}?{1}'.format(selector, split.query)
+        headers = dict(headers or {})
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        await self._semaphore.acquire()
+        try:
+            conn = self._get_conn(key)
+            reused = conn is not None
+            if not reused:
+                conn = await asyncio.wait_for(self._open(key), self.timeout)
+            sent = []
+            try:
+                return await asyncio.wait_for(
+                    self._send(key, conn, method, selector, split.netloc, body, headers, sent), self.timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                conn[1].close()
+                if not reused or (sent and not idempotent):
+                    raise
+                logger.debug('Connection to %s was closed, sending the request again on a new one', split.netloc)
+                conn = await asyncio.wait_for(self._open(key), self.timeout)
+                try:
+                    return await asyncio.wait_for(
+                        self._send(key, conn, method, selector, split.netloc, body, headers, []), self.timeout)
+                except BaseException:
+                    conn[1].close()
+                    raise
+            except BaseException:
+                conn[1].close()
+                raise
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def close(self):
+        '''
+        Close all idle connections
+        '''
+        for idle in self._idle.values():
+            for _, writer, _ in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncPepper(PepperBase):
+    '''
+    An asyncio flavoured :class:`pepper.libpepper.Pepper`
+
+    >>> async def main():
+    ...     async with AsyncPepper('https://localhost:8000') as api:
+    ...         await api.login('saltdev', 'saltdev', 'pam')
+    ...         return await asyncio.gather(*[
+    ...             api.local(minion, 'test.ping', expr_form='list') for minion in minions
+    ...         ])
+    '''
+    def __init__(self, api_url='https://localhost:8000', debug_http=False, ignore_ssl_errors=False,
+                 pool_maxsize=10, pool_idle_timeout=60, max_connections=100):
+        '''
+        Initialize the class with the URL of the API
+
+        :param api_url: Host or IP address of the salt-api URL;
+            include the port number
+
+        :param debug_http: Log the HTTP responses
+
+        :param ignore_ssl_errors: Ignore invalid SSL certificates
+
+        :param pool_maxsize: Number of idle keep-alive connections kept open
+            per salt-api host
+
+        :param pool_idle_timeout: Seconds after which an idle keep-alive
+            connection is closed instead of being reused
+
+        :param max_connections: Maximum number of requests in flight at once
+
+        :raises PepperException: if the api_url is misformed
+
+        '''
+        super(AsyncPepper, self).__init__(api_url)
+        self.debug_http = int(debug_http)
+        # only decides which requests are safe to send twice
+        self._policy = RetryPolicy()
+        self._ssl_verify = not ignore_ssl_errors
+        self._pool = AsyncConnectionPool(
+            maxsize=pool_maxsize,
+            idle_timeout=pool_idle_timeout,
+            max_connections=max_connections,
+            ssl_context=create_ssl_context(self._ssl_verify),
+        )
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        '''
+        Close the keep-alive connections held by this instance
+        '''
+        self._pool.close()
+
+    async def req(self, path, data=None):
+        '''
+        Send a request to salt-api and return the decoded response
+
+        :rtype: dictionary
+        '''
+        if ((hasattr(data, 'get') and data.get('eauth') == 'kerberos')
+                or self.auth.get('eauth') == 'kerberos'):
+            raise PepperException('Kerberos authentication is not supported by AsyncPepper')
+
+        postdata = codec.dumps(data) if data is not None else None
+        url = self._construct_url(path)
+        method = 'POST' if postdata is not None else 'GET'
+
+        try:
+            try:
+                resp = await self._pool.urlopen(method, url, postdata, self._headers(path),
+                                                idempotent=self._policy.is_idempotent(method, path, data))
+                content = await resp.read()
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+                raise URLError(exc)
+            if resp.status >= 400:
+                raise HTTPError(url, resp.status, resp.reason, resp.headers, io.BytesIO(content))
+        except (HTTPError, URLError) as exc:
+            logger.debug('Error with request', exc_info=True)
+            status = getattr(exc, 'code', None)
+
+            if status == 401:
+                raise PepperException('Authentication denied')
+
+            if status == 500:
+                raise PepperException('Server error.')
+
+            logger.error('Error with request: {0}'.format(exc))
+            raise
+
+        if self.debug_http:
+            logger.debug('Response: %s', content.decode('utf-8'))
+        try:
+            ret = codec.loads(content)
+        except ValueError:
+            logger.debug('Error converting response from JSON', exc_info=True)
+            raise PepperException('Unable to parse the server response.')
+
+        if not self.salt_version and 'x-salt-version' in resp.headers:
+            self._parse_salt_version(resp.headers['x-salt-version'])
+
+        return ret
+
+    async def low(self, lowstate, path='/'):
+        '''
+        Execute a command through salt-api and return the response
+
+        :param string path: URL path to be joined with the API hostname
+
+        :param list lowstate: a list of lowstate dictionaries
+        '''
+        return await self.req(path, lowstate)
+
+    async def local(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
+                    timeout=None, ret=None):
+        '''
+        Run a single command using the ``local`` client
+        '''
+        return await self.low([self._local_low('local', tgt, fun, arg, kwarg, expr_form,
+                                               timeout=timeout, ret=ret)])
+
+    async def local_async(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
+                          timeout=None, ret=None):
+        '''
+        Run a single command using the ``local_async`` client
+        '''
+        return await self.low([self._local_low('local_async', tgt, fun, arg, kwarg, expr_form,
+                                               timeout=timeout, ret=ret)])
+
+    async def local_batch(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
+                          batch='50%', ret=None):
+        '''
+        Run a single command using the ``local_batch`` client
+        '''
+        return await self.low([self._local_low('local_batch', tgt, fun, arg, kwarg, expr_form,
+                                               batch=batch, ret=ret)])
+
+    async def lookup_jid(self, jid):
+        '''
+        Get job results
+        '''
+        return await self.runner('jobs.lookup_jid', jid='{0}'.format(jid))
+
+    async def runner(self, fun, arg=None, **kwargs):
+        '''
+        Run a single command using the ``runner`` client
+        '''
+        return await self.low([self._runner_low(fun, arg, kwargs)])
+
+    async def wheel(self, fun, arg=None, kwarg=None, **kwargs):
+        '''
+        Run a single command using the ``wheel`` client
+        '''
+        return await self.low([self._wheel_low(fun, arg, kwarg, kwargs)])
+
+    async def login(self, username=None, password=None, eauth=None, **kwargs):
+        '''
+        Authenticate with salt-api and return the user permissions and
+        authentication token or an empty dict
+        '''
+        kwargs = self._login_kwargs(username, password, eauth, kwargs)
+        self.auth = (await self.req('/login', kwargs)).get('return', [{}])[0]
+        return self.auth
+
+    async def token(self, **kwargs):
+        '''
+        Get an eauth token from Salt for use with the /run URL
+        '''
+        self.auth = (await self.req('/token', kwargs))[0]
+        return self.auth
+
+    async def events(self, tags=None):
+        '''
+        Iterate over the events from the salt-api ``/events`` stream
+
+        >>> async for event in api.events():
+        ...     print(event['tag'])
+
+        :param tags: ``fnmatch`` patterns of the tags of the events to
+            return; the other events are not decoded
+        '''
+        if not (self.auth and self.auth.get('token')):
+            raise PepperException('Authentication required')
+
+        resp = await self._pool.urlopen('GET', self._construct_url('/events'), None, self._headers('/events'))
+        try:
+            if resp.status == 401:
+                raise PepperException('Authentication denied')
+            if resp.status != 200:
+                raise PepperException('Unable to open the event stream: {0} {1}'.format(resp.status, resp.reason))
+            decoder = SSEDecoder(TagMatcher(tags) if tags is not None else None)
+            async for chunk in resp:
+                for event in decoder.feed(chunk):
+                    yield event
+        finally:
+            resp.close()
+
+    async def events_ws(self, tags=None, timeout=None, ping_interval=30, reconnect=True):
+        '''
+        Iterate over the events from the salt-api ``/ws`` WebSocket
+
+        The connection is opened again with backoff if it closes or does not
+        answer pings, see :meth:`pepper.libpepper.Pepper.events_ws`.
+
+        >>> async for event in api.events_ws(tags='salt/job/*/ret/*'):
+        ...     print(event['data']['id'])
+
+        :param tags: ``fnmatch`` patterns of the tags of the events to return
+        '''
+        matcher = TagMatcher(tags) if tags is not None else None
+        backoff = Backoff(initial=0.5, maximum=10)
+        ws = await self._open_ws(timeout, ping_interval)
+        try:
+            while True:
+                try:
+                    async for message in ws:
+                        event = decode_event(message)
+                        if not isinstance(event, dict):
+                            continue
+                        if matcher is None or matcher.match(event.get('tag', '')):
+                            yield event
+                    reason = 'salt-api closed the WebSocket'
+                except WebSocketClosed as exc:
+                    reason = str(exc)
+                ws.close()
+                if not reconnect:
+                    return
+                while True:
+                    delay = backoff.next()
+                    logger.warning('%s, connecting again in %.1fs', reason, delay)
+                    await asyncio.sleep(delay)
+                    try:
+                        ws = await self._open_ws(timeout, ping_interval)
+                        break
+                    except PepperException as exc:
+                        reason = str(exc)
+                backoff.reset()
+        finally:
+            ws.close()
+
+    async def _open_ws(self, timeout, ping_interval):
+        if not (self.auth and self.auth.get('token')):
+            raise PepperException('Authentication required')
+        ws = await AsyncWebSocket.connect(
+            self._construct_url('/ws'),
+            {'X-Auth-Token': self.auth['token']},
+            ssl_context=self._pool.ssl_context,
+            timeout=timeout,
+            ping_interval=ping_interval,
+        )
+        await ws.send(READY)
+        return ws
@@ -0,0 +1,134 @@
+'''
+Load balancing across several salt-api instances
+
+A :class:`Balancer` sends each request to the available instance with the
+fewest requests in flight. Instances are ejected while their
+:class:`~pepper.retry.CircuitBreaker` is open or their health check fails, and
+a background thread checks them again every few seconds so they are
+readmitted once they recover.
+
+'''
+import logging
+import threading
+
+from pepper.retry import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+class Endpoint(object):
+    '''
+    A salt-api instance and the requests in flight to it
+
+    :param url: the salt-api URL
+
+    :param breaker: the :class:`~pepper.retry.CircuitBreaker` of the instance
+    '''
+    def __init__(self, url, breaker):
+        self.url = url
+        self.breaker = breaker
+        #: the number of requests sent whose response is not finished yet
+        self.outstanding = 0
+        #: whether the last health check succeeded
+        self.healthy = True
+
+    @property
+    def available(self):
+        return self.healthy and self.breaker.state != CircuitBreaker.OPEN
+
+    def __repr__(self):
+        return '<Endpoint {0} outstanding={1} healthy={2}>'.format(self.url, self.outstanding, self.healthy)
+
+
+class Balancer(object):
+    '''
+    Route requests to the least busy available salt-api instance
+
+    Ties are broken in turn so that sequential requests are spread too. When
+    no instance is available, requests are routed as if all of them were, so
+    that their circuit breakers decide whether to fail fast.
+
+    .. code-block:: python
+
+        endpoint = balancer.acquire()
+        try:
+            send(endpoint.url)
+        finally:
+            balancer.release(endpoint)
+
+    :param endpoints: a list of :class:`Endpoint`
+
+    :param check: a callable taking an endpoint URL and returning whether the
+        instance is healthy, or None to not check the instances
+
+    :param interval: seconds between the health checks of all instances
+    '''
+    def __init__(self, endpoints, check=None, interval=10):
+        self.endpoints = endpoints
+        self.check = check
+        self.interval = interval
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def acquire(self, prefer=None):
+        '''
+        Return the endpoint the next request is sent to, and count the
+        request as in flight until :meth:`release` is called
+
+        :param prefer: the endpoint to use if it is available
+        '''
+        if self.check is not None and self._thread is None and len(self.endpoints) > 1:
+            self._start()
+        with self._lock:
+            if prefer is not None and prefer.available:
+                endpoint = prefer
+            else:
+                start, self._next = self._next, (self._next + 1) % len(self.endpoints)
+                rotated = self.endpoints[start:] + self.endpoints[:start]
+                candidates = [candidate for candidate in rotated if candidate.available] or rotated
+                endpoint = min(candidates, key=lambda candidate: candidate.outstanding)
+            endpoint.outstanding += 1
+        return endpoint
+
+    def release(self, endpoint):
+        with self._lock:
+            endpoint.outstanding -= 1
+
+    def check_health(self):
+        '''
+        Check every instance once, ejecting or readmitting them
+        '''
+        for endpoint in self.endpoints:
+            try:
+                healthy = self.check(endpoint.url)
+            except Exception as exc:
+                logger.debug('Health check of %s failed: %s', endpoint.url, exc)
+                healthy = False
+            if healthy != endpoint.healthy:
+                if healthy:
+                    logger.info('%s is healthy again', endpoint.url)
+                else:
+                    logger.warning('%s failed its health check, not sending requests to it', endpoint.url)
+            endpoint.healthy = healthy
+            if healthy and endpoint.breaker.state != CircuitBreaker.CLOSED:
+                endpoint.breaker.success()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='pepper-health-check')
+            self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.check_health()
+
+    def close(self):
+        '''
+        Stop checking the instances
+        '''
+        self._stop.set()
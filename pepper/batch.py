@@ -0,0 +1,169 @@
+'''
+Send many lowstates to salt-api in a single request
+
+salt-api runs every lowstate of the list POSTed to its root URL and answers
+with one ``return`` entry per lowstate. :class:`LowstateBatch` queues the
+calls made through it and sends them together, so a script making many small
+``runner`` or ``wheel`` calls pays for one round trip instead of one each.
+
+'''
+import logging
+import threading
+from concurrent.futures import Future
+
+from pepper import codec
+from pepper.exceptions import PepperException
+
+logger = logging.getLogger(__name__)
+
+
+class LowstateBatch(object):
+    '''
+    Queue lowstates and send them as one request
+
+    Every call returns a :class:`concurrent.futures.Future` resolving to the
+    entry of the ``return`` list for that lowstate once the batch was sent.
+    The queue is sent when the ``with`` block exits, when it holds
+    ``max_size`` lowstates or when adding a lowstate would make the request
+    body larger than ``max_bytes``.
+
+    .. code-block:: python
+
+        with api.batch() as batch:
+            keys = batch.wheel('key.list_all')
+            jobs = batch.runner('jobs.active')
+        print(keys.result(), jobs.result())
+
+    A failed request fails the futures of all the lowstates it carried. If the
+    ``with`` block raises, the lowstates still queued are not sent and their
+    futures are cancelled.
+
+    :param api: a logged in :class:`pepper.Pepper`
+
+    :param max_size: the most lowstates sent in one request
+
+    :param max_bytes: the largest request body, in bytes, unless a single
+        lowstate is larger
+
+    :param path: the URL the lowstates are sent to
+    '''
+    def __init__(self, api, max_size=100, max_bytes=1048576, path='/'):
+        self.api = api
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.path = path
+        self._lock = threading.Lock()
+        self._queue = []
+        self._bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.cancel()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, low):
+        '''
+        Queue a lowstate and return the future of its return entry
+        '''
+        future = Future()
+        # the lowstate and the comma or closing bracket after it
+        size = len(codec.dumps(low)) + 1
+        with self._lock:
+            # plus the opening bracket of the list
+            if self._queue and 1 + self._bytes + size > self.max_bytes:
+                self._flush()
+            self._queue.append((low, future))
+            self._bytes += size
+            if len(self._queue) >= self.max_size:
+                self._flush()
+        return future
+
+    def flush(self):
+        '''
+        Send the queued lowstates now
+        '''
+        with self._lock:
+            self._flush()
+
+    def cancel(self):
+        '''
+        Drop the queued lowstates, cancelling their futures
+        '''
+        with self._lock:
+            queue, self._queue, self._bytes = self._queue, [], 0
+        for _, future in queue:
+            future.cancel()
+
+    def _flush(self):
+        queue, self._queue, self._bytes = self._queue, [], 0
+        if not queue:
+            return
+        for _, future in queue:
+            future.set_running_or_notify_cancel()
+
+        logger.debug('Sending %s lowstates in one request', len(queue))
+        try:
+            ret = self.api.low([low for low, _ in queue], path=self.path)
+            entries = ret.get('return', []) if isinstance(ret, dict) else []
+        except Exception as exc:
+            for _, future in queue:
+                future.set_exception(exc)
+            return
+
+        for i, (_, future) in enumerate(queue):
+            if i < len(entries):
+                future.set_result(entries[i])
+            else:
+                future.set_exception(PepperException('salt-api sent no return for lowstate {0}'.format(i)))
+
+    def low(self, low):
+        '''
+        Queue a lowstate dictionary
+        '''
+        return self.submit(low)
+
+    def local(self, tgt, fun, arg=None, kwarg=None, expr_form='glob', timeout=None, ret=None):
+        '''
+        Queue a command for the ``local`` client
+        '''
+        return self.submit(self.api._local_low('local', tgt, fun, arg, kwarg, expr_form,
+                                               timeout=timeout, ret=ret))
+
+    def local_async(self, tgt, fun, arg=None, kwarg=None, expr_form='glob', timeout=None, ret=None):
+        '''
+        Queue a command for the ``local_async`` client
+        '''
+        return self.submit(self.api._local_low('local_async', tgt, fun, arg, kwarg, expr_form,
+                                               timeout=timeout, ret=ret))
+
+    def local_batch(self, tgt, fun, arg=None, kwarg=None, expr_form='glob', batch='50%', ret=None):
+        '''
+        Queue a command for the ``local_batch`` client
+        '''
+        return self.submit(self.api._local_low('local_batch', tgt, fun, arg, kwarg, expr_form,
+                                               batch=batch, ret=ret))
+
+    def runner(self, fun, arg=None, **kwargs):
+        '''
+        Queue a command for the ``runner`` client
+        '''
+        return self.submit(self.api._runner_low(fun, arg, kwargs))
+
+    def wheel(self, fun, arg=None, kwarg=None, **kwargs):
+        '''
+        Queue a command for the ``wheel`` client
+        '''
+        return self.submit(self.api._wheel_low(fun, arg, kwarg, kwargs))
+
+    def lookup_jid(self, jid):
+        '''
+        Queue a job results lookup
+        '''
+        return self.runner('jobs.lookup_jid', jid='{0}'.format(jid))
@@ -14,6 +14,11 @@ import time
 
 # Import Pepper Libraries
 import pepper
+from pepper import codec
+from pepper.libpepper import JobTracker
+from pepper.poll import Backoff, quorum_size
+from pepper.retcode import RetcodeEvaluator
+from pepper.rolling import RollingBatch
 from pepper.exceptions import (
     PepperAuthException,
     PepperArgumentsException,
@@ -47,8 +52,9 @@ logger = logging.getLogger(__name__)
 
 
 class PepperCli(object):
-    def __init__(self, seconds_to_wait=3):
+    def __init__(self, seconds_to_wait=3, argv=None):
         self.seconds_to_wait = seconds_to_wait
+        self.argv = argv
         self.parser = self.get_parser()
         self.parser.option_groups.extend([
             self.add_globalopts(),
@@ -104,7 +110,9 @@ class PepperCli(object):
         self.parser.add_option(
             '-o', '--out', dest='output', default=None,
             help=textwrap.dedent('''
-                Salt outputter to use for printing out returns.
+                Salt outputter to use for printing out returns. ``ndjson``
+                prints every minion return as a JSON document on a line of
+                its own, as soon as it arrives.
             ''')
         )
 
@@ -115,6 +123,44 @@ class PepperCli(object):
             ''')
         )
 
+        self.parser.add_option(
+            '--output-file-replace', dest='output_file_append', action='store_false', default=True,
+            help=textwrap.dedent('''
+                Replace the output file once the command finished instead of
+                appending to it; the previous content stays in place until
+                then.
+            ''')
+        )
+
+        self.parser.add_option(
+            '--output-file-gzip', dest='output_file_gzip', action='store_true', default=False,
+            help=textwrap.dedent('''
+                Compress the output file with gzip.
+            ''')
+        )
+
+        self.parser.add_option(
+            '--output-file-flush', dest='output_file_flush', default=None,
+            help=textwrap.dedent('''
+                When to write the buffered output to the output file: "line"
+                after every line, or a number of buffered bytes. Default: 65536
+            ''')
+        )
+
+        self.parser.add_option(
+            '--outputter-cache', dest='outputter_cache',
+            default=os.environ.get(
+                'PEPPEROUTPUTTERS',
+                os.path.join(os.path.expanduser('~'), '.cache', 'pepper', 'outputters.json')
+            ),
+            help=textwrap.dedent('''
+                Location of the index of the outputters declared by Salt
+                execution modules. It is rebuilt when Salt or the modules
+                change. Default is a file path in the "PEPPEROUTPUTTERS"
+                environment variable or ~/.cache/pepper/outputters.json.
+            ''')
+        )
+
         self.parser.add_option(
             '-v', dest='verbose', default=0, action='count',
             help=textwrap.dedent('''
@@ -129,6 +175,81 @@ class PepperCli(object):
             '''),
         )
 
+        self.parser.add_option(
+            '--daemon', dest='daemon', default=False, action='store_true',
+            help=textwrap.dedent('''
+                Run a resident pepper daemon for this user. It keeps the salt-api
+                session, its connections and the Salt outputters warm, and
+                later pepper commands are forwarded to it over a Unix socket.
+            ''')
+        )
+
+        self.parser.add_option(
+            '--no-daemon', dest='no_daemon', default=False, action='store_true',
+            help=textwrap.dedent('''
+                Do not forward the command to a running pepper daemon
+            ''')
+        )
+
+        self.parser.add_option(
+            '--daemon-socket', dest='daemon_socket',
+            default=os.environ.get(
+                'PEPPERSOCKET',
+                os.path.join(
+                    os.environ.get('XDG_RUNTIME_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'pepper'),
+                    'pepper.sock',
+                )
+            ),
+            help=textwrap.dedent('''
+                Unix socket of the pepper daemon. Default is a file path in the
+                "PEPPERSOCKET" environment variable or pepper.sock in
+                $XDG_RUNTIME_DIR or ~/.cache/pepper.
+            ''')
+        )
+
+        self.parser.add_option(
+            '--daemon-idle-timeout', dest='daemon_idle_timeout', default=600, type='int',
+            help=textwrap.dedent('''
+                Seconds without commands after which the pepper daemon exits.
+                Default: 600
+            ''')
+        )
+
+        self.parser.add_option(
+            '--gzip-requests', dest='gzip_requests', default=None, type='int', metavar='BYTES',
+            help=textwrap.dedent('''
+                Compress the commands sent to salt-api with gzip when they
+                are larger than BYTES. salt-api does not decompress requests
+                itself; only use this behind a proxy which does.
+            '''),
+        )
+
+        self.parser.add_option(
+            '--ca-bundle', dest='ca_bundle', default=None,
+            help=textwrap.dedent('''
+                File or directory of the CA certificates to verify the salt-api
+                certificate against. Also SALTAPI_CA_BUNDLE in the
+                configuration file.
+            '''),
+        )
+
+        self.parser.add_option(
+            '--client-cert', dest='client_cert', default=None,
+            help=textwrap.dedent('''
+                PEM file of the client certificate presented to salt-api,
+                including its key unless --client-key is given. Also
+                SALTAPI_CLIENT_CERT in the configuration file.
+            '''),
+        )
+
+        self.parser.add_option(
+            '--client-key', dest='client_key', default=None,
+            help=textwrap.dedent('''
+                PEM file of the key of the client certificate. Also
+                SALTAPI_CLIENT_KEY in the configuration file.
+            '''),
+        )
+
         self.parser.add_option(
             '--ignore-ssl-errors', action='store_true', dest='ignore_ssl_certificate_errors', default=False,
             help=textwrap.dedent('''
@@ -137,13 +258,33 @@ class PepperCli(object):
             '''),
         )
 
-        self.options, self.args = self.parser.parse_args()
+        self.parser.add_option(
+            '--retries', dest='retries', default=3, type='int',
+            help=textwrap.dedent('''
+                Number of times a request which failed because salt-api was
+                unreachable or unavailable is sent again. Commands which may
+                change the minions are only sent again if salt-api did not
+                receive them. Default: 3
+            '''),
+        )
+
+        self.options, self.args = self.parser.parse_args(self.argv)
 
         option_names = ["fail_any", "fail_any_none", "fail_all", "fail_all_none"]
         toggled_options = [name for name in option_names if getattr(self.options, name)]
         if len(toggled_options) > 1:
             s = repr(toggled_options).strip("[]")
             self.parser.error("Options %s are mutually exclusive" % s)
+        flush = self.options.output_file_flush
+        if flush is not None and flush != 'line':
+            try:
+                self.options.output_file_flush = int(flush)
+            except ValueError:
+                self.parser.error('Option --output-file-flush must be "line" or a number of bytes')
+        if self.options.kill_on_fail:
+            self.options.fail_fast = True
+        if self.options.fail_fast and not (self.options.fail_any or self.options.fail_any_none):
+            self.parser.error("Option --fail-fast requires --fail-any or --fail-any-none")
 
     def add_globalopts(self):
         '''
@@ -188,7 +329,35 @@ class PepperCli(object):
             help=textwrap.dedent('''
                 Return a failure exit code if not all minions respond. This option
                 requires the authenticated user have access to run the
-                `jobs.list_jobs` runner function.
+                `jobs.list_job` runner function.
+            '''),
+        )
+
+        optgroup.add_option(
+            '--quorum', dest='quorum', default=None,
+            help=textwrap.dedent('''
+                Stop waiting for returns once this many of the targeted
+                minions, or this percentage of them such as 90%, returned. The
+                minions which did not return are listed as Stragglers.
+            '''),
+        )
+
+        optgroup.add_option(
+            '--stall-timeout', dest='stall_timeout', type='float', default=None,
+            help=textwrap.dedent('''
+                Stop waiting for returns when no minion returned for this many
+                seconds. The minions which did not return are listed as
+                Stragglers.
+            '''),
+        )
+
+        optgroup.add_option(
+            '--event-returns', action='store_true', dest='event_returns', default=False,
+            help=textwrap.dedent('''
+                Run the command with the local_async client and wait for the
+                returns on the salt-api event stream instead of polling the job
+                cache. Falls back to polling if the event stream is not
+                available.
             '''),
         )
 
@@ -247,7 +416,23 @@ class PepperCli(object):
             help="Target based on a named nodegroup",
         )
 
-        optgroup.add_option('--batch', dest='batch', default=None)
+        optgroup.add_option(
+            '--batch', dest='batch', default=None,
+            help=textwrap.dedent('''
+                Run the command on this many minions at a time, a number or a
+                percentage such as 10%. With the local client pepper keeps the
+                window full itself and prints returns as they arrive; use
+                --client=local_batch to have salt-api run the batches.
+            '''),
+        )
+
+        optgroup.add_option(
+            '--batch-max-failures', dest='batch_max_failures', default=None, type='int',
+            help=textwrap.dedent('''
+                Stop starting the command on more minions once more than this
+                many minions returned a non-zero retcode or did not return.
+            '''),
+        )
 
         return optgroup
 
@@ -266,7 +451,21 @@ class PepperCli(object):
 
         optgroup.add_option(
             '-u', '--saltapi-url', dest='saltapiurl',
-            help="Specify the host url.  Defaults to https://localhost:8080"
+            help=textwrap.dedent('''
+                Specify the host url.  Defaults to https://localhost:8080
+                A comma separated list of urls spreads the requests over
+                several salt-api instances.
+            '''),
+        )
+
+        optgroup.add_option(
+            '--token-affinity', dest='token_affinity', action='store_true', default=None,
+            help=textwrap.dedent('''
+                Send all requests to the salt-api instance which issued the
+                token while it is available, for salt-api instances which do
+                not share their tokens. Also SALTAPI_TOKEN_AFFINITY=true in
+                the configuration file.
+            '''),
         )
 
         optgroup.add_option(
@@ -362,6 +561,28 @@ class PepperCli(object):
             '--fail-all-none', dest='fail_all_none', action='store_true',
             help="Fail if all retcode fields are non zero or there is no retcode at all.")
 
+        optgroup.add_option(
+            '--summary', dest='summary', action='store_true', default=False,
+            help=textwrap.dedent('''
+                Print how many minions returned each retcode and which minions
+                failed or returned no retcode after the returns.
+            '''))
+
+        optgroup.add_option(
+            '--fail-fast', dest='fail_fast', action='store_true', default=False,
+            help=textwrap.dedent('''
+                With --fail-any or --fail-any-none, stop waiting for returns
+                and exit as soon as a minion returns a non-zero retcode. The
+                job keeps running on the other minions.
+            '''))
+
+        optgroup.add_option(
+            '--kill-on-fail', dest='kill_on_fail', action='store_true', default=False,
+            help=textwrap.dedent('''
+                Like --fail-fast, and also kill the job on the targeted
+                minions with saltutil.kill_job.
+            '''))
+
         return optgroup
 
     def get_login_details(self):
@@ -451,6 +672,60 @@ class PepperCli(object):
 
         return url
 
+    def parse_token_affinity(self):
+        '''
+        Determine whether requests stick to the salt-api instance which
+        issued the token
+        '''
+        if self.options.token_affinity is not None:
+            return self.options.token_affinity
+        value = self._config_value('SALTAPI_TOKEN_AFFINITY') or 'false'
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+    def parse_tls(self):
+        '''
+        Determine the CA bundle and client certificate used for HTTPS
+        '''
+        tls = {}
+        for key, option in (('ca_bundle', 'SALTAPI_CA_BUNDLE'),
+                            ('client_cert', 'SALTAPI_CLIENT_CERT'),
+                            ('client_key', 'SALTAPI_CLIENT_KEY')):
+            value = getattr(self.options, key) or self._config_value(option)
+            tls[key] = os.path.abspath(os.path.expanduser(value)) if value else None
+        return tls
+
+    def _config_value(self, key):
+        '''
+        Read a setting from the environment or the profile of the config file
+        '''
+        if key in os.environ:
+            return os.environ[key]
+
+        try:
+            config = ConfigParser(interpolation=None)
+        except TypeError:
+            config = RawConfigParser()
+        config.read(self.options.config)
+
+        profile = self.options.profile
+        if config.has_section(profile) and config.has_option(profile, key):
+            return config.get(profile, key)
+        return None
+
+    def client_options(self):
+        '''
+        Return the keyword arguments of the :class:`pepper.Pepper` client
+        '''
+        options = {
+            'debug_http': self.options.debug_http,
+            'ignore_ssl_errors': self.options.ignore_ssl_certificate_errors,
+            'retry': self.options.retries,
+            'token_affinity': self.parse_token_affinity(),
+            'gzip_threshold': self.options.gzip_requests,
+        }
+        options.update(self.parse_tls())
+        return options
+
     def parse_login(self):
         '''
         Extract the authentication credentials
@@ -493,7 +768,9 @@ class PepperCli(object):
 
         args = list(self.args)
 
-        client = self.options.client if not self.options.batch else 'local_batch'
+        client = self.options.client
+        if self.options.batch and client != 'local':
+            client = 'local_batch'
         low = {'client': client}
 
         if client.startswith('local'):
@@ -561,83 +838,198 @@ class PepperCli(object):
         async_ret = self.low(api, load)
         jid = async_ret['return'][0]['jid']
         nodes = async_ret['return'][0]['minions']
-        ret_nodes = []
-        exit_code = 1
 
-        # keep trying until all expected nodes return
-        total_time = 0
-        start_time = time.time()
-        exit_code = 0
-        while True:
-            total_time = time.time() - start_time
-            if total_time > self.options.timeout:
-                exit_code = 1
-                break
+        for exit_code, ret in self._poll_returns(api, jid, nodes, [], time.time()):
+            yield exit_code, ret
 
-            jid_ret = self.low(api, [{
-                'client': 'runner',
-                'fun': 'jobs.lookup_jid',
-                'kwarg': {
-                    'jid': jid,
-                },
-            }])
+    def _poll_returns(self, api, jid, nodes, ret_nodes, start_time):
+        '''
+        Poll the job cache until all expected nodes returned, the timeout
+        expires or the ``--quorum`` or ``--stall-timeout`` conditions are met;
+        nodes in ``ret_nodes`` are known to have returned already.
 
-            inner_ret = jid_ret['return'][0]
-            # sometimes ret is nested in data
-            if 'data' in inner_ret:
-                inner_ret = inner_ret['data']
+        The job cache is polled quickly at first, then less and less often up
+        to every ``seconds_to_wait`` seconds. Returns are yielded in the
+        ``full_return`` format, with their retcode.
+        '''
+        tracker = JobTracker(api, low=lambda load: self.low(api, load))
+        backoff = Backoff(maximum=self.seconds_to_wait)
+        quorum = quorum_size(self.options.quorum, len(nodes)) if self.options.quorum else None
+        ret_nodes = set(ret_nodes)
+        last_return = time.time()
+        early_exit = timed_out = False
 
-            responded = set(inner_ret.keys()) ^ set(ret_nodes)
+        # keep trying until all expected nodes return
+        while True:
+            inner_ret = tracker.lookup([jid])[jid]
+            responded = set(inner_ret.keys()) - ret_nodes
 
             for node in responded:
                 yield None, [{node: inner_ret[node]}]
-            ret_nodes = list(inner_ret.keys())
+            ret_nodes.update(inner_ret.keys())
+
+            now = time.time()
+            if responded:
+                last_return = now
 
-            if set(ret_nodes) == set(nodes):
-                exit_code = 0
+            if ret_nodes >= set(nodes):
+                break
+            if quorum is not None and len(ret_nodes & set(nodes)) >= quorum:
+                logger.info('%s of %s minions returned, not waiting for the others', quorum, len(nodes))
+                early_exit = True
+                break
+            if self.options.stall_timeout and now - last_return > self.options.stall_timeout:
+                logger.info('No minion returned for %s seconds, not waiting for the others',
+                            self.options.stall_timeout)
+                early_exit = timed_out = True
                 break
-            else:
-                time.sleep(self.seconds_to_wait)
 
-        exit_code = exit_code if self.options.fail_if_minions_dont_respond else 0
-        failed = list(set(ret_nodes) ^ set(nodes))
+            remaining = self.options.timeout - (now - start_time)
+            if remaining <= 0:
+                timed_out = True
+                break
+            time.sleep(min(backoff.next(), remaining))
+
+        exit_code = 1 if timed_out and self.options.fail_if_minions_dont_respond else 0
+        if early_exit:
+            stragglers = sorted(set(nodes) - ret_nodes)
+            if stragglers:
+                yield exit_code, [{'Stragglers': stragglers}]
+            return
+        failed = list(ret_nodes ^ set(nodes))
         if failed:
             yield exit_code, [{'Failed': failed}]
 
-    def login(self, api):
-        login = api.token if self.options.userun else api.login
+    def event_returns(self, api, load):
+        '''
+        Run a command with the local_async client and collect the returns from
+        the ``salt/job/<jid>/ret/<minion>`` events as they arrive.
+
+        Falls back to polling the job cache if the event stream can not be
+        opened or breaks before the timeout.
+        '''
+        start_time = time.time()
+        try:
+            events = api.events(timeout=self.options.timeout)
+        except Exception as exc:
+            logger.info('Event stream not available, polling for returns: %s', exc)
+            for exit_code, ret in self.poll_for_returns(api, load):
+                yield exit_code, ret
+            return
+
+        try:
+            load[0]['client'] = 'local_async'
+            async_ret = self.low(api, load)
+            jid = async_ret['return'][0]['jid']
+            nodes = async_ret['return'][0]['minions']
+            tag_prefix = 'salt/job/{0}/ret/'.format(jid)
+            ret_nodes = []
+            quorum = quorum_size(self.options.quorum, len(nodes)) if self.options.quorum else None
+            quorum_met = False
 
-        if self.options.mktoken:
-            token_file = self.options.cache
             try:
-                with open(token_file, 'rt') as f:
-                    auth = json.load(f)
-                if auth['expire'] < time.time()+30:
-                    logger.error('Login token expired')
-                    raise Exception('Login token expired')
-            except Exception as e:
-                if e.args[0] != 2:
-                    logger.error('Unable to load login token from {0} {1}'.format(token_file, str(e)))
-                    if os.path.isfile(token_file):
-                        os.remove(token_file)
-                auth = login(**self.parse_login())
-                try:
-                    oldumask = os.umask(0)
-                    fdsc = os.open(token_file, os.O_WRONLY | os.O_CREAT, 0o600)
-                    with os.fdopen(fdsc, 'wt') as f:
-                        json.dump(auth, f)
-                except Exception as e:
-                    logger.error('Unable to save token to {0} {1}'.format(token_file, str(e)))
-                finally:
-                    os.umask(oldumask)
-        else:
-            auth = login(**self.parse_login())
+                for event in events:
+                    tag = event.get('tag', '')
+                    node = tag[len(tag_prefix):] if tag.startswith(tag_prefix) else None
+                    if node and node not in ret_nodes:
+                        ret_nodes.append(node)
+                        data = event.get('data', {})
+                        ret = {'ret': data.get('return'), 'retcode': data.get('retcode'), 'jid': jid}
+                        if 'out' in data:
+                            ret['out'] = data['out']
+                        yield None, [{node: ret}]
+                        if set(ret_nodes) >= set(nodes):
+                            break
+                        if quorum is not None and len(set(ret_nodes) & set(nodes)) >= quorum:
+                            quorum_met = True
+                            break
+                    if time.time() - start_time > self.options.timeout:
+                        break
+            except Exception as exc:
+                if time.time() - start_time < self.options.timeout:
+                    logger.info('Event stream interrupted, polling for returns: %s', exc)
+                    for exit_code, ret in self._poll_returns(api, jid, nodes, ret_nodes, start_time):
+                        yield exit_code, ret
+                    return
+        finally:
+            events.close()
+
+        missing = list(set(nodes) - set(ret_nodes))
+        if missing and quorum_met:
+            yield 0, [{'Stragglers': sorted(missing)}]
+        elif missing:
+            yield 1 if self.options.fail_if_minions_dont_respond else 0, [{'Failed': missing}]
+
+    def batch_returns(self, api, load):
+        '''
+        Run a command on a rolling window of minions with the local_async
+        client and yield the returns as they arrive
+        '''
+        low = load[0]
+        batch = RollingBatch(
+            api, low['tgt'], low['fun'],
+            arg=low.get('arg'),
+            kwarg=low.get('kwarg'),
+            tgt_type=low.get('tgt_type', 'glob'),
+            size=self.options.batch,
+            max_failures=self.options.batch_max_failures,
+            timeout=self.options.timeout,
+            poll_interval=self.seconds_to_wait,
+            low=lambda load: self.low(api, load),
+        )
+        for node, ret in batch:
+            yield None, [{node: ret}]
+
+        exit_code = 0
+        if batch.aborted or (batch.missing and self.options.fail_if_minions_dont_respond):
+            exit_code = 1
+        summary = {}
+        if batch.missing:
+            summary['Failed'] = batch.missing
+        if batch.not_run:
+            summary['Not run'] = batch.not_run
+        if summary or exit_code:
+            yield exit_code, [summary]
 
+    def login(self, api):
+        '''
+        Authenticate ``api``, sharing the token through the cache file when
+        ``--make-token`` is set
+
+        The :class:`~pepper.libpepper.TokenManager` attached to ``api`` keeps
+        the token valid for as long as the client is used.
+        '''
+        manager = api.token_manager
+        if manager is None:
+            manager = pepper.TokenManager(
+                api,
+                self.parse_login,
+                cache=self.options.cache if self.options.mktoken else None,
+                userun=self.options.userun)
+
+        auth = manager.get()
         api.auth = auth
         self.auth = auth
         return auth
 
     def low(self, api, load):
+        path = self._prepare_low(api, load)
+        return api.low(load, path=path)
+
+    def stream_low(self, api, load):
+        '''
+        Run a command and yield its returns one minion at a time, as they are
+        read from the response
+        '''
+        path = self._prepare_low(api, load)
+        for minion, ret in api.iter_low(load, path=path):
+            yield None, [{minion: ret} if minion is not None else ret]
+
+    def _prepare_low(self, api, load):
+        '''
+        Add the token and timeout to the lowstates and return the URL path
+        they are sent to
+        '''
         path = '/run' if self.options.userun else '/'
 
         if self.options.userun:
@@ -651,34 +1043,91 @@ class PepperCli(object):
                 if not i.get('client', '').startswith('wheel'):
                     i['timeout'] = self.options.timeout
 
-        return api.low(load, path=path)
+        return path
 
-    def run(self):
+    def run(self, serialize=True):
         '''
         Parse all arguments and call salt-api
+
+        Yields ``(exit_code, result)`` pairs; ``exit_code`` is None for
+        intermediate results. With ``serialize`` the results are pretty printed
+        JSON strings, otherwise the decoded responses are yielded as they are so
+        the caller only has to serialize them once, in the output format it
+        needs.
         '''
         # set up logging
         rootLogger = logging.getLogger(name=None)
         rootLogger.addHandler(logging.StreamHandler())
         rootLogger.setLevel(max(logging.ERROR - (self.options.verbose * 10), 1))
 
-        api = pepper.Pepper(
-            self.parse_url(),
-            debug_http=self.options.debug_http,
-            ignore_ssl_errors=self.options.ignore_ssl_certificate_errors)
+        api = pepper.Pepper(self.parse_url(), **self.client_options())
 
         self.login(api)
 
+        for exit_code, ret in self.execute(api):
+            yield exit_code, codec.dumps_pretty(ret) if serialize else ret
+
+    def execute(self, api):
+        '''
+        Run the command with an authenticated client and yield the decoded
+        ``(exit_code, result)`` pairs
+        '''
         load = self.parse_cmd(api)
 
         for entry in load:
             if not entry.get('client', '').startswith('wheel'):
                 entry['full_return'] = True
 
-        if self.options.fail_if_minions_dont_respond:
-            for exit_code, ret in self.poll_for_returns(api, load):  # pragma: no cover
-                yield exit_code, json.dumps(ret, sort_keys=True, indent=4)
+        if self.options.batch and load[0].get('client') == 'local' and len(load) == 1:
+            results = self.batch_returns(api, load)
+        elif self.options.event_returns:
+            results = self.event_returns(api, load)
+        elif (self.options.fail_if_minions_dont_respond or self.options.quorum or self.options.stall_timeout
+              or (self.options.fail_fast and load[0].get('client') == 'local' and len(load) == 1)):
+            results = self.poll_for_returns(api, load)
+        elif self.options.output == 'ndjson':
+            results = self.stream_low(api, load)
         else:
-            ret = self.low(api, load)
-            exit_code = 0
-            yield exit_code, json.dumps(ret, sort_keys=True, indent=4)
+            results = [(0, self.low(api, load))]
+
+        if self.options.fail_fast:
+            results = self.fail_fast(api, load, results)
+
+        for exit_code, ret in results:
+            yield exit_code, ret
+
+    def fail_fast(self, api, load, results):
+        '''
+        Pass results through until a minion returns a non-zero retcode, then
+        stop waiting for the others and, with ``--kill-on-fail``, kill the job
+        '''
+        evaluator = RetcodeEvaluator.from_options(self.options)
+        for exit_code, ret in results:
+            yield exit_code, ret
+            if exit_code is not None:
+                return
+            retcode = evaluator.feed(ret)
+            if retcode is not None:
+                break
+        else:
+            return
+
+        # stop polling or reading the event stream
+        getattr(results, 'close', lambda: None)()
+        minion, retcode, jid = evaluator.failed
+        logger.error('%s returned retcode %s, not waiting for the other minions', minion, retcode)
+        aborted = {'jid': jid, 'minion': minion, 'retcode': retcode, 'killed': False}
+        if self.options.kill_on_fail and jid:
+            low = load[0]
+            try:
+                self.low(api, [{
+                    'client': 'local_async',
+                    'tgt': low['tgt'],
+                    'tgt_type': low.get('tgt_type', 'glob'),
+                    'fun': 'saltutil.kill_job',
+                    'arg': [jid],
+                }])
+                aborted['killed'] = True
+            except PepperException as exc:
+                logger.error('Unable to kill job %s: %s', jid, exc)
+        yield retcode, [{'Aborted': aborted}]
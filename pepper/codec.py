@@ -0,0 +1,219 @@
+'''
+JSON encoding and decoding for requests, responses and CLI output
+
+orjson or ujson are used when installed, the standard library ``json`` module
+otherwise. The ``PEPPER_JSON`` environment variable (``orjson``, ``ujson`` or
+``json``) or :func:`set_backend` pick a backend explicitly.
+
+All backends decode straight from ``bytes`` and :func:`dumps` returns
+``bytes`` ready to be sent, so no intermediate ``str`` copy is made on the
+request path.
+
+'''
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# all backends raise a subclass of ValueError on invalid documents
+JSONDecodeError = ValueError
+
+_INDENT = re.compile(r'^( +)', re.MULTILINE)
+
+# every digit is turned into 0 and whitespace and signs are dropped, so a
+# number of 20 digits or more, which may not fit in 64 bits, is found by a
+# substring search after a separator; quoted jids are not matched
+_DIGITS = (bytes.maketrans(b'123456789', b'000000000'), b' \t\r\n-')
+_DIGITS_STR = (str.maketrans('123456789', '000000000', ' \t\r\n-'),)
+_BIG_INT = b'0' * 20
+_BIG_INTS = tuple(sep + _BIG_INT for sep in (b':', b',', b'['))
+_BIG_INT_STR = _BIG_INT.decode('ascii')
+_BIG_INTS_STR = tuple(big.decode('ascii') for big in _BIG_INTS)
+
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+
+def _has_big_int(data):
+    '''
+    Whether a JSON document may hold an integer beyond 64 bits
+    '''
+    if isinstance(data, str):
+        data, big, bigs = data.translate(*_DIGITS_STR), _BIG_INT_STR, _BIG_INTS_STR
+    else:
+        data, big, bigs = data.translate(*_DIGITS), _BIG_INT, _BIG_INTS
+    return data.startswith(big) or any(sep in data for sep in bigs)
+
+
+class StdlibCodec(object):
+    '''
+    The standard library ``json`` module
+    '''
+    name = 'json'
+
+    @staticmethod
+    def loads(data):
+        return json.loads(data)
+
+    @staticmethod
+    def dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+    @staticmethod
+    def dumps_pretty(obj):
+        return json.dumps(obj, sort_keys=True, indent=4)
+
+
+class UJSONCodec(object):
+    '''
+    The ``ujson`` module
+
+    Integers too large for ujson are handed to the standard library.
+    '''
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self._ujson = ujson
+
+    def loads(self, data):
+        return self._ujson.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return self._ujson.dumps(obj, escape_forward_slashes=False).encode('utf-8')
+        except OverflowError:
+            return StdlibCodec.dumps(obj)
+
+    def dumps_pretty(self, obj):
+        try:
+            return self._ujson.dumps(obj, sort_keys=True, indent=4, escape_forward_slashes=False)
+        except OverflowError:
+            return StdlibCodec.dumps_pretty(obj)
+
+
+class OrjsonCodec(object):
+    '''
+    The ``orjson`` module
+
+    Documents orjson refuses to encode, such as integers beyond 64 bits,
+    are handed to the standard library instead. So are documents it would
+    decode lossily or not at all: integers beyond 64 bits, which orjson
+    turns into floats, and ``NaN`` or ``Infinity``.
+    '''
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        self._orjson = orjson
+        self._pretty = orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS
+
+    def loads(self, data):
+        if _has_big_int(data):
+            return StdlibCodec.loads(data)
+        try:
+            return self._orjson.loads(data)
+        except self._orjson.JSONDecodeError:
+            return StdlibCodec.loads(data)
+
+    def dumps(self, obj):
+        try:
+            return self._orjson.dumps(obj, option=self._orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            return StdlibCodec.dumps(obj)
+
+    def dumps_pretty(self, obj):
+        try:
+            text = self._orjson.dumps(obj, option=self._pretty).decode('utf-8')
+        except TypeError:
+            return StdlibCodec.dumps_pretty(obj)
+        # orjson only indents by two spaces; JSON strings never span lines so
+        # all leading whitespace is indentation
+        text = _INDENT.sub(lambda match: match.group(1) * 2, text)
+        # orjson writes UTF-8 where the other backends write \\u escapes
+        if not text.isascii():
+            text = _NON_ASCII.sub(lambda match: json.dumps(match.group())[1:-1], text)
+        return text
+
+
+BACKENDS = (
+    ('orjson', OrjsonCodec),
+    ('ujson', UJSONCodec),
+    ('json', StdlibCodec),
+)
+
+_backend = None
+
+
+def get_backend():
+    '''
+    Return the codec in use
+    '''
+    return _backend
+
+
+def set_backend(name=None):
+    '''
+    Select the JSON backend by name, or the fastest installed one
+
+    :raises ImportError: if the requested backend is not installed
+    '''
+    global _backend
+    backends = dict(BACKENDS)
+    if name is not None:
+        if name not in backends:
+            raise ImportError('Unknown JSON backend: {0}'.format(name))
+        _backend = backends[name]()
+        return _backend
+
+    for name, backend in BACKENDS:
+        try:
+            _backend = backend()
+            break
+        except ImportError:
+            continue
+    logger.debug('Using the %s JSON backend', _backend.name)
+    return _backend
+
+
+def available_backends():
+    '''
+    Return the names of the installed backends
+    '''
+    names = []
+    for name, backend in BACKENDS:
+        try:
+            backend()
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+def loads(data):
+    '''
+    Decode a JSON document from ``bytes`` or ``str``
+    '''
+    return _backend.loads(data)
+
+
+def dumps(obj):
+    '''
+    Encode an object to compact JSON ``bytes``
+    '''
+    return _backend.dumps(obj)
+
+
+def dumps_pretty(obj):
+    '''
+    Encode an object to a sorted JSON ``str`` indented by four spaces
+    '''
+    return _backend.dumps_pretty(obj)
+
+
+try:
+    set_backend(os.environ.get('PEPPER_JSON') or None)
+except ImportError as exc:
+    logger.warning('%s; falling back to the default JSON backend', exc)
+    set_backend()
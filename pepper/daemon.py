@@ -0,0 +1,388 @@
+'''
+A resident pepper process serving CLI invocations over a Unix socket
+
+``pepper --daemon`` keeps the authenticated salt-api sessions, their pooled
+connections and the Salt outputter configuration loaded. When its socket
+exists the ``pepper`` script forwards the parsed command line to the daemon
+instead of logging in and loading the outputters itself, so a command costs a
+single round trip to salt-api.
+
+Messages are newline delimited JSON documents. The client sends one request::
+
+    {"version": "...", "url": "...", "login": {...}, "options": {...}, "args": [...], "tty": false}
+
+and the daemon answers with any number of ``{"out": text}`` and
+``{"err": text}`` messages followed by ``{"exit": code}``. An ``exit`` of
+``null`` asks the client to run the command itself.
+
+'''
+import errno
+import logging
+import optparse
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+
+import pepper
+from pepper import codec
+from pepper.cli import PepperCli
+from pepper.exceptions import PepperException
+from pepper.outputters import OutputterIndex
+
+logger = logging.getLogger(__name__)
+
+# options holding paths; they are made absolute before they are forwarded
+PATH_OPTIONS = ('config', 'cache', 'master', 'output_file', 'outputter_cache', 'json_file')
+
+
+def _is_listening(path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        sock.close()
+
+
+def _peer_uid(sock):
+    '''
+    Return the uid of the process on the other end of a Unix socket, or None
+    if the platform can not tell
+    '''
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', creds)[1]
+
+
+class ForwardedCli(PepperCli):
+    '''
+    A PepperCli for a command line the client has parsed already
+
+    The url and the login details are resolved by the client too, since they
+    depend on its environment and may have been prompted for.
+    '''
+    def __init__(self, request):
+        self.request = request
+        super(ForwardedCli, self).__init__(argv=[])
+        self.options = optparse.Values(request['options'])
+        self.args = list(request['args'])
+
+    def parse_url(self):
+        return self.request['url']
+
+    def parse_token_affinity(self):
+        return self.request.get('token_affinity', False)
+
+    def parse_tls(self):
+        return dict(self.request.get('tls', {}))
+
+    def parse_login(self):
+        return dict(self.request['login'])
+
+
+class _Stream(object):
+    '''
+    A text file object sending everything written to it to the client
+    '''
+    def __init__(self, wfile, name, lock):
+        self._wfile = wfile
+        self._name = name
+        self._lock = lock
+
+    def write(self, text):
+        if text:
+            _send(self._wfile, self._lock, {self._name: text})
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def isatty(self):
+        return False
+
+
+def _send(wfile, lock, message):
+    with lock:
+        wfile.write(codec.dumps(message) + b'\n')
+        wfile.flush()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        daemon = self.server.pepper_daemon
+        daemon.enter()
+        try:
+            daemon.handle(codec.loads(line), self.wfile)
+        except (IOError, OSError) as exc:
+            logger.debug('Client went away: %s', exc)
+        finally:
+            daemon.leave()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def verify_request(self, request, client_address):
+        uid = _peer_uid(request)
+        if uid is not None and uid != os.getuid():
+            logger.warning('Refusing a connection from uid %s', uid)
+            return False
+        return True
+
+
+class PepperDaemon(object):
+    '''
+    Serve forwarded pepper commands until no command arrived for
+    ``idle_timeout`` seconds
+
+    :param path: the Unix socket to listen on; its directory is created
+        readable by the current user only
+
+    :param idle_timeout: seconds without commands after which the daemon exits
+    '''
+    def __init__(self, path, idle_timeout=600):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._login_locks = {}
+        self._salt_opts = {}
+        self._outputters = {}
+        self._lock = threading.Lock()
+        self._active = 0
+        self._last_active = time.time()
+        self._stopped = threading.Event()
+        self._server = None
+
+    def bind(self):
+        '''
+        Create the listening socket, replacing a stale one
+        '''
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        if os.path.exists(self.path):
+            if _is_listening(self.path):
+                raise PepperException('A pepper daemon is already listening on {0}'.format(self.path))
+            os.remove(self.path)
+
+        oldumask = os.umask(0o077)
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(oldumask)
+        self._server.pepper_daemon = self
+
+    def serve_forever(self):
+        '''
+        Serve until the idle timeout expires; returns the exit code
+        '''
+        if self._server is None:
+            self.bind()
+        logger.info('pepper daemon listening on %s', self.path)
+        watchdog = threading.Thread(target=self._watch)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            self._server.serve_forever(poll_interval=0.5)
+        finally:
+            self._stopped.set()
+            self.close()
+        return 0
+
+    def shutdown(self):
+        '''
+        Stop serving; may be called from any thread but the serving one
+        '''
+        self._stopped.set()
+        self._server.shutdown()
+
+    def close(self):
+        self._server.server_close()
+        try:
+            os.remove(self.path)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        with self._lock:
+            sessions, self._sessions = self._sessions, {}
+        for api in sessions.values():
+            api.close()
+
+    def _watch(self):
+        while not self._stopped.wait(min(1.0, self.idle_timeout)):
+            with self._lock:
+                idle = self._active == 0 and time.time() - self._last_active > self.idle_timeout
+            if idle:
+                logger.info('pepper daemon idle for %s seconds, exiting', self.idle_timeout)
+                self._server.shutdown()
+                return
+
+    def enter(self):
+        with self._lock:
+            self._active += 1
+
+    def leave(self):
+        with self._lock:
+            self._active -= 1
+            self._last_active = time.time()
+
+    def session(self, cli):
+        '''
+        Return the logged in client for the url and credentials of a command
+
+        The token manager of the client refreshes its token before it expires.
+        Concurrent commands only wait for a login to the same session.
+        '''
+        client_options = cli.client_options()
+        key = codec.dumps([
+            cli.parse_url(),
+            sorted(cli.parse_login().items()),
+            cli.options.userun,
+            sorted(client_options.items()),
+        ])
+        with self._lock:
+            login_lock = self._login_locks.setdefault(key, threading.Lock())
+        with login_lock:
+            with self._lock:
+                api = self._sessions.get(key)
+            if api is None:
+                api = pepper.Pepper(cli.parse_url(), **client_options)
+            cli.login(api)
+            with self._lock:
+                self._sessions[key] = api
+        return key, api
+
+    def execute(self, cli):
+        '''
+        Run a command with the cached session and yield its results
+        '''
+        key, api = self.session(cli)
+        try:
+            for exit_code, ret in cli.execute(api):
+                yield exit_code, ret
+        except PepperException:
+            # the token may have been revoked; log in again next time
+            with self._lock:
+                evicted = self._sessions.pop(key, None)
+            if evicted is not None:
+                evicted.close()
+            raise
+
+    def salt_opts(self, cli, stdout, tty):
+        '''
+        Return a copy of the cached Salt client configuration which prints to
+        the client
+        '''
+        from pepper import script
+        if not script.HAS_SALT:
+            return {}
+        with self._lock:
+            if cli.options.master not in self._salt_opts:
+                import salt.config
+                import salt.output  # noqa: F401
+                self._salt_opts[cli.options.master] = salt.config.client_config(cli.options.master)
+            opts = dict(self._salt_opts[cli.options.master])
+        # script.Pepper replaces it with its sink for --output-file
+        opts['output_file'] = stdout
+        if tty and opts.get('color', True) and not opts.get('no_color'):
+            # the Salt outputters only color output for a terminal
+            opts['force_color'] = True
+        return opts
+
+    def outputter_index(self, cli, opts):
+        key = (cli.options.outputter_cache, cli.options.master)
+        with self._lock:
+            if key not in self._outputters:
+                self._outputters[key] = OutputterIndex(cli.options.outputter_cache, opts)
+            return self._outputters[key]
+
+    def handle(self, request, wfile):
+        '''
+        Run a forwarded command, sending its output to the client
+        '''
+        from pepper import script
+
+        lock = threading.Lock()
+        if request.get('version') != pepper.__version__:
+            logger.info('Client version %s differs from the daemon', request.get('version'))
+            _send(wfile, lock, {'exit': None})
+            return
+
+        stdout = _Stream(wfile, 'out', lock)
+        stderr = _Stream(wfile, 'err', lock)
+        cli = ForwardedCli(request)
+        opts = self.salt_opts(cli, stdout, request.get('tty'))
+        output = script.Pepper(cli, opts=opts, stdout=stdout, stderr=stderr)
+        output.outputters = self.outputter_index(cli, opts)
+        exit_code = output.render(self.execute(cli))
+        _send(wfile, lock, {'exit': exit_code or 0})
+
+
+class DaemonClient(object):
+    '''
+    Forward commands to a running pepper daemon
+    '''
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        '''
+        Return a socket connected to the daemon, None if it is not running
+        '''
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+        except (IOError, OSError) as exc:
+            logger.debug('pepper daemon not available at %s: %s', self.path, exc)
+            sock.close()
+            return None
+        return sock
+
+    def run(self, cli, stdout, stderr):
+        '''
+        Run the command of ``cli`` in the daemon and copy its output
+
+        :return: the exit code, or None if the command has to run locally
+        '''
+        sock = self.connect()
+        if sock is None:
+            return None
+
+        options = dict(vars(cli.options))
+        for name in PATH_OPTIONS:
+            if options.get(name):
+                options[name] = os.path.abspath(os.path.expanduser(options[name]))
+        isatty = getattr(stdout, 'isatty', None)
+        request = {
+            'version': pepper.__version__,
+            'url': cli.parse_url(),
+            'token_affinity': cli.parse_token_affinity(),
+            'tls': cli.parse_tls(),
+            'login': cli.parse_login(),
+            'options': options,
+            'args': cli.args,
+            'tty': bool(isatty and isatty()),
+        }
+
+        with sock:
+            sock.sendall(codec.dumps(request) + b'\n')
+            with sock.makefile('rb') as rfile:
+                for line in rfile:
+                    message = codec.loads(line)
+                    if 'out' in message:
+                        stdout.write(message['out'])
+                    elif 'err' in message:
+                        stderr.write(message['err'])
+                    elif 'exit' in message:
+                        stdout.flush()
+                        return message['exit']
+        raise PepperException('The pepper daemon closed the connection')
@@ -0,0 +1,191 @@
+'''
+Helpers for the salt-api ``/events`` stream
+
+salt-api sends the Salt event bus as server-sent events; every event is a
+``tag:`` line followed by a ``data:`` line holding the JSON encoded event::
+
+    tag: salt/job/20180414193904158892/new
+    data: {"tag": "salt/job/20180414193904158892/new", "data": {...}}
+
+'''
+import fnmatch
+import itertools
+import logging
+import re
+
+from pepper import codec
+
+logger = logging.getLogger(__name__)
+
+
+class TagMatcher(object):
+    '''
+    Match event tags against ``fnmatch`` patterns compiled once
+
+    The patterns are combined in a single regular expression, which matches
+    ``bytes`` tags too so that the tag of an event can be checked before its
+    data is decoded.
+
+    >>> matcher = TagMatcher(['salt/job/*/ret/*', 'salt/auth'])
+    >>> matcher.match('salt/job/20180414193904158892/ret/ms-0')
+    True
+    >>> matcher.match(b'salt/job/20180414193904158892/new')
+    False
+
+    :param patterns: a pattern or a list of them
+    '''
+    def __init__(self, patterns):
+        if isinstance(patterns, (str, bytes)):
+            patterns = [patterns]
+        self.patterns = [
+            pattern.decode('utf-8') if isinstance(pattern, bytes) else pattern for pattern in patterns]
+        # a regular expression which never matches when there is no pattern
+        regex = '|'.join(fnmatch.translate(pattern) for pattern in self.patterns) or '(?!)'
+        self._match = re.compile(regex).match
+        if regex.isascii():
+            #: the ``match`` method of the compiled regular expression for
+            #: ``bytes`` tags, returning a match object or None; it takes
+            #: ``pos`` to match the tag at the end of a line
+            self.match_bytes = re.compile(regex.encode('ascii')).match
+        else:
+            # character classes of non-ASCII patterns do not work on UTF-8
+            self.match_bytes = self._match_decoded
+
+    def _match_decoded(self, tag, pos=0):
+        return self._match(tag[pos:].decode('utf-8', 'replace'))
+
+    def match(self, tag):
+        '''
+        Return whether a ``str`` or ``bytes`` tag matches one of the patterns
+        '''
+        if isinstance(tag, bytes):
+            return self.match_bytes(tag) is not None
+        return self._match(tag) is not None
+
+    def __repr__(self):
+        return '<TagMatcher {0}>'.format(self.patterns)
+
+
+class SSEDecoder(object):
+    '''
+    Incrementally decode a ``text/event-stream`` into Salt events
+
+    Chunks may be split anywhere, including in the middle of a line or of a
+    multi-byte character. The stream is split into events on the raw bytes,
+    and the data of an event is only decoded if its ``tag:`` line passes the
+    matcher.
+
+    >>> decoder = SSEDecoder()
+    >>> decoder.feed(b'tag: salt/auth\\ndata: {"tag": "salt/auth", "da')
+    []
+    >>> decoder.feed(b'ta": {}}\\n\\n')
+    [{'tag': 'salt/auth', 'data': {}}]
+
+    :param matcher: a :class:`TagMatcher` the events must pass, None for
+        every event
+    '''
+    def __init__(self, matcher=None):
+        self.matcher = matcher
+        # the chunks of the incomplete event, only joined once it is complete
+        self._pending = []
+        self._cr = False
+        #: the number of events left out by the matcher
+        self.skipped = 0
+
+    def feed(self, chunk):
+        '''
+        Feed a chunk of the stream and return the events it completed
+
+        :param chunk: bytes or str
+        '''
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if self._cr:
+            chunk = b'\r' + chunk
+            self._cr = False
+        if b'\r' in chunk:
+            # keep a final \r until the next chunk tells if a \n follows
+            if chunk.endswith(b'\r'):
+                chunk = chunk[:-1]
+                self._cr = True
+            chunk = chunk.replace(b'\r\n', b'\n')
+        pending = self._pending
+        # only the end of the previous chunk can hold part of a boundary
+        if b'\n\n' not in chunk and not (
+                pending and chunk.startswith(b'\n') and pending[-1].endswith(b'\n')):
+            if chunk:
+                pending.append(chunk)
+            return []
+        if pending:
+            pending.append(chunk)
+            buf = b''.join(pending)
+        else:
+            buf = chunk
+        end = buf.rfind(b'\n\n')
+        rest = buf[end + 2:]
+        self._pending = [rest] if rest else []
+
+        loads = codec.get_backend().loads
+        match = self.matcher.match_bytes if self.matcher is not None else None
+        events = []
+        lines = iter(buf[:end].split(b'\n'))
+        for line in lines:
+            if not line:
+                continue
+            block = [line]
+            if line.startswith(b'tag: '):
+                # salt-api sends a tag line and a single data line; the tag
+                # is matched in place and only the data of the events which
+                # pass is decoded
+                data = next(lines, b'')
+                following = next(lines, b'') if data else b''
+                if not following and data.startswith(b'data: '):
+                    if match is not None and match(line, 5) is None:
+                        self.skipped += 1
+                        continue
+                    try:
+                        events.append(loads(data[6:]))
+                    except ValueError:
+                        logger.debug('Unable to decode event data: %s', data)
+                    continue
+                if data:
+                    block.append(data)
+                if following:
+                    block.append(following)
+                    block.extend(itertools.takewhile(bool, lines))
+            else:
+                block.extend(itertools.takewhile(bool, lines))
+            event = self._dispatch(block)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _dispatch(self, lines):
+        '''
+        Decode an event with other fields or several data lines
+        '''
+        tag = None
+        data = []
+        for line in lines:
+            if line.startswith(b'data:'):
+                data.append(line[6:] if line.startswith(b'data: ') else line[5:])
+            elif line.startswith(b'tag:'):
+                tag = line[5:] if line.startswith(b'tag: ') else line[4:]
+        if not data:
+            return None
+        matcher = self.matcher
+        if matcher is not None and tag is not None and not matcher.match(tag):
+            self.skipped += 1
+            return None
+
+        data = data[0] if len(data) == 1 else b'\n'.join(data)
+        try:
+            event = codec.loads(data)
+        except ValueError:
+            logger.debug('Unable to decode event data: %s', data)
+            return None
+        if matcher is not None and tag is None and not matcher.match(
+                event.get('tag', '') if isinstance(event, dict) else ''):
+            self.skipped += 1
+            return None
+        return event
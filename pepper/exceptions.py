@@ -11,3 +11,7 @@ class PepperArgumentsException(Exception):
 
 class PepperException(Exception):
     pass
+
+
+class PepperCircuitOpenException(PepperException):
+    pass
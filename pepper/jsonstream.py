@@ -0,0 +1,174 @@
+'''
+Incremental decoding of salt-api responses
+
+A ``local`` call against many minions answers with one large document::
+
+    {"return": [{"minion1": ..., "minion2": ..., ...}]}
+
+:func:`iter_return_items` walks that document while it is read from the
+socket and yields the minion returns one at a time, so only a single return
+has to be held in memory.
+
+'''
+import codecs
+import json
+import re
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStream(object):
+    '''
+    A text buffer over a binary file object which is refilled on demand
+    '''
+    def __init__(self, fp, chunk_size):
+        self._fp = fp
+        self._read1 = getattr(fp, 'read1', None)
+        self._chunk_size = chunk_size
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        '''
+        Drop the consumed part of the buffer and read more data
+
+        Whatever has arrived is returned right away as long as little data is
+        pending, so returns are yielded as soon as they are received. The read
+        size grows with the pending data so that decoding a large value is
+        retried a logarithmic number of times.
+        '''
+        if self._eof:
+            return False
+        pending = self._buf[self._pos:]
+        if self._read1 is not None and len(pending) < self._chunk_size:
+            data = self._read1(self._chunk_size)
+        else:
+            data = self._fp.read(max(self._chunk_size, len(pending)))
+        if not data:
+            self._eof = True
+        self._buf = pending + self._decoder.decode(data or b'', final=self._eof)
+        self._pos = 0
+        return True
+
+    def finish(self):
+        '''
+        Read what remains of the stream, such as the end of a chunked body, so
+        an HTTP connection can be reused
+        '''
+        if not self._eof:
+            self._fp.read()
+            self._eof = True
+
+    def peek(self):
+        '''
+        Return the next non-whitespace character without consuming it;
+        an empty string at the end of the stream
+        '''
+        while True:
+            self._pos = _WHITESPACE.match(self._buf, self._pos).end()
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        '''
+        Consume the next character, which must be one of ``chars``
+        '''
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError('Expected one of {0!r} at {1!r}'.format(
+                chars, self._buf[self._pos:self._pos + 20]))
+        self._pos += 1
+        return char
+
+    def value(self):
+        '''
+        Decode the next complete JSON value
+        '''
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self._buf, self._pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self._buf) or self._eof or type(obj) not in (int, float):
+                    self._pos = end
+                    return obj
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+
+def _iter_entry(stream):
+    if stream.peek() != '{':
+        yield None, stream.value()
+        return
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.expect('}')
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        yield key, stream.value()
+        if stream.expect(',}') == '}':
+            return
+
+
+def _iter_list(stream):
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.expect(']')
+        return
+    while True:
+        for item in _iter_entry(stream):
+            yield item
+        if stream.expect(',]') == ']':
+            return
+
+
+def iter_return_items(fp, chunk_size=65536):
+    '''
+    Incrementally decode a salt-api response and yield ``(key, value)`` pairs
+
+    Every dictionary in the ``return`` list is unfolded into its items, which
+    for the ``local`` clients are ``(minion_id, return)`` pairs. Entries of the
+    list which are not dictionaries are yielded as ``(None, entry)``.
+
+    >>> import io
+    >>> list(iter_return_items(io.BytesIO(b'{"return": [{"ms-0": true, "ms-1": true}]}')))
+    [('ms-0', True), ('ms-1', True)]
+
+    :param fp: a binary file-like object with a ``read(size)`` method
+
+    :param chunk_size: the number of bytes to read at once
+
+    :raises ValueError: if the response is not valid JSON
+    '''
+    stream = _JSONStream(fp, chunk_size)
+    if stream.peek() == '[':
+        # /token answers with a bare list
+        for item in _iter_list(stream):
+            yield item
+        stream.finish()
+        return
+
+    stream.expect('{')
+    if stream.peek() == '}':
+        stream.finish()
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if key == 'return' and stream.peek() == '[':
+            for item in _iter_list(stream):
+                yield item
+        else:
+            stream.value()
+        if stream.expect(',}') == '}':
+            stream.finish()
+            return
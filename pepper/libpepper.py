@@ -4,12 +4,29 @@ A Python library for working with Salt's REST API
 (Specifically the rest_cherrypy netapi module.)
 
 '''
-import json
+import collections
+import contextlib
+import errno
+import functools
+import gzip
+import io
+import itertools
 import logging
+import os
 import re
+import socket
 import ssl
+import threading
+import time
 
+from pepper import codec
+from pepper.balancer import Balancer, Endpoint
+from pepper.batch import LowstateBatch
+from pepper.events import SSEDecoder, TagMatcher
 from pepper.exceptions import PepperException
+from pepper.jsonstream import iter_return_items
+from pepper.retry import BREAKER_STATUSES, CircuitBreaker, RetryPolicy
+from pepper.transport import ConnectionPool, TransferStats, create_ssl_context
 
 try:
     ssl._create_default_https_context = ssl._create_stdlib_context
@@ -17,19 +34,197 @@ except Exception:
     pass
 
 try:
-    from urllib.request import HTTPHandler, HTTPSHandler, Request, urlopen, \
-        install_opener, build_opener
     from urllib.error import HTTPError, URLError
     import urllib.parse as urlparse
 except ImportError:
-    from urllib2 import HTTPHandler, HTTPSHandler, Request, urlopen, install_opener, build_opener, \
-        HTTPError, URLError
+    from urllib2 import HTTPError, URLError
     import urlparse
 
+try:
+    import http.client as httplib
+except ImportError:
+    import httplib
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import fcntl
+except ImportError:
+    # no locking between processes on Windows
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+# seconds to wait for a salt-api instance to answer its health check
+HEALTH_CHECK_TIMEOUT = 5
 
-class Pepper(object):
+
+class PepperBase(object):
+    '''
+    The transport independent parts of the salt-api clients
+
+    Builds lowstate dictionaries, URLs and parses the salt-api version for
+    :class:`Pepper` and :class:`pepper.aio.AsyncPepper`.
+    '''
+    def __init__(self, api_url='https://localhost:8000'):
+        '''
+        :param api_url: the salt-api URL, or a list or comma separated string
+            of the URLs of several salt-api instances
+
+        :raises PepperException: if the api_url is misformed
+        '''
+        if isinstance(api_url, (list, tuple)):
+            api_urls = list(api_url)
+        else:
+            api_urls = [url for url in re.split(r'[\s,]+', api_url) if url]
+        if not api_urls:
+            raise PepperException('salt-api URL missing')
+        for url in api_urls:
+            split = urlparse.urlsplit(url)
+            if split.scheme not in ['http', 'https']:
+                raise PepperException("salt-api URL missing HTTP(s) protocol: {0}"
+                                      .format(url))
+
+        #: the URLs of the salt-api instances
+        self.api_urls = api_urls
+        self.api_url = api_urls[0]
+        self.auth = {}
+        self.salt_version = None
+
+    def _headers(self, path=None):
+        '''
+        Return the request headers, including the session token if there is one
+
+        The ``/run`` URL takes the token in the lowstate instead.
+        '''
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest',
+        }
+        if path != '/run' and self.auth and 'token' in self.auth and self.auth['token']:
+            headers['X-Auth-Token'] = self.auth['token']
+        return headers
+
+    @staticmethod
+    def _local_low(client, tgt, fun, arg=None, kwarg=None, expr_form='glob',
+                   timeout=None, batch=None, ret=None):
+        '''
+        Build the lowstate for the ``local`` family of clients
+        '''
+        low = {
+            'client': client,
+            'tgt': tgt,
+            'fun': fun,
+        }
+
+        if arg:
+            low['arg'] = arg
+
+        if kwarg:
+            low['kwarg'] = kwarg
+
+        if expr_form:
+            low['expr_form'] = expr_form
+
+        if timeout:
+            low['timeout'] = timeout
+
+        if batch:
+            low['batch'] = batch
+
+        if ret:
+            low['ret'] = ret
+
+        return low
+
+    @staticmethod
+    def _runner_low(fun, arg=None, kwargs=None):
+        '''
+        Build the lowstate for the ``runner`` client
+        '''
+        low = {
+            'client': 'runner',
+            'fun': fun,
+        }
+        if arg:
+            low['arg'] = arg
+
+        low.update(kwargs or {})
+
+        return low
+
+    @staticmethod
+    def _wheel_low(fun, arg=None, kwarg=None, kwargs=None):
+        '''
+        Build the lowstate for the ``wheel`` client
+        '''
+        low = {
+            'client': 'wheel',
+            'fun': fun,
+        }
+
+        if arg:
+            low['arg'] = arg
+        if kwarg:
+            low['kwarg'] = kwarg
+
+        low.update(kwargs or {})
+
+        return low
+
+    @staticmethod
+    def _login_kwargs(username, password, eauth, kwargs):
+        '''
+        Merge the credentials which were given into the /login payload
+        '''
+        local = {'username': username, 'password': password, 'eauth': eauth}
+        kwargs.update(
+            dict(
+                (key, local[key]) for key in (
+                    'username',
+                    'password',
+                    'eauth'
+                ) if local.get(key, None) is not None
+            )
+        )
+        return kwargs
+
+    def _construct_url(self, path, base=None):
+        '''
+        Construct the url to salt-api for the given path
+
+        Args:
+            path: the path to the salt-api resource
+            base: the salt-api URL, ``api_url`` by default
+
+        >>> api = Pepper('https://localhost:8000/salt-api/')
+        >>> api._construct_url('/login')
+        'https://localhost:8000/salt-api/login'
+        '''
+
+        relative_path = path.lstrip('/')
+        return urlparse.urljoin(base or self.api_url, relative_path)
+
+    def _parse_salt_version(self, version):
+        # borrow from salt.version
+        git_describe_regex = re.compile(
+            r'(?:[^\d]+)?(?P<major>[\d]{1,4})'
+            r'\.(?P<minor>[\d]{1,2})'
+            r'(?:\.(?P<bugfix>[\d]{0,2}))?'
+            r'(?:\.(?P<mbugfix>[\d]{0,2}))?'
+            r'(?:(?P<pre_type>rc|a|b|alpha|beta|nb)(?P<pre_num>[\d]{1}))?'
+            r'(?:(?:.*)-(?P<noc>(?:[\d]+|n/a))-(?P<sha>[a-z0-9]{8}))?'
+        )
+        match = git_describe_regex.match(version)
+        if match:
+            self.salt_version = match.groups()
+
+
+class Pepper(PepperBase):
     '''
     A thin wrapper for making HTTP calls to the salt-api rest_cherrpy REST
     interface
@@ -57,32 +252,238 @@ class Pepper(object):
               u'ms-4': True}]}
 
     '''
-    def __init__(self, api_url='https://localhost:8000', debug_http=False, ignore_ssl_errors=False):
+    def __init__(self, api_url='https://localhost:8000', debug_http=False, ignore_ssl_errors=False,
+                 pool_maxsize=10, pool_idle_timeout=60, retry=None, breaker_threshold=5, breaker_timeout=30,
+                 token_affinity=False, health_interval=10, ca_bundle=None, client_cert=None, client_key=None,
+                 gzip_threshold=None, on_transfer=None):
         '''
         Initialize the class with the URL of the API
 
         :param api_url: Host or IP address of the salt-api URL;
-            include the port number
+            include the port number. A list or a comma separated string of
+            URLs spreads the requests over several salt-api instances; see
+            :class:`pepper.balancer.Balancer`
+
+        :param debug_http: Output the HTTP exchange
+
+        :param ignore_ssl_errors: Ignore invalid SSL certificates
+
+        :param pool_maxsize: Number of idle keep-alive connections kept open
+            per salt-api host
+
+        :param pool_idle_timeout: Seconds after which an idle keep-alive
+            connection is closed instead of being reused
+
+        :param retry: the :class:`pepper.retry.RetryPolicy` of failed
+            requests, or the number of retries of the default policy; 0
+            disables retries
+
+        :param breaker_threshold: Number of consecutive failures after which
+            requests to a salt-api host fail fast, 0 to never fail fast
+
+        :param breaker_timeout: Seconds to fail fast for before trying the
+            salt-api host again
+
+        :param token_affinity: Send all requests to the salt-api instance
+            which issued the token, while it is available. Needed when the
+            instances do not share their tokens, such as with several
+            masters which keep their own tokens
+
+        :param health_interval: Seconds between the health checks of the
+            salt-api instances, when there are several of them
+
+        :param ca_bundle: File or directory of the CA certificates to verify
+            the salt-api certificate against
+
+        :param client_cert: PEM file of the client certificate presented to
+            salt-api, including its key unless ``client_key`` is given
 
-        :param debug_http: Add a flag to urllib2 to output the HTTP exchange
+        :param client_key: PEM file of the key of ``client_cert``
 
-        :param ignore_ssl_errors: Add a flag to urllib2 to ignore invalid SSL certificates
+        :param gzip_threshold: Compress request bodies larger than this many
+            bytes with gzip; salt-api itself does not decompress them, so
+            only set this behind a proxy which does
+
+        :param on_transfer: Called with the
+            :class:`pepper.transport.TransferStats` of every request once its
+            response was read
 
         :raises PepperException: if the api_url is misformed
 
         '''
-        split = urlparse.urlsplit(api_url)
-        if split.scheme not in ['http', 'https']:
-            raise PepperException("salt-api URL missing HTTP(s) protocol: {0}"
-                                  .format(api_url))
-
-        self.api_url = api_url
+        super(Pepper, self).__init__(api_url)
         self.debug_http = int(debug_http)
         self._ssl_verify = not ignore_ssl_errors
-        self.auth = {}
-        self.salt_version = None
+        # built once, all connections share it and its TLS session cache
+        ssl_context = create_ssl_context(self._ssl_verify, ca_bundle, client_cert, client_key)
+        # the requests paths always verify the certificate unless told not to
+        if ignore_ssl_errors or ca_bundle:
+            session_ssl_context = ssl_context
+        elif client_cert:
+            session_ssl_context = ssl.create_default_context()
+            session_ssl_context.load_cert_chain(client_cert, client_key)
+        else:
+            session_ssl_context = None
+        self._pool = ConnectionPool(
+            maxsize=pool_maxsize,
+            idle_timeout=pool_idle_timeout,
+            debuglevel=self.debug_http,
+            ssl_context=ssl_context,
+            session_ssl_context=session_ssl_context,
+        )
+        #: the :class:`TokenManager` keeping ``auth`` valid, if any
+        self.token_manager = None
+        if retry is None:
+            retry = RetryPolicy()
+        elif isinstance(retry, int):
+            retry = RetryPolicy(retries=retry)
+        self.retry = retry
+        self.gzip_threshold = gzip_threshold
+        self.on_transfer = on_transfer
+        self.breaker_threshold = breaker_threshold
+        self.breaker_timeout = breaker_timeout
+        self._breakers = {}
+        self.token_affinity = token_affinity
+        # the instance which issued the token, with token_affinity
+        self._pinned = None
+        self._health_pool = ConnectionPool(maxsize=1, timeout=HEALTH_CHECK_TIMEOUT, ssl_context=ssl_context)
+        self.balancer = Balancer(
+            [Endpoint(url, self.breaker(url)) for url in self.api_urls],
+            check=self._check_health,
+            interval=health_interval,
+        )
+
+    def close(self):
+        '''
+        Close the keep-alive connections held by this instance
+        '''
+        if self.token_manager is not None:
+            self.token_manager.close()
+        self.balancer.close()
+        self._pool.close()
+        self._health_pool.close()
+
+    def breaker(self, url):
+        '''
+        Return the :class:`pepper.retry.CircuitBreaker` of the salt-api host
+        serving a URL
+        '''
+        split = urlparse.urlsplit(url)
+        endpoint = '{0}://{1}'.format(split.scheme, split.netloc)
+        breaker = self._breakers.get(endpoint)
+        if breaker is None:
+            breaker = self._breakers.setdefault(
+                endpoint, CircuitBreaker(endpoint, self.breaker_threshold, self.breaker_timeout))
+        return breaker
+
+    def _transferred(self, stats):
+        logger.debug('%s', stats)
+        if self.on_transfer is not None:
+            self.on_transfer(stats)
+
+    def _check_health(self, url):
+        '''
+        Return whether a salt-api instance answers its index page
+        '''
+        with self._health_pool.urlopen('GET', url, headers={'Accept': 'application/json'}) as resp:
+            resp.read()
+            return resp.status < 500
+
+    def _retrying(self, path, idempotent, send, errors):
+        '''
+        Call ``send`` with the URL of ``path`` on a salt-api instance until
+        the retry policy accepts its response
+
+        ``send`` returns a ``(response, status, headers)`` tuple; the responses
+        which are retried are closed. Once the policy gives up, the last
+        response is returned whatever its status, or the last error raised.
+
+        Returns the response and the :class:`pepper.balancer.Endpoint` it came
+        from, which the caller releases once it is done with the response.
+
+        :raises PepperCircuitOpenException: if the host is failing
+        '''
+        backoff = self.retry.backoff()
+        for attempt in itertools.count():
+            endpoint = self.balancer.acquire(prefer=self._pinned)
+            url = self._construct_url(path, endpoint.url)
+            try:
+                endpoint.breaker.before_request()
+            except Exception:
+                self.balancer.release(endpoint)
+                raise
+            try:
+                resp, status, headers = send(url)
+            except errors as exc:
+                self.balancer.release(endpoint)
+                endpoint.breaker.failure()
+                if not self.retry.should_retry(attempt, idempotent, error=exc):
+                    raise
+                delay = self.retry.delay(backoff)
+                reason = exc
+            except Exception:
+                self.balancer.release(endpoint)
+                # the breaker must hear back from a probe, or it never lets
+                # another request through
+                endpoint.breaker.failure()
+                raise
+            else:
+                if status in BREAKER_STATUSES:
+                    endpoint.breaker.failure()
+                else:
+                    endpoint.breaker.success()
+                if not self.retry.should_retry(attempt, idempotent, status=status):
+                    return resp, endpoint
+                delay = self.retry.delay(backoff, headers)
+                if delay is None:
+                    return resp, endpoint
+                resp.close()
+                self.balancer.release(endpoint)
+                reason = 'HTTP {0}'.format(status)
+            logger.warning('Request to %s failed (%s), retrying in %.1fs', url, reason, delay)
+            self.retry.sleep(delay)
+
+    def _get(self, path, **kwargs):
+        '''
+        Send a GET request with ``requests`` and return the response
+
+        :raises PepperException: if salt-api rejected the request
+        '''
+        import requests
+
+        if not (self.auth and 'token' in self.auth and self.auth['token']):
+            raise PepperException('Authentication required')
+        headers = {
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+            'X-Requested-With': 'XMLHttpRequest',
+            'X-Auth-Token': self.auth['token'],
+        }
 
-    def req_stream(self, path):
+        def send(url):
+            resp = self._pool.session.get(url, headers=headers, verify=self._ssl_verify is True, **kwargs)
+            return resp, resp.status_code, resp.headers
+
+        try:
+            resp, endpoint = self._retrying(path, True, send, (requests.ConnectionError, requests.Timeout))
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            raise PepperException('Unable to reach salt-api: {0}'.format(exc))
+        # streamed responses are not counted as in flight, /events would
+        # keep its instance busy forever
+        self.balancer.release(endpoint)
+
+        if resp.status_code == 401:
+            raise PepperException(str(resp.status_code) + ':Authentication denied')
+        if resp.status_code == 404:
+            raise PepperException(str(resp.status_code) + ' :This request returns nothing.')
+        if resp.status_code == 500:
+            raise PepperException(str(resp.status_code) + ':Server error.')
+        if resp.status_code > 500:
+            resp.close()
+            raise PepperException('{0}:{1}'.format(resp.status_code, resp.reason))
+        return resp
+
+    def req_stream(self, path, timeout=None):
         '''
         A thin wrapper to get a response from saltstack api.
         The body of the response will not be downloaded immediately.
@@ -93,45 +494,135 @@ class Pepper(object):
 
         :param path: The path to the salt api resource
 
+        :param timeout: Seconds to wait for the server to send data
+
         :return: :class:`Response <Response>` object
 
         :rtype: requests.Response
+
+        :raises PepperException: if salt-api rejected the request or could
+            not be reached
         '''
-        import requests
+        return self._get(path, stream=True, timeout=timeout)
 
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
-        if self.auth and 'token' in self.auth and self.auth['token']:
-            headers.setdefault('X-Auth-Token', self.auth['token'])
-        else:
-            raise PepperException('Authentication required')
-            return
-        params = {'url': self._construct_url(path),
-                  'headers': headers,
-                  'verify': self._ssl_verify is True,
-                  'stream': True
-                  }
+    def events(self, timeout=None, tags=None):
+        '''
+        Subscribe to the salt-api ``/events`` stream and return an iterator
+        over the decoded events
+
+        The subscription is live once this returns, so events fired by
+        commands sent afterwards are not missed.
+
+        >>> events = api.events()
+        >>> api.local_async('*', 'test.ping')
+        >>> for event in events:
+        ...     print(event['tag'])
+
+        :param timeout: Seconds to wait for the server to send data
+
+        :param tags: ``fnmatch`` patterns of the tags of the events to
+            return; the other events are not decoded
+
+        :raises PepperException: if the stream can not be opened
+        '''
+        resp = self.req_stream('/events', timeout=timeout)
+
+        chunks = resp.iter_content(chunk_size=None)
+        # salt-api subscribes to the event bus before it sends the first
+        # ``retry:`` line of the stream
+        first = next(chunks, b'')
+        decoder = SSEDecoder(TagMatcher(tags) if tags is not None else None)
+        return self._iter_events(resp, itertools.chain([first], chunks), decoder)
+
+    @staticmethod
+    def _iter_events(resp, chunks, decoder):
         try:
-            resp = requests.get(**params)
+            for chunk in chunks:
+                for event in decoder.feed(chunk):
+                    yield event
+        finally:
+            resp.close()
 
-            if resp.status_code == 401:
-                raise PepperException(str(resp.status_code) + ':Authentication denied')
-                return
+    def events_ws(self, tags=None, timeout=None, ping_interval=30, reconnect=True):
+        '''
+        Subscribe to the salt-api ``/ws`` WebSocket and return an iterator
+        over the decoded events
 
-            if resp.status_code == 500:
-                raise PepperException(str(resp.status_code) + ':Server error.')
-                return
+        Like :meth:`events` but every event arrives in its own length
+        prefixed message. The server is pinged after ``ping_interval``
+        seconds of silence, and the connection is opened again with backoff
+        if it closes or does not answer; events fired meanwhile are lost.
 
-            if resp.status_code == 404:
-                raise PepperException(str(resp.status_code) + ' :This request returns nothing.')
-                return
-        except PepperException as e:
-            print(e)
-            return
-        return resp
+        >>> for event in api.events_ws(tags='salt/job/*/ret/*'):
+        ...     print(event['data']['id'])
+
+        :param tags: ``fnmatch`` patterns of the tags of the events to return
+
+        :param timeout: Seconds to wait for the connection to be established
+
+        :param ping_interval: Seconds of silence after which the server is
+            pinged
+
+        :param reconnect: open the connection again when it fails instead of
+            stopping the iteration
+
+        :raises PepperException: if the connection can not be opened
+        '''
+        ws = self._open_ws(timeout, ping_interval)
+        matcher = TagMatcher(tags) if tags is not None else None
+        return self._iter_ws_events(ws, matcher, timeout, ping_interval, reconnect)
+
+    def _open_ws(self, timeout, ping_interval):
+        from pepper.websocket import READY, WebSocket
+
+        if not (self.auth and 'token' in self.auth and self.auth['token']):
+            raise PepperException('Authentication required')
+        # the stream is not counted as in flight, see _get
+        endpoint = self.balancer.acquire(prefer=self._pinned)
+        self.balancer.release(endpoint)
+        ws = WebSocket(
+            self._construct_url('/ws', endpoint.url),
+            {'X-Auth-Token': self.auth['token']},
+            ssl_context=self._pool.ssl_context or create_ssl_context(self._ssl_verify),
+            timeout=timeout,
+            ping_interval=ping_interval,
+        )
+        ws.send(READY)
+        return ws
+
+    def _iter_ws_events(self, ws, matcher, timeout, ping_interval, reconnect):
+        from pepper.websocket import WebSocketClosed, decode_event
+
+        backoff = self.retry.backoff()
+        try:
+            while True:
+                try:
+                    for message in ws:
+                        event = decode_event(message)
+                        if not isinstance(event, dict):
+                            continue
+                        if matcher is None or matcher.match(event.get('tag', '')):
+                            yield event
+                    reason = 'salt-api closed the WebSocket'
+                except WebSocketClosed as exc:
+                    reason = str(exc)
+                ws.close()
+                if not reconnect:
+                    return
+                while True:
+                    delay = backoff.next()
+                    logger.warning('%s, connecting again in %.1fs', reason, delay)
+                    time.sleep(delay)
+                    try:
+                        if self.token_manager is not None:
+                            self.token_manager.get()
+                        ws = self._open_ws(timeout, ping_interval)
+                        break
+                    except PepperException as exc:
+                        reason = str(exc)
+                backoff.reset()
+        finally:
+            ws.close()
 
     def req_get(self, path):
         '''
@@ -139,45 +630,17 @@ class Pepper(object):
         api = Pepper('http://ipaddress/api/')
         print(api.login('salt','salt','pam'))
         print(api.req_get('/keys'))
-        '''
-        import requests
-
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
-        if self.auth and 'token' in self.auth and self.auth['token']:
-            headers.setdefault('X-Auth-Token', self.auth['token'])
-        else:
-            raise PepperException('Authentication required')
-            return
-        params = {'url': self._construct_url(path),
-                  'headers': headers,
-                  'verify': self._ssl_verify is True,
-                  }
-        try:
-            resp = requests.get(**params)
 
-            if resp.status_code == 401:
-                raise PepperException(str(resp.status_code) + ':Authentication denied')
-                return
-
-            if resp.status_code == 500:
-                raise PepperException(str(resp.status_code) + ':Server error.')
-                return
-
-            if resp.status_code == 404:
-                raise PepperException(str(resp.status_code) + ' :This request returns nothing.')
-                return
-        except PepperException as e:
-            print(e)
-            return
-        return resp.json()
+        :raises PepperException: if salt-api rejected the request or could
+            not be reached
+        '''
+        resp = self._get(path)
+        return codec.loads(resp.content)
 
     def req(self, path, data=None):
         '''
-        A thin wrapper around urllib2 to send requests and return the response
+        A thin wrapper around a pooled keep-alive connection to send requests
+        and return the response
 
         If the current instance contains an authentication token it will be
         attached to the request as a custom header.
@@ -189,71 +652,89 @@ class Pepper(object):
                 or self.auth.get('eauth') == 'kerberos'):
             return self.req_requests(path, data)
 
-        headers = {
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'X-Requested-With': 'XMLHttpRequest',
-        }
+        f = self._open(path, data)
+        try:
+            with f:
+                content = f.read()
+            if (self.debug_http):
+                logger.debug('Response: %s', content.decode('utf-8'))
+            ret = codec.loads(content)
+        except AttributeError:
+            logger.debug('Error converting response from JSON', exc_info=True)
+            raise PepperException('Unable to parse the server response.')
 
-        opener = build_opener()
-        for handler in opener.handlers:
-            if isinstance(handler, HTTPHandler):
-                handler.set_http_debuglevel(self.debug_http)
-            if isinstance(handler, HTTPSHandler):
-                handler.set_http_debuglevel(self.debug_http)
-        install_opener(opener)
+        return ret
+
+    def _open(self, path, data=None, retry_auth=True):
+        '''
+        Send a request and return the response once its headers have arrived
+
+        A request rejected with 401 is sent once more with a new token if a
+        :class:`TokenManager` is attached. Transient failures are retried as
+        the :class:`pepper.retry.RetryPolicy` allows.
+
+        :rtype: :class:`pepper.transport.PooledResponse`
+        '''
+        headers = self._headers(path)
+        headers['Accept-Encoding'] = 'gzip, deflate'
 
         # Build POST data
         if data is not None:
-            postdata = json.dumps(data).encode()
-            clen = len(postdata)
+            postdata = codec.dumps(data)
         else:
             postdata = None
 
-        # Create request object
-        url = self._construct_url(path)
-        req = Request(url, postdata, headers)
+        method = 'POST' if postdata is not None else 'GET'
+        body = postdata
+        if postdata is not None and self.gzip_threshold is not None and len(postdata) > self.gzip_threshold:
+            body = gzip.compress(postdata, compresslevel=6)
+            headers['Content-Encoding'] = 'gzip'
 
-        # Add POST data to request
-        if data is not None:
-            req.add_header('Content-Length', clen)
+        idempotent = self.retry.is_idempotent(method, path, data)
 
-        # Add auth header to request
-        if path != '/run' and self.auth and 'token' in self.auth and self.auth['token']:
-            req.add_header('X-Auth-Token', self.auth['token'])
+        def send(url):
+            stats = TransferStats(method, url, len(body or b''), len(postdata or b''))
+            f = self._pool.urlopen(method, url, body, headers, stats=stats, idempotent=idempotent)
+            return f, f.status, f.headers
 
         # Send request
         try:
-            if not (self._ssl_verify):
-                con = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-                f = urlopen(req, context=con)
-            else:
-                f = urlopen(req)
-            content = f.read().decode('utf-8')
-            if (self.debug_http):
-                logger.debug('Response: %s', content)
-            ret = json.loads(content)
-
-            if not self.salt_version and 'x-salt-version' in f.headers:
-                self._parse_salt_version(f.headers['x-salt-version'])
+            try:
+                f, endpoint = self._retrying(path, idempotent, send, (socket.error, httplib.HTTPException))
+            except (socket.error, httplib.HTTPException) as exc:
+                raise URLError(exc)
+            f.add_done_callback(functools.partial(self.balancer.release, endpoint))
+            f.add_done_callback(functools.partial(self._transferred, f.stats))
+            if f.status >= 400:
+                with f:
+                    content = f.read()
+                raise HTTPError(self._construct_url(path, endpoint.url), f.status, f.reason, f.headers,
+                                io.BytesIO(content))
 
         except (HTTPError, URLError) as exc:
             logger.debug('Error with request', exc_info=True)
             status = getattr(exc, 'code', None)
 
             if status == 401:
+                stale = self.auth.get('token')
+                if retry_auth and stale and self.token_manager is not None and path not in ('/login', '/token'):
+                    logger.info('salt-api rejected the token, logging in again')
+                    self.token_manager.refresh(stale_token=stale)
+                    return self._open(path, _replace_token(data, stale, self.auth.get('token')), retry_auth=False)
                 raise PepperException('Authentication denied')
 
             if status == 500:
                 raise PepperException('Server error.')
 
-            logger.error('Error with request: {0}'.format(exc))
-            raise
-        except AttributeError:
-            logger.debug('Error converting response from JSON', exc_info=True)
-            raise PepperException('Unable to parse the server response.')
+            logger.error('Error with request: {0}'.format(exc))
+            raise
 
-        return ret
+        if self.token_affinity and path in ('/login', '/token'):
+            self._pinned = endpoint
+        if not self.salt_version and 'x-salt-version' in f.headers:
+            self._parse_salt_version(f.headers['x-salt-version'])
+
+        return f
 
     def req_requests(self, path, data=None):
         '''
@@ -277,14 +758,25 @@ class Pepper(object):
         if self.auth and 'token' in self.auth and self.auth['token']:
             headers.setdefault('X-Auth-Token', self.auth['token'])
         # Optionally toggle SSL verification
-        params = {'url': self._construct_url(path),
-                  'headers': headers,
+        params = {'headers': headers,
                   'verify': self._ssl_verify is True,
                   'auth': auth,
-                  'data': json.dumps(data),
+                  'data': codec.dumps(data),
                   }
         logger.debug('postdata {0}'.format(params))
-        resp = requests.post(**params)
+
+        def send(url):
+            resp = self._pool.session.post(url, **params)
+            return resp, resp.status_code, resp.headers
+
+        try:
+            resp, endpoint = self._retrying(path, self.retry.is_idempotent('POST', path, data), send,
+                                            requests.ConnectionError)
+        except requests.ConnectionError as exc:
+            raise PepperException('Unable to reach salt-api: {0}'.format(exc))
+        self.balancer.release(endpoint)
+        if self.token_affinity and path in ('/login', '/token') and resp.status_code < 400:
+            self._pinned = endpoint
         if resp.status_code == 401:
             # TODO should be resp.raise_from_status
             raise PepperException('Authentication denied')
@@ -295,7 +787,7 @@ class Pepper(object):
         if not self.salt_version and 'x-salt-version' in resp.headers:
             self._parse_salt_version(resp.headers['x-salt-version'])
 
-        return resp.json()
+        return codec.loads(resp.content)
 
     def low(self, lowstate, path='/'):
         '''
@@ -307,35 +799,51 @@ class Pepper(object):
         '''
         return self.req(path, lowstate)
 
-    def local(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
-              timeout=None, ret=None):
+    def iter_low(self, lowstate, path='/', chunk_size=65536):
         '''
-        Run a single command using the ``local`` client
+        Execute a command through salt-api and yield ``(minion_id, return)``
+        pairs while the response is being received
 
-        Wraps :meth:`low`.
-        '''
-        low = {
-            'client': 'local',
-            'tgt': tgt,
-            'fun': fun,
-        }
+        Only one minion return is decoded and held in memory at a time, which
+        keeps the memory use flat for commands targeting many minions. Entries
+        of the ``return`` list which are not dictionaries are yielded as
+        ``(None, entry)``.
 
-        if arg:
-            low['arg'] = arg
+        >>> for minion, ret in api.iter_low([{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]):
+        ...     print(minion, ret)
 
-        if kwarg:
-            low['kwarg'] = kwarg
+        :param list lowstate: a list of lowstate dictionaries
 
-        if expr_form:
-            low['expr_form'] = expr_form
+        :param string path: URL path to be joined with the API hostname
 
-        if timeout:
-            low['timeout'] = timeout
+        :param int chunk_size: the number of bytes read from the socket at once
+        '''
+        if self.auth.get('eauth') == 'kerberos':
+            for entry in self.req_requests(path, lowstate).get('return', []):
+                if isinstance(entry, dict):
+                    for item in entry.items():
+                        yield item
+                else:
+                    yield None, entry
+            return
 
-        if ret:
-            low['ret'] = ret
+        with self._open(path, lowstate) as f:
+            try:
+                for item in iter_return_items(f, chunk_size):
+                    yield item
+            except ValueError:
+                logger.debug('Error converting response from JSON', exc_info=True)
+                raise PepperException('Unable to parse the server response.')
+
+    def local(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
+              timeout=None, ret=None):
+        '''
+        Run a single command using the ``local`` client
 
-        return self.low([low])
+        Wraps :meth:`low`.
+        '''
+        return self.low([self._local_low('local', tgt, fun, arg, kwarg, expr_form,
+                                         timeout=timeout, ret=ret)])
 
     def local_async(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
                     timeout=None, ret=None):
@@ -344,28 +852,8 @@ class Pepper(object):
 
         Wraps :meth:`low`.
         '''
-        low = {
-            'client': 'local_async',
-            'tgt': tgt,
-            'fun': fun,
-        }
-
-        if arg:
-            low['arg'] = arg
-
-        if kwarg:
-            low['kwarg'] = kwarg
-
-        if expr_form:
-            low['expr_form'] = expr_form
-
-        if timeout:
-            low['timeout'] = timeout
-
-        if ret:
-            low['ret'] = ret
-
-        return self.low([low])
+        return self.low([self._local_low('local_async', tgt, fun, arg, kwarg, expr_form,
+                                         timeout=timeout, ret=ret)])
 
     def local_batch(self, tgt, fun, arg=None, kwarg=None, expr_form='glob',
                     batch='50%', ret=None):
@@ -374,28 +862,26 @@ class Pepper(object):
 
         Wraps :meth:`low`.
         '''
-        low = {
-            'client': 'local_batch',
-            'tgt': tgt,
-            'fun': fun,
-        }
-
-        if arg:
-            low['arg'] = arg
+        return self.low([self._local_low('local_batch', tgt, fun, arg, kwarg, expr_form,
+                                         batch=batch, ret=ret)])
 
-        if kwarg:
-            low['kwarg'] = kwarg
-
-        if expr_form:
-            low['expr_form'] = expr_form
+    def batch(self, max_size=100, max_bytes=1048576, path='/'):
+        '''
+        Queue commands and send them to salt-api in a single request
 
-        if batch:
-            low['batch'] = batch
+        Returns a :class:`pepper.batch.LowstateBatch` context manager whose
+        ``local``, ``runner`` and ``wheel`` methods return futures of their
+        entry in the ``return`` list; the queue is sent when the ``with`` block
+        exits or once it holds ``max_size`` lowstates or ``max_bytes`` bytes.
 
-        if ret:
-            low['ret'] = ret
+        .. code-block:: python
 
-        return self.low([low])
+            with api.batch() as batch:
+                keys = batch.wheel('key.list_all')
+                jobs = batch.runner('jobs.active')
+            print(keys.result(), jobs.result())
+        '''
+        return LowstateBatch(self, max_size=max_size, max_bytes=max_bytes, path=path)
 
     def lookup_jid(self, jid):
         '''
@@ -413,16 +899,7 @@ class Pepper(object):
         Usage::
           runner('jobs.lookup_jid', jid=12345)
         '''
-        low = {
-            'client': 'runner',
-            'fun': fun,
-        }
-        if arg:
-            low['arg'] = arg
-
-        low.update(kwargs)
-
-        return self.low([low])
+        return self.low([self._runner_low(fun, arg, kwargs)])
 
     def wheel(self, fun, arg=None, kwarg=None, **kwargs):
         '''
@@ -431,19 +908,7 @@ class Pepper(object):
         Usage::
           wheel('key.accept', match='myminion')
         '''
-        low = {
-            'client': 'wheel',
-            'fun': fun,
-        }
-
-        if arg:
-            low['arg'] = arg
-        if kwarg:
-            low['kwarg'] = kwarg
-
-        low.update(kwargs)
-
-        return self.low([low])
+        return self.low([self._wheel_low(fun, arg, kwarg, kwargs)])
 
     def _send_auth(self, path, **kwargs):
         return self.req(path, kwargs)
@@ -454,16 +919,7 @@ class Pepper(object):
         authentication token or an empty dict
 
         '''
-        local = locals()
-        kwargs.update(
-            dict(
-                (key, local[key]) for key in (
-                    'username',
-                    'password',
-                    'eauth'
-                ) if local.get(key, None) is not None
-            )
-        )
+        kwargs = self._login_kwargs(username, password, eauth, kwargs)
         self.auth = self._send_auth('/login', **kwargs).get('return', [{}])[0]
         return self.auth
 
@@ -475,31 +931,686 @@ class Pepper(object):
         self.auth = self._send_auth('/token', **kwargs)[0]
         return self.auth
 
-    def _construct_url(self, path):
+
+def _replace_token(data, old, new):
+    '''
+    Swap the token sent in the body of /run lowstates
+    '''
+    if not old or not isinstance(data, list):
+        return data
+    return [dict(low, token=new) if isinstance(low, dict) and low.get('token') == old else low
+            for low in data]
+
+
+class TokenManager(object):
+    '''
+    Keep the salt-api token of a :class:`Pepper` instance valid and share it
+    between processes
+
+    The token is cached in ``cache``, a JSON file readable by the current user
+    only. Refreshing takes an exclusive lock on ``<cache>.lock`` and reads the
+    cache again before logging in, so when many processes find the token
+    expiring at the same time only the first one calls ``/login`` and the
+    others use its token.
+
+    A background thread refreshes the token ``refresh_margin`` seconds before
+    it expires. When a request is answered with 401 the client asks the
+    manager for a new token and retries the request once.
+
+    >>> api = Pepper('https://localhost:8000')
+    >>> manager = TokenManager(api, {'username': 'saltdev', 'password': 'saltdev', 'eauth': 'pam'},
+    ...                        cache='~/.peppercache')
+    >>> manager.get()['token']
+    'c02a6f4397b5496ba06b70ae5fd1f2ab75de9237'
+
+    :param api: the :class:`Pepper` instance to authenticate; its
+        ``token_manager`` is set to this manager
+
+    :param credentials: the keyword arguments for :meth:`Pepper.login`, or a
+        callable returning them which is only called when logging in
+
+    :param cache: path of the token cache shared with other processes, or
+        None to keep the token in memory
+
+    :param userun: get the token from ``/token`` for use with the ``/run`` URL
+
+    :param refresh_margin: seconds before ``expire`` at which the token is
+        refreshed, at most half the lifetime of the token
+
+    :param background: refresh the token from a background thread
+    '''
+    def __init__(self, api, credentials, cache=None, userun=False, refresh_margin=300, background=True):
+        self.api = api
+        self.credentials = credentials
+        self.cache = os.path.expanduser(cache) if cache else None
+        self.userun = userun
+        self.refresh_margin = refresh_margin
+        self.background = background
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._thread = None
+        api.token_manager = self
+
+    def refresh_at(self, auth):
         '''
-        Construct the url to salt-api for the given path
+        Return the time at which a token should be replaced
+        '''
+        expire = auth.get('expire', 0)
+        margin = self.refresh_margin
+        if auth.get('start'):
+            margin = min(margin, (expire - auth['start']) / 2.0)
+        return expire - margin
 
-        Args:
-            path: the path to the salt-api resource
+    def is_fresh(self, auth):
+        return bool(isinstance(auth, dict) and auth.get('token') and time.time() < self.refresh_at(auth))
 
-        >>> api = Pepper('https://localhost:8000/salt-api/')
-        >>> api._construct_url('/login')
-        'https://localhost:8000/salt-api/login'
+    def get(self):
+        '''
+        Return a valid token, logging in if neither this instance nor the
+        cache has one
         '''
+        with self._lock:
+            if not self.is_fresh(self.api.auth):
+                auth = self._read()
+                if self.is_fresh(auth):
+                    self.api.auth = auth
+                else:
+                    self.refresh()
+            self._start()
+            return self.api.auth
+
+    def refresh(self, stale_token=None):
+        '''
+        Replace the token unless another thread or process already did
 
-        relative_path = path.lstrip('/')
-        return urlparse.urljoin(self.api_url, relative_path)
+        :param stale_token: a token the server rejected; it is not reused
+            even if it has not expired
+        '''
+        with self._lock, self._file_lock():
+            for auth in (self.api.auth, self._read()):
+                if self.is_fresh(auth) and auth.get('token') != stale_token:
+                    logger.debug('Token was refreshed by another thread or process')
+                    self.api.auth = auth
+                    return auth
+
+            credentials = self.credentials() if callable(self.credentials) else dict(self.credentials)
+            if self.userun:
+                auth = self.api.token(**credentials)
+            else:
+                auth = self.api.login(**credentials)
+            self.api.auth = auth
+            self._write(auth)
+            return auth
 
-    def _parse_salt_version(self, version):
-        # borrow from salt.version
-        git_describe_regex = re.compile(
-            r'(?:[^\d]+)?(?P<major>[\d]{1,4})'
-            r'\.(?P<minor>[\d]{1,2})'
-            r'(?:\.(?P<bugfix>[\d]{0,2}))?'
-            r'(?:\.(?P<mbugfix>[\d]{0,2}))?'
-            r'(?:(?P<pre_type>rc|a|b|alpha|beta|nb)(?P<pre_num>[\d]{1}))?'
-            r'(?:(?:.*)-(?P<noc>(?:[\d]+|n/a))-(?P<sha>[a-z0-9]{8}))?'
-        )
-        match = git_describe_regex.match(version)
-        if match:
-            self.salt_version = match.groups()
+    def close(self):
+        '''
+        Stop the background refresh
+        '''
+        self._stop.set()
+
+    def _start(self):
+        if self.background and (self._thread is None or not self._thread.is_alive()):
+            self._thread = threading.Thread(target=self._run, name='pepper-token-refresh')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        delay = 0
+        while not self._stop.wait(delay):
+            now = time.time()
+            refresh_at = self.refresh_at(self.api.auth) if self.api.auth else now
+            if now < refresh_at:
+                delay = refresh_at - now
+                continue
+            try:
+                auth = self.refresh()
+            except Exception as exc:
+                logger.warning('Unable to refresh the salt-api token: %s', exc)
+                delay = 30
+                continue
+            if self.is_fresh(auth):
+                delay = 0
+            else:
+                logger.warning('salt-api returned a token expiring at %s', auth.get('expire'))
+                delay = 30
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        if self.cache is None or fcntl is None:
+            yield
+            return
+        # the lock is best effort, like the cache: logging in must not fail
+        # because the cache cannot be written
+        fd = None
+        try:
+            self._makedirs()
+            fd = os.open(self.cache + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to lock token cache {0} {1}'.format(self.cache, exc))
+            if fd is not None:
+                os.close(fd)
+                fd = None
+        try:
+            yield
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _makedirs(self):
+        '''
+        Create the directory of the cache
+
+        :raises OSError: if it cannot be created
+        '''
+        directory = os.path.dirname(self.cache)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def _read(self):
+        if self.cache is None:
+            return None
+        try:
+            with open(self.cache, 'rb') as f:
+                return codec.loads(f.read())
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.ENOENT:
+                logger.error('Unable to load login token from {0} {1}'.format(self.cache, exc))
+        except ValueError as exc:
+            logger.error('Unable to load login token from {0} {1}'.format(self.cache, exc))
+        return None
+
+    def _write(self, auth):
+        if self.cache is None:
+            return
+        tmp = '{0}.{1}.tmp'.format(self.cache, os.getpid())
+        try:
+            self._makedirs()
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(codec.dumps(auth))
+            os.replace(tmp, self.cache)
+        except (IOError, OSError, TypeError) as exc:
+            logger.error('Unable to save token to {0} {1}'.format(self.cache, exc))
+
+
+class TrackedJob(object):
+    '''
+    A job followed by a :class:`JobTracker`
+
+    :ivar returns: ``{minion_id: return}`` of the minions which returned,
+        where ``return`` has the ``ret`` and ``jid`` keys of a
+        ``full_return``, and its ``retcode`` if the job cache has one
+    '''
+    def __init__(self, jid, minions, deadline=None, callback=None):
+        self.jid = jid
+        #: the minions the job was published to
+        self.minions = list(minions)
+        self.deadline = deadline
+        self.callback = callback
+        self.returns = {}
+        self.done = False
+        #: whether the job was given up on before every minion returned
+        self.timed_out = False
+
+    @property
+    def missing(self):
+        '''
+        The minions which did not return yet
+        '''
+        return [minion for minion in self.minions if minion not in self.returns]
+
+    def __repr__(self):
+        return '<TrackedJob {0} {1}/{2} returned>'.format(self.jid, len(self.returns), len(self.minions))
+
+
+class JobTracker(object):
+    '''
+    Wait for many jobs at once
+
+    Every tick looks up all the outstanding jobs with a single request of one
+    ``jobs.list_job`` lowstate per job. A job is done once all the minions it
+    was published to returned, or when its timeout expired.
+
+    .. code-block:: python
+
+        tracker = JobTracker(api, timeout=300)
+        for host in hosts:
+            tracker.local_async(host, 'state.apply')
+        for job in tracker:
+            print(job.jid, job.returns, job.missing)
+
+    Completed jobs are yielded by iterating the tracker and passed to the
+    callback given for them, if any.
+
+    :param api: a logged in :class:`Pepper`
+
+    :param poll_interval: seconds between ticks
+
+    :param timeout: seconds after which a job is given up on, None to wait
+        forever
+
+    :param low: a callable sending a list of lowstates, ``api.low`` by
+        default
+    '''
+    def __init__(self, api, poll_interval=1, timeout=None, low=None):
+        self.api = api
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self._low = low or api.low
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def __len__(self):
+        return len(self._jobs)
+
+    @property
+    def pending(self):
+        '''
+        The jids of the outstanding jobs
+        '''
+        with self._lock:
+            return list(self._jobs)
+
+    def add(self, jid, minions, callback=None, timeout=None):
+        '''
+        Track a job published to ``minions``
+
+        :param callback: called with the :class:`TrackedJob` once it is done
+
+        :param timeout: overrides the timeout of the tracker for this job
+        '''
+        timeout = self.timeout if timeout is None else timeout
+        job = TrackedJob(jid, minions, time.time() + timeout if timeout is not None else None, callback)
+        with self._lock:
+            self._jobs[jid] = job
+        return job
+
+    def local_async(self, tgt, fun, arg=None, kwarg=None, expr_form='glob', callback=None, timeout=None):
+        '''
+        Publish a command with the ``local_async`` client and track its job
+
+        :raises PepperException: if the master did not publish the job
+        '''
+        low = self.api._local_low('local_async', tgt, fun, arg, kwarg, expr_form)
+        ret = self._low([low])['return'][0] or {}
+        if 'jid' not in ret:
+            raise PepperException('The job was not published: {0}'.format(ret))
+        return self.add(ret['jid'], ret.get('minions', []), callback=callback, timeout=timeout)
+
+    def lookup(self, jids):
+        '''
+        Look up the results of several jobs in a single request
+
+        Returns ``{jid: {minion_id: return}}``; a return has no ``retcode``
+        when the job cache holds none.
+        '''
+        load = [{'client': 'runner', 'fun': 'jobs.list_job', 'kwarg': {'jid': jid}} for jid in jids]
+        results = {}
+        for jid, job in zip(jids, self._low(load)['return']):
+            # sometimes ret is nested in data
+            if isinstance(job, dict) and 'data' in job:
+                job = job['data']
+            results[jid] = {}
+            for minion, ret in ((job or {}).get('Result') or {}).items():
+                if not isinstance(ret, dict):
+                    ret = {'return': ret}
+                results[jid][minion] = {'ret': ret.get('return'), 'jid': jid}
+                if ret.get('retcode') is not None:
+                    results[jid][minion]['retcode'] = ret['retcode']
+        return results
+
+    def poll(self):
+        '''
+        Look up all the outstanding jobs once and return those which are done
+        '''
+        with self._lock:
+            jobs = list(self._jobs.values())
+        if not jobs:
+            return []
+
+        results = self.lookup([job.jid for job in jobs])
+        now = time.time()
+        done = []
+        for job in jobs:
+            job.returns.update(results.get(job.jid, {}))
+            if not job.missing:
+                done.append(job)
+            elif job.deadline is not None and now > job.deadline:
+                job.timed_out = True
+                done.append(job)
+
+        with self._lock:
+            for job in done:
+                self._jobs.pop(job.jid, None)
+        for job in done:
+            self._complete(job)
+        return done
+
+    def _complete(self, job):
+        job.done = True
+        if job.callback is not None:
+            try:
+                job.callback(job)
+            except Exception:
+                logger.exception('Callback for job %s failed', job.jid)
+
+    def wait(self):
+        '''
+        Poll until every job is done
+        '''
+        for _ in self:
+            pass
+
+    def __iter__(self):
+        while self._jobs:
+            time.sleep(self.poll_interval)
+            for job in self.poll():
+                yield job
+
+
+class Subscription(object):
+    '''
+    The events of an :class:`EventHub` whose tag matches some patterns
+
+    Events are queued until they are read with :meth:`get` or by iterating
+    the subscription, which stops once it is closed. When the queue is full,
+    the ``drop`` policy discards the oldest queued event and the ``block``
+    policy holds the hub, and so every other subscriber, until there is
+    room.
+
+    :param patterns: ``fnmatch`` patterns of the tags to receive
+
+    :param maxsize: the number of events queued at most
+
+    :param policy: ``drop`` or ``block``
+    '''
+    DROP = 'drop'
+    BLOCK = 'block'
+
+    def __init__(self, hub, patterns, maxsize=1000, policy=DROP):
+        if policy not in (self.DROP, self.BLOCK):
+            raise PepperException('Unknown subscription policy: {0}'.format(policy))
+        self.hub = hub
+        self.patterns = list(patterns)
+        self.maxsize = maxsize
+        self.policy = policy
+        self.matcher = TagMatcher(self.patterns)
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        #: the number of events queued, read and dropped
+        self.delivered = 0
+        self.consumed = 0
+        self.dropped = 0
+
+    def matches(self, tag):
+        return self.matcher.match(tag)
+
+    @property
+    def pending(self):
+        '''
+        The number of events waiting to be read
+        '''
+        return len(self._queue)
+
+    @property
+    def lag(self):
+        '''
+        Seconds the oldest pending event has been waiting to be read
+        '''
+        try:
+            return max(0.0, time.time() - self._queue[0][0])
+        except IndexError:
+            return 0.0
+
+    def metrics(self):
+        return {
+            'patterns': self.patterns,
+            'pending': self.pending,
+            'lag': self.lag,
+            'delivered': self.delivered,
+            'consumed': self.consumed,
+            'dropped': self.dropped,
+        }
+
+    def put(self, event):
+        '''
+        Queue an event according to the policy of the subscription
+
+        Returns whether it was queued.
+        '''
+        with self._cond:
+            if self.policy == self.BLOCK:
+                while len(self._queue) >= self.maxsize and not self.closed:
+                    self._cond.wait()
+            elif len(self._queue) >= self.maxsize:
+                self._queue.popleft()
+                self.dropped += 1
+            if self.closed:
+                return False
+            self._queue.append((time.time(), event))
+            self.delivered += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout=None):
+        '''
+        Return the next event
+
+        :raises queue.Empty: if no event arrived within ``timeout`` seconds,
+            or the subscription is closed and no event is pending
+        '''
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while not self._queue:
+                remaining = deadline - time.time() if deadline is not None else None
+                if self.closed or (remaining is not None and remaining <= 0):
+                    raise queue.Empty()
+                self._cond.wait(remaining)
+            _, event = self._queue.popleft()
+            self.consumed += 1
+            self._cond.notify_all()
+            return event
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.get()
+            except queue.Empty:
+                return
+
+    def close(self):
+        '''
+        Stop receiving events; pending events can still be read
+        '''
+        self.hub.unsubscribe(self)
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return '<Subscription {0} pending={1} dropped={2}>'.format(self.patterns, self.pending, self.dropped)
+
+
+class EventHub(object):
+    '''
+    Share one salt-api ``/events`` stream between many subscribers
+
+    A background thread reads the stream and queues every event on the
+    subscriptions whose patterns match its tag. The stream is opened again
+    with backoff when it ends or fails; events fired while it is down are
+    lost.
+
+    .. code-block:: python
+
+        hub = EventHub(api)
+        with hub.subscribe('salt/job/*/ret/*', maxsize=10000) as returns:
+            hub.start(timeout=5)
+            api.local_async('*', 'test.ping')
+            for event in returns:
+                print(event['data']['id'])
+
+    :param api: a logged in :class:`Pepper`
+
+    :param timeout: seconds to wait for the server to send data before the
+        stream is opened again, None to wait forever
+    '''
+    def __init__(self, api, timeout=None):
+        self.api = api
+        self.timeout = timeout
+        self._subscriptions = []
+        # the tags of every subscription; the other events are not decoded
+        self._matcher = TagMatcher([])
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._resp = None
+        #: set while the stream is open
+        self.connected = threading.Event()
+        #: the number of events read from the stream
+        self.received = 0
+        #: the number of times the stream was opened again
+        self.reconnects = 0
+
+    def subscribe(self, patterns='*', maxsize=1000, policy=Subscription.DROP):
+        '''
+        Return a :class:`Subscription` to the events whose tag matches
+        ``patterns``, a pattern or a list of them
+
+        The stream is opened by the first subscription; call :meth:`start`
+        to wait until it is live.
+        '''
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        subscription = Subscription(self, patterns, maxsize, policy)
+        with self._lock:
+            self._subscriptions.append(subscription)
+            self._update_matcher()
+        self.start()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+                self._update_matcher()
+
+    def _update_matcher(self):
+        self._matcher = TagMatcher([
+            pattern for subscription in self._subscriptions for pattern in subscription.patterns])
+
+    def start(self, timeout=None):
+        '''
+        Start reading the stream if it is not read yet
+
+        Returns whether the stream was open within ``timeout`` seconds, so
+        that events fired afterwards are not missed.
+        '''
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='pepper-event-hub')
+                self._thread.daemon = True
+                self._thread.start()
+        return self.connected.wait(timeout)
+
+    def metrics(self):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        return {
+            'connected': self.connected.is_set(),
+            'received': self.received,
+            'reconnects': self.reconnects,
+            'subscriptions': [subscription.metrics() for subscription in subscriptions],
+        }
+
+    def publish(self, event):
+        '''
+        Queue an event on the matching subscriptions
+        '''
+        self.received += 1
+        tag = event.get('tag', '') if isinstance(event, dict) else ''
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(tag):
+                subscription.put(event)
+
+    def _run(self):
+        backoff = self.api.retry.backoff()
+        opened = False
+        while not self._stop.is_set():
+            if opened:
+                self.reconnects += 1
+            opened = True
+            try:
+                if self.api.token_manager is not None:
+                    self.api.token_manager.get()
+                self._resp = self.api.req_stream('/events', timeout=self.timeout)
+                if self._stop.is_set():
+                    break
+                chunks = self._resp.iter_content(chunk_size=None)
+                # salt-api subscribes to the event bus before it sends the
+                # first ``retry:`` line of the stream
+                first_chunk = next(chunks, b'')
+                self.connected.set()
+                backoff.reset()
+                decoder = SSEDecoder()
+                for chunk in itertools.chain([first_chunk], chunks):
+                    decoder.matcher = self._matcher
+                    for event in decoder.feed(chunk):
+                        self.publish(event)
+                logger.info('The salt-api event stream ended, opening it again')
+            except Exception as exc:
+                if self._stop.is_set():
+                    break
+                logger.warning('Reading the salt-api event stream failed: %s', exc)
+            finally:
+                self.connected.clear()
+                if self._resp is not None:
+                    self._resp.close()
+                    self._resp = None
+            self._stop.wait(backoff.next())
+
+    def close(self):
+        '''
+        Close the stream and every subscription
+        '''
+        self._stop.set()
+        resp = self._resp
+        if resp is not None:
+            _interrupt(resp)
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            subscription.close()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _interrupt(resp):
+    '''
+    Unblock the thread reading a streamed ``requests`` response
+    '''
+    try:
+        resp.raw.shutdown()
+    except (AttributeError, ValueError, RuntimeError, OSError):
+        # urllib3 < 2.3 has no shutdown
+        sock = getattr(getattr(resp.raw, 'connection', None), 'sock', None)
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except (OSError, socket.error):
+                pass
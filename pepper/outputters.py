@@ -0,0 +1,133 @@
+'''
+An index of the outputters declared by Salt execution modules
+
+Execution modules pick the outputter for some of their functions with an
+``__outputter__`` dictionary, ``state.apply`` uses ``highstate`` for example.
+Reading that attribute through ``salt.loader.minion_mods`` loads every
+execution module, which takes seconds, so the outputters are collected once and
+stored in a small JSON file.
+
+The file is keyed by the Salt version and the modification times of the
+module files; it is rebuilt when either changes.
+
+'''
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OUTPUTTER = 'nested'
+
+
+def _salt_version():
+    try:
+        from importlib import metadata
+        return metadata.version('salt')
+    except Exception:
+        # not installed as a distribution, e.g. running from a checkout
+        import salt.version
+        return salt.version.__version__
+
+
+class OutputterIndex(object):
+    '''
+    Map execution module functions to the outputter they declare
+
+    >>> index = OutputterIndex('~/.cache/pepper/outputters.json', opts)
+    >>> index.get('state.apply')
+    'highstate'
+    >>> index.get('test.ping')
+    'nested'
+    '''
+    def __init__(self, path, opts):
+        self.path = os.path.expanduser(path)
+        self.opts = opts
+        self._outputters = None
+
+    def module_dirs(self):
+        '''
+        The directories execution modules are loaded from
+        '''
+        spec = importlib.util.find_spec('salt')
+        dirs = [os.path.join(os.path.dirname(spec.origin), 'modules')]
+        if self.opts.get('extension_modules'):
+            dirs.append(os.path.join(self.opts['extension_modules'], 'modules'))
+        for module_dir in self.opts.get('module_dirs') or []:
+            dirs.extend([module_dir, os.path.join(module_dir, 'modules')])
+        return dirs
+
+    def fingerprint(self):
+        '''
+        Hash the Salt version and the modification times of the modules
+        '''
+        digest = hashlib.sha1(_salt_version().encode('utf-8'))
+        for module_dir in self.module_dirs():
+            try:
+                entries = sorted(os.scandir(module_dir), key=lambda entry: entry.name)
+            except OSError:
+                continue
+            digest.update(module_dir.encode('utf-8'))
+            for entry in entries:
+                try:
+                    mtime = entry.stat().st_mtime
+                except OSError:
+                    continue
+                digest.update('{0}:{1!r}'.format(entry.name, mtime).encode('utf-8'))
+        return digest.hexdigest()
+
+    def build(self):
+        '''
+        Load all execution modules and collect their outputters
+        '''
+        import salt.loader
+
+        logger.info('Building the outputter index, this only happens when Salt or its modules change')
+        outputters = {}
+        for name, func in salt.loader.minion_mods(self.opts).items():
+            outputter = getattr(func, '__outputter__', None)
+            if outputter:
+                outputters[name] = outputter
+        return outputters
+
+    def load(self):
+        '''
+        Read the index from disk, rebuilding and saving it if it is stale
+        '''
+        fingerprint = self.fingerprint()
+        try:
+            with open(self.path) as f:
+                index = json.load(f)
+            if index['fingerprint'] == fingerprint:
+                return index['outputters']
+            logger.debug('Outputter index %s is stale', self.path)
+        except (IOError, OSError, ValueError, KeyError, TypeError) as exc:
+            logger.debug('Unable to read the outputter index %s: %s', self.path, exc)
+
+        outputters = self.build()
+        self.save(fingerprint, outputters)
+        return outputters
+
+    def save(self, fingerprint, outputters):
+        '''
+        Atomically write the index
+        '''
+        tmp = '{0}.{1}.tmp'.format(self.path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(self.path)):
+                os.makedirs(os.path.dirname(self.path))
+            with open(tmp, 'w') as f:
+                json.dump({'fingerprint': fingerprint, 'outputters': outputters}, f)
+            os.replace(tmp, self.path)
+        except (IOError, OSError) as exc:
+            logger.warning('Unable to save the outputter index to %s: %s', self.path, exc)
+
+    def get(self, fun, default=DEFAULT_OUTPUTTER):
+        '''
+        Return the outputter declared for ``fun``
+        '''
+        if self._outputters is None:
+            self._outputters = self.load()
+        return self._outputters.get(fun, default)
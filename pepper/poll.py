@@ -0,0 +1,77 @@
+'''
+Helpers for waiting on salt-api
+
+Polling at a fixed interval is either slow to notice quick returns or hammers
+the master while waiting for slow ones. :class:`Backoff` starts polling fast
+and backs off exponentially, with jitter so that many clients started together
+do not poll in lockstep.
+
+'''
+import math
+import random
+
+
+class Backoff(object):
+    '''
+    Exponentially growing delays with jitter
+
+    The n-th delay is ``initial * factor ** n``, capped at ``maximum``, minus
+    a random fraction of at most ``jitter`` of it.
+
+    >>> backoff = Backoff(initial=0.5, maximum=4, jitter=0)
+    >>> [backoff.next() for _ in range(5)]
+    [0.5, 1.0, 2.0, 4.0, 4.0]
+
+    :param initial: the first delay, in seconds
+
+    :param maximum: the longest delay, in seconds
+
+    :param factor: the growth of the delay between attempts
+
+    :param jitter: the fraction of the delay which is randomised
+    '''
+    def __init__(self, initial=0.25, maximum=3, factor=2, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.attempt = 0
+
+    def next(self):
+        '''
+        Return the next delay
+        '''
+        delay = self.initial * self.factor ** self.attempt
+        if delay < self.maximum:
+            self.attempt += 1
+        else:
+            # stop growing the exponent once capped, or it overflows a float
+            delay = self.maximum
+        return delay * (1 - self.jitter * random.random())
+
+    __next__ = next
+
+    def __iter__(self):
+        return self
+
+    def reset(self):
+        '''
+        Start again from the initial delay
+        '''
+        self.attempt = 0
+
+
+def quorum_size(quorum, total):
+    '''
+    Resolve a quorum, a number of minions or a percentage such as ``'90%'``,
+    to a number of minions; percentages are rounded up
+
+    >>> quorum_size('90%', 55)
+    50
+    >>> quorum_size(3, 55)
+    3
+    '''
+    quorum = str(quorum).strip()
+    if quorum.endswith('%'):
+        return min(total, int(math.ceil(total * float(quorum[:-1]) / 100)))
+    return min(total, int(quorum))
@@ -3,6 +3,122 @@ A retcode validator
 
 '''
 
+# the validation policies, named after their command line options
+POLICIES = ('fail_any', 'fail_any_none', 'fail_all', 'fail_all_none')
+
+# entries the CLI adds to a result to report on minions rather than returns
+REPORTS = ('Failed', 'Stragglers', 'Not run', 'Aborted')
+
+
+def _is_master_result(chunk):
+    '''
+    Whether a chunk is the result of a runner or wheel function, such as
+    ``{'fun': 'runner.jobs.list_jobs', 'jid': ..., 'return': ...}``, rather
+    than minion returns
+    '''
+    if 'tag' in chunk and isinstance(chunk.get('data'), dict):
+        chunk = chunk['data']
+    return str(chunk.get('fun', '')).startswith(('runner.', 'wheel.'))
+
+
+class RetcodeSummary(object):
+    '''
+    Aggregate the retcodes of minion returns in a single pass
+
+    Results may be added one chunk at a time, as they are streamed; only the
+    counts and the names of the minions which need reporting are kept.
+
+    >>> summary = RetcodeSummary()
+    >>> summary.add([{'ms-0': {'ret': True, 'retcode': 0}, 'ms-1': {'ret': False, 'retcode': 2}}])
+    >>> summary.add([{'ms-2': True}])
+    >>> summary.counts, summary.failed, summary.missing
+    ({0: 1, 2: 1}, ['ms-1'], ['ms-2'])
+    '''
+    def __init__(self):
+        #: ``{retcode: number of minions}``
+        self.counts = {}
+        #: minions which returned a non-zero retcode
+        self.failed = []
+        #: minions whose return has no retcode
+        self.missing = []
+        #: ``(minion_id, retcode, jid)`` of the first non-zero retcode
+        self.first_failure = None
+
+    @classmethod
+    def of(cls, result):
+        summary = cls()
+        summary.add(result)
+        return summary
+
+    def add(self, result):
+        '''
+        Add the minion returns of a result, a list of ``{minion_id: return}``
+        dictionaries or a salt-api response holding one
+
+        The results of runner and wheel functions hold no minion returns and
+        are left out.
+        '''
+        if isinstance(result, dict) and 'return' in result:
+            result = result['return']
+        if not isinstance(result, list):
+            return
+        for chunk in result:
+            if not isinstance(chunk, dict) or _is_master_result(chunk):
+                continue
+            for minion, ret in chunk.items():
+                if minion in REPORTS:
+                    continue
+                retcode = ret.get('retcode') if isinstance(ret, dict) else None
+                if retcode is None:
+                    self.missing.append(minion)
+                    continue
+                self.counts[retcode] = self.counts.get(retcode, 0) + 1
+                if retcode != 0:
+                    self.failed.append(minion)
+                    if self.first_failure is None:
+                        self.first_failure = (minion, retcode, ret.get('jid'))
+
+    @property
+    def total(self):
+        '''
+        The number of returns with a retcode
+        '''
+        return sum(self.counts.values())
+
+    def fail_any(self, none=False):
+        '''
+        The first non-zero retcode if any retcode is non zero, otherwise 0,
+        or -1 with ``none`` if there are no retcodes at all
+        '''
+        if none and not self.total:
+            return -1
+        return self.first_failure[1] if self.first_failure else 0
+
+    def fail_all(self, none=False):
+        '''
+        The first non-zero retcode if all retcodes are non zero, otherwise 0,
+        or -1 with ``none`` if there are no retcodes at all
+        '''
+        if not self.total:
+            return -1 if none else 0
+        if self.counts.get(0):
+            return 0
+        return self.first_failure[1]
+
+    def report(self):
+        '''
+        Return the summary as a dictionary for display
+        '''
+        report = {
+            'Returned': self.total + len(self.missing),
+            'Retcodes': dict((str(retcode), count) for retcode, count in sorted(self.counts.items())),
+        }
+        if self.failed:
+            report['Failed'] = self.failed
+        if self.missing:
+            report['Missing retcode'] = self.missing
+        return report
+
 
 class PepperRetcode(object):
     '''
@@ -15,18 +131,20 @@ class PepperRetcode(object):
 
         :param options: optparse options
 
-        :param result: dictionary from Saltstack master
+        :param result: dictionary from Saltstack master, or a
+            :class:`RetcodeSummary` of the returns
 
         :return: exit code
         '''
+        summary = result if isinstance(result, RetcodeSummary) else RetcodeSummary.of(result)
         if options.fail_any:
-            return self.validate_fail_any(result)
+            return summary.fail_any()
         if options.fail_any_none:
-            return self.validate_fail_any_none(result)
+            return summary.fail_any(none=True)
         if options.fail_all:
-            return self.validate_fail_all(result)
+            return summary.fail_all()
         if options.fail_all_none:
-            return self.validate_fail_all_none(result)
+            return summary.fail_all(none=True)
         return 0
 
     @staticmethod
@@ -40,14 +158,7 @@ class PepperRetcode(object):
 
         :return: exit code
         '''
-        if isinstance(result, list):
-            if isinstance(result[0], dict):
-                minion = result[0]
-                retcodes = list(minion[name].get('retcode')
-                                for name in minion if isinstance(minion[name], dict) and
-                                minion[name].get('retcode') is not None)
-                return next((r for r in retcodes if r != 0), 0)
-        return 0
+        return RetcodeSummary.of(result).fail_any()
 
     @staticmethod
     def validate_fail_any_none(result):
@@ -60,16 +171,7 @@ class PepperRetcode(object):
 
         :return: exit code
         '''
-        if isinstance(result, list):
-            if isinstance(result[0], dict):
-                minion = result[0]
-                retcodes = list(minion[name].get('retcode')
-                                for name in minion if isinstance(minion[name], dict) and
-                                minion[name].get('retcode') is not None)
-                if not retcodes:
-                    return -1  # there are no retcodes
-                return next((r for r in retcodes if r != 0), 0)
-        return -1
+        return RetcodeSummary.of(result).fail_any(none=True)
 
     @staticmethod
     def validate_fail_all(result):
@@ -82,15 +184,7 @@ class PepperRetcode(object):
 
         :return: exit code
         '''
-        if isinstance(result, list):
-            if isinstance(result[0], dict):
-                minion = result[0]
-                retcodes = list(minion[name].get('retcode')
-                                for name in minion if isinstance(minion[name], dict) and
-                                minion[name].get('retcode') is not None)
-                if all(r != 0 for r in retcodes):
-                    return next((r for r in retcodes if r != 0), 0)
-        return 0
+        return RetcodeSummary.of(result).fail_all()
 
     @staticmethod
     def validate_fail_all_none(result):
@@ -103,16 +197,47 @@ class PepperRetcode(object):
 
         :return: exit code
         '''
-        if isinstance(result, list):
-            if isinstance(result[0], dict):
-                minion = result[0]
-                retcodes = list(minion[name].get('retcode')
-                                for name in minion if isinstance(minion[name], dict) and
-                                minion[name].get('retcode') is not None)
-                if not retcodes:
-                    return -1  # there are no retcodes
-                if all(r != 0 for r in retcodes):
-                    return next((r for r in retcodes if r != 0), 0)
-                else:
-                    return 0
-        return -1
+        return RetcodeSummary.of(result).fail_all(none=True)
+
+
+class RetcodeEvaluator(object):
+    '''
+    Evaluate the retcodes of minion returns as they arrive
+
+    Returns are fed one chunk at a time; :meth:`feed` returns the exit code
+    as soon as it is decided, which for the ``fail_any`` policies is when the
+    first minion returns a non-zero retcode.
+
+    >>> evaluator = RetcodeEvaluator('fail_any')
+    >>> evaluator.feed([{'ms-0': {'ret': True, 'retcode': 0, 'jid': '1'}}])
+    >>> evaluator.feed([{'ms-1': {'ret': False, 'retcode': 2, 'jid': '1'}}])
+    2
+    >>> evaluator.failed
+    ('ms-1', 2, '1')
+
+    :param policy: one of :data:`POLICIES`, or None to never fail
+    '''
+    def __init__(self, policy=None):
+        self.policy = policy
+        self.summary = RetcodeSummary()
+
+    @classmethod
+    def from_options(cls, options):
+        return cls(next((name for name in POLICIES if getattr(options, name, None)), None))
+
+    @property
+    def failed(self):
+        '''
+        ``(minion_id, retcode, jid)`` of the first non-zero retcode
+        '''
+        return self.summary.first_failure
+
+    def feed(self, result):
+        '''
+        Consume a chunk of returns; returns the exit code if it is decided
+        already, None otherwise
+        '''
+        self.summary.add(result)
+        if self.failed is not None and self.policy in ('fail_any', 'fail_any_none'):
+            return self.failed[1]
+        return None
@@ -0,0 +1,228 @@
+'''
+Retries and circuit breaking for salt-api requests
+
+salt-api usually sits behind a load balancer which resets connections or
+answers 502/503 while the master restarts. :class:`RetryPolicy` decides which
+failed requests may be sent again, and when: requests which can not have
+changed anything on the master are retried after any transient failure, other
+ones only when the request never reached salt-api or salt-api declined it.
+
+:class:`CircuitBreaker` stops sending requests to an endpoint which keeps
+failing, so that callers fail fast instead of piling up while the master is
+down.
+
+'''
+import email.utils
+import errno
+import fnmatch
+import logging
+import socket
+import ssl
+import threading
+import time
+
+from pepper.exceptions import PepperCircuitOpenException
+from pepper.poll import Backoff
+
+logger = logging.getLogger(__name__)
+
+# functions which only read state, so sending them twice is harmless
+READ_ONLY_FUNCTIONS = (
+    'test.ping', 'test.version', 'test.versions_report', 'test.echo',
+    'grains.get', 'grains.item', 'grains.items', 'grains.ls',
+    'pillar.get', 'pillar.item', 'pillar.items', 'pillar.ls',
+    'config.get', 'sys.*', 'status.*',
+    'saltutil.find_job', 'saltutil.running',
+    'jobs.active', 'jobs.list_job', 'jobs.list_jobs', 'jobs.lookup_jid', 'jobs.print_job',
+    'manage.status', 'manage.up', 'manage.down', 'manage.present', 'manage.not_present',
+    'key.list', 'key.list_all', 'key.finger', 'key.print', 'key.name_match',
+)
+
+# salt-api declined the request without running it
+DECLINED_STATUSES = (429, 503)
+
+# the request may have been run before the gateway gave up on it
+GATEWAY_STATUSES = (502, 504)
+
+# the responses which count as failures of the endpoint
+BREAKER_STATUSES = (502, 503, 504)
+
+# the request did not leave this host
+UNSENT_ERRNOS = (errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH)
+
+
+def _unsent(exc):
+    '''
+    Whether a connection error happened before the request was sent
+    '''
+    if isinstance(exc, socket.gaierror):
+        return True
+    return isinstance(exc, (OSError, socket.error)) and getattr(exc, 'errno', None) in UNSENT_ERRNOS
+
+
+class RetryPolicy(object):
+    '''
+    Decide whether and when a failed request is sent again
+
+    Idempotent requests (``GET``, ``/login``, ``/token`` and lowstates only
+    calling :data:`READ_ONLY_FUNCTIONS`) are retried after connection errors
+    and 429, 502, 503 or 504 responses. Other requests are only retried when
+    the connection could not be opened or salt-api answered 429 or 503.
+
+    The delay between attempts grows exponentially with jitter; a
+    ``Retry-After`` header sets the minimum delay.
+
+    >>> api = Pepper('https://salt-api:8000', retry=RetryPolicy(retries=5, maximum=30))
+
+    :param retries: the number of times a request is sent again, 0 to never
+        retry
+
+    :param initial: the first delay, in seconds
+
+    :param maximum: the longest delay, in seconds
+
+    :param max_retry_after: give up rather than wait longer than this many
+        seconds when salt-api asks to with ``Retry-After``
+
+    :param read_only: ``fnmatch`` patterns of the functions which are safe to
+        run twice
+    '''
+    def __init__(self, retries=3, initial=0.5, maximum=10, max_retry_after=60, read_only=READ_ONLY_FUNCTIONS):
+        self.retries = retries
+        self.initial = initial
+        self.maximum = maximum
+        self.max_retry_after = max_retry_after
+        self.read_only = read_only
+
+    def backoff(self):
+        return Backoff(initial=self.initial, maximum=self.maximum)
+
+    def is_read_only(self, fun):
+        if isinstance(fun, (list, tuple)):
+            return all(self.is_read_only(name) for name in fun)
+        return any(fnmatch.fnmatchcase(str(fun), pattern) for pattern in self.read_only)
+
+    def is_idempotent(self, method, path, data=None):
+        '''
+        Whether sending the request twice has the same effect as sending it
+        once
+        '''
+        if method == 'GET' or path in ('/login', '/token'):
+            return True
+        lowstates = data if isinstance(data, list) else [data]
+        return all(isinstance(low, dict) and self.is_read_only(low.get('fun')) for low in lowstates)
+
+    def should_retry(self, attempt, idempotent, error=None, status=None):
+        '''
+        Whether to retry a request after its ``attempt``-th attempt failed
+        with the connection ``error`` or the response ``status``
+        '''
+        if attempt >= self.retries or isinstance(error, ssl.SSLCertVerificationError):
+            return False
+        if error is not None:
+            return idempotent or _unsent(error)
+        if status in DECLINED_STATUSES:
+            return True
+        return idempotent and status in GATEWAY_STATUSES
+
+    def retry_after(self, headers):
+        '''
+        Return the delay requested by a ``Retry-After`` header, in seconds
+        '''
+        value = headers.get('Retry-After') if headers is not None else None
+        if not value:
+            return None
+        value = value.strip()
+        if value.isdigit():
+            return int(value)
+        parsed = email.utils.parsedate_tz(value)
+        if parsed is None:
+            return None
+        return max(0, email.utils.mktime_tz(parsed) - time.time())
+
+    def delay(self, backoff, headers=None):
+        '''
+        Return the delay before the next attempt, or None if salt-api asked to
+        wait longer than ``max_retry_after``
+        '''
+        delay = backoff.next()
+        retry_after = self.retry_after(headers)
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            delay = max(delay, retry_after)
+        return delay
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class CircuitBreaker(object):
+    '''
+    Fail fast while an endpoint keeps failing
+
+    The breaker opens after ``threshold`` consecutive failures, and requests
+    raise :class:`~pepper.exceptions.PepperCircuitOpenException` without
+    being sent. After ``reset_timeout`` seconds a single request is let
+    through: the breaker closes if it succeeds and opens again otherwise.
+
+    :param endpoint: the endpoint name, for messages
+
+    :param threshold: the number of consecutive failures opening the breaker,
+        0 to never open it
+
+    :param reset_timeout: seconds to wait before probing the endpoint again
+    '''
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half-open'
+
+    def __init__(self, endpoint, threshold=5, reset_timeout=30):
+        self.endpoint = endpoint
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if time.time() - self.opened_at < self.reset_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def before_request(self):
+        '''
+        :raises PepperCircuitOpenException: if the request must not be sent
+        '''
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                logger.info('Probing %s again', self.endpoint)
+                return
+            remaining = max(0, self.opened_at + self.reset_timeout - time.time())
+        raise PepperCircuitOpenException(
+            '{0} is unavailable after {1} failures; not retrying for {2:.0f}s'.format(
+                self.endpoint, self.failures, remaining))
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info('%s is available again', self.endpoint)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._probing or (self.opened_at is None and self.threshold and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    logger.warning('%s failed %s times in a row, failing fast for %ss',
+                                   self.endpoint, self.failures, self.reset_timeout)
+                self.opened_at = time.time()
+            self._probing = False
@@ -0,0 +1,168 @@
+'''
+Client-side rolling batches
+
+salt-api's ``local_batch`` client answers once the whole batch has finished.
+:class:`RollingBatch` runs the batches itself with ``local_async`` instead:
+the target is expanded once, a window of minions is kept busy and refilled as
+minions return, and every return is yielded as soon as it is seen.
+
+'''
+import collections
+import logging
+import time
+
+from pepper.libpepper import JobTracker
+
+logger = logging.getLogger(__name__)
+
+
+def window_size(size, total):
+    '''
+    Resolve a batch size, a number of minions or a percentage such as
+    ``'10%'``, to a number of minions
+
+    >>> window_size('10%', 55)
+    5
+    >>> window_size(3, 55)
+    3
+    '''
+    size = str(size).strip()
+    if size.endswith('%'):
+        return max(1, int(total * float(size[:-1]) / 100))
+    return max(1, int(size))
+
+
+class RollingBatch(object):
+    '''
+    Run a command on the minions matched by a target, keeping at most
+    ``size`` of them busy at a time
+
+    Iterating yields ``(minion_id, return)`` pairs as the minions return,
+    where ``return`` has the ``ret``, ``retcode`` and ``jid`` keys of a
+    ``full_return``.
+
+    .. code-block:: python
+
+        batch = RollingBatch(api, 'web*', 'state.apply', size='25%', max_failures=2)
+        for minion, ret in batch:
+            print(minion, ret['retcode'])
+        if batch.aborted:
+            print('Not run on', batch.not_run)
+
+    :param api: a logged in :class:`pepper.Pepper`
+
+    :param size: the window, a number of minions or a percentage of the
+        matched minions
+
+    :param max_failures: stop starting the command on more minions once more
+        than this many minions failed; a minion fails when it returns a
+        non-zero retcode or does not return within ``timeout``
+
+    :param timeout: seconds to wait for a minion to return
+
+    :param poll_interval: seconds between looking up the running jobs
+
+    :param low: a callable sending a list of lowstates, ``api.low`` by
+        default
+    '''
+    def __init__(self, api, tgt, fun, arg=None, kwarg=None, tgt_type='glob', size=10,
+                 max_failures=None, timeout=60, poll_interval=1, ret=None, low=None):
+        self.api = api
+        self.tgt = tgt
+        self.fun = fun
+        self.arg = arg
+        self.kwarg = kwarg
+        self.tgt_type = tgt_type
+        self.size = size
+        self.max_failures = max_failures
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.ret = ret
+        self._low = low or api.low
+        self._tracker = JobTracker(api, low=self._low)
+
+        #: the minions matched by the target
+        self.minions = None
+        #: minions which returned a non-zero retcode
+        self.failed = []
+        #: minions which did not return in time
+        self.missing = []
+        #: minions the command was not started on after an abort
+        self.not_run = []
+        self.aborted = False
+
+    def expand(self):
+        '''
+        Return the minions matched by the target
+        '''
+        low = {'client': 'local_async', 'tgt': self.tgt, 'tgt_type': self.tgt_type, 'fun': 'test.ping'}
+        return list(self._low([low])['return'][0].get('minions', []))
+
+    def dispatch(self, minions):
+        '''
+        Start the command on a list of minions and return the job id and the
+        minions the master accepted
+        '''
+        low = {'client': 'local_async', 'tgt': minions, 'tgt_type': 'list', 'fun': self.fun, 'arg': self.arg or []}
+        if self.kwarg:
+            low['kwarg'] = self.kwarg
+        if self.ret:
+            low['ret'] = self.ret
+        job = self._low([low])['return'][0] or {}
+        return job.get('jid'), job.get('minions', [])
+
+    def lookup(self, jids):
+        '''
+        Look up the results of several jobs in a single request
+
+        Returns ``{jid: {minion_id: return}}``.
+        '''
+        return self._tracker.lookup(jids)
+
+    def _check_abort(self):
+        if self.max_failures is not None and not self.aborted and \
+                len(self.failed) + len(self.missing) > self.max_failures:
+            logger.error('%s minions failed, not starting %s on more minions',
+                         len(self.failed) + len(self.missing), self.fun)
+            self.aborted = True
+
+    def __iter__(self):
+        self.minions = self.expand()
+        pending = collections.deque(self.minions)
+        size = window_size(self.size, len(self.minions))
+        # minion -> (jid, deadline)
+        running = {}
+
+        while pending or running:
+            if not self.aborted and pending and len(running) < size:
+                batch = [pending.popleft() for _ in range(min(size - len(running), len(pending)))]
+                jid, accepted = self.dispatch(batch)
+                deadline = time.time() + self.timeout
+                for minion in batch:
+                    if jid and minion in accepted:
+                        running[minion] = (jid, deadline)
+                    else:
+                        self.missing.append(minion)
+                self._check_abort()
+
+            if not running:
+                if self.aborted:
+                    break
+                continue
+
+            time.sleep(self.poll_interval)
+            results = self.lookup(sorted(set(jid for jid, _ in running.values())))
+            now = time.time()
+            for minion, (jid, deadline) in sorted(running.items()):
+                if minion in results.get(jid, {}):
+                    ret = results[jid][minion]
+                    del running[minion]
+                    if ret['retcode']:
+                        self.failed.append(minion)
+                    yield minion, ret
+                elif now > deadline:
+                    del running[minion]
+                    self.missing.append(minion)
+            self._check_abort()
+
+        self.not_run = list(pending)
@@ -4,127 +4,276 @@ A CLI interface to a remote salt-api instance
 '''
 from __future__ import print_function
 
-import sys
+import errno
+import importlib.util
 import json
 import logging
+import os
+import sys
 
+from pepper import codec
 from pepper.cli import PepperCli
-from pepper.retcode import PepperRetcode
+from pepper.outputters import OutputterIndex, DEFAULT_OUTPUTTER
+from pepper.retcode import PepperRetcode, RetcodeSummary
+from pepper.sink import BUFFER_SIZE, OutputSink
 from pepper.exceptions import (
     PepperException,
     PepperAuthException,
     PepperArgumentsException,
 )
 
-try:
-    import salt.loader
-    import salt.config
-    import salt.output
-    HAS_SALT = True
-except ImportError:
-    HAS_SALT = False
+# Salt takes a long time to import; it is only imported when a Salt outputter
+# is used
+HAS_SALT = importlib.util.find_spec('salt') is not None
+
+# outputters pepper can print on its own, mimicking the Salt outputter
+NATIVE_OUTPUTTERS = ('json',)
+
+# one JSON document per minion return and line; not a Salt outputter
+NDJSON = 'ndjson'
 
 logger = logging.getLogger(__name__)
 
 
 class Pepper(object):
-    def __init__(self):
-        self.cli = PepperCli()
-        if HAS_SALT:
-            self.opts = salt.config.client_config(self.cli.options.master)
-        else:
-            self.opts = {}
-        if self.cli.options.output_file is not None:
-            self.opts['output_file'] = self.cli.options.output_file
+    def __init__(self, cli=None, opts=None, stdout=None, stderr=None):
+        self.cli = cli or PepperCli()
+        self._opts = opts
+        self._sink = None
+        self.stdout = stdout
+        self.stderr = stderr
+
+    @property
+    def sink(self):
+        '''
+        The :class:`pepper.sink.OutputSink` writing to ``--output-file``,
+        opened on first use
+        '''
+        if self._sink is None and self.cli.options.output_file is not None:
+            options = self.cli.options
+            self._sink = OutputSink(
+                options.output_file,
+                append=options.output_file_append,
+                compress=options.output_file_gzip,
+                flush=options.output_file_flush or BUFFER_SIZE)
+        return self._sink
+
+    @property
+    def opts(self):
+        '''
+        The Salt client configuration, read on first use
+        '''
+        if self._opts is None:
+            if HAS_SALT:
+                import salt.config
+                self._opts = salt.config.client_config(self.cli.options.master)
+            else:
+                self._opts = {}
+        if self.sink is not None and self._opts.get('output_file') is not self.sink:
+            self._opts['output_file'] = self.sink
+        return self._opts
+
+    @property
+    def salt_outputters(self):
+        '''
+        Whether results are printed by the Salt outputters
+
+        Outputters pepper implements itself are used instead unless the master
+        configuration file, which may configure them, exists.
+        '''
+        if not HAS_SALT:
+            return False
+        return (self.cli.options.output not in NATIVE_OUTPUTTERS
+                or os.path.isfile(self.cli.options.master))
 
     @property
     def output(self):
-        if not hasattr(self, 'modules'):
-            self.modules = salt.loader.minion_mods(self.opts)
+        if not hasattr(self, 'outputters'):
+            self.outputters = OutputterIndex(self.cli.options.outputter_cache, self.opts)
         try:
-            oput = self.modules[self.cli.args[1]].__outputter__
-        except (KeyError, AttributeError, TypeError):
-            oput = 'nested'
-        return oput
+            return self.outputters.get(self.cli.args[1])
+        except (IndexError, TypeError):
+            return DEFAULT_OUTPUTTER
 
-    def __call__(self):
-        try:
-            for exit_code, result in self.cli.run():
-                if HAS_SALT and self.opts:
-                    logger.debug('Use Salt outputters')
-                    result = json.loads(result)
-
-                    # unwrap ret in some cases
-                    if 'return' in result:
-                        result = result['return']
-
-                    for ret in result:
-                        if isinstance(ret, dict):
-                            if self.cli.options.client.startswith('local'):
-                                for minionid, minionret in ret.items():
-                                    # rest_tornado doesnt return full_return directly
-                                    # it will always be from get_event, so the output differs slightly
-                                    if isinstance(minionret, dict) and 'return' in minionret:
-                                        # version >= 2017.7
-                                        salt.output.display_output(
-                                            {minionid: minionret['return']},
-                                            self.cli.options.output or minionret.get('out', None) or 'nested',
-                                            opts=self.opts
-                                        )
-                                    # cherrypy returns with ret via full_return
-                                    elif isinstance(minionret, dict) and 'ret' in minionret:
-                                        # version >= 2017.7
-                                        salt.output.display_output(
-                                            {minionid: minionret['ret']},
-                                            self.cli.options.output or minionret.get('out', None) or 'nested',
-                                            opts=self.opts
-                                        )
-                                    else:
-                                        salt.output.display_output(
-                                            {minionid: minionret},
-                                            self.cli.options.output or self.output,
-                                            opts=self.opts
-                                        )
-                            elif 'data' in ret:
-                                # unfold runners
-                                outputter = ret.get('outputter', 'nested')
-                                if isinstance(ret['data'], dict) and 'return' in ret['data']:
-                                    ret = ret['data']['return']
-                                salt.output.display_output(
-                                    ret,
-                                    self.cli.options.output or outputter,
-                                    opts=self.opts
-                                )
-                            else:
-                                salt.output.display_output(
-                                    {self.cli.options.client: ret},
-                                    self.cli.options.output or ret.get('outputter', 'nested'),
-                                    opts=self.opts
-                                )
+    def display(self, result):
+        '''
+        Display a result with the Salt outputters
+        '''
+        for ret in result:
+            if isinstance(ret, dict):
+                if self.cli.options.client.startswith('local'):
+                    for minionid, minionret in ret.items():
+                        # rest_tornado doesnt return full_return directly
+                        # it will always be from get_event, so the output differs slightly
+                        if isinstance(minionret, dict) and 'return' in minionret:
+                            # version >= 2017.7
+                            self.display_output(
+                                {minionid: minionret['return']},
+                                self.cli.options.output or minionret.get('out', None) or 'nested',
+                            )
+                        # cherrypy returns with ret via full_return
+                        elif isinstance(minionret, dict) and 'ret' in minionret:
+                            # version >= 2017.7
+                            self.display_output(
+                                {minionid: minionret['ret']},
+                                self.cli.options.output or minionret.get('out', None) or 'nested',
+                            )
                         else:
-                            salt.output.display_output(
-                                {self.cli.options.client: ret},
-                                self.cli.options.output or 'nested',
-                                opts=self.opts,
+                            self.display_output(
+                                {minionid: minionret},
+                                self.cli.options.output or self.output,
                             )
+                elif 'data' in ret:
+                    # unfold runners
+                    outputter = ret.get('outputter', 'nested')
+                    if isinstance(ret['data'], dict) and 'return' in ret['data']:
+                        ret = ret['data']['return']
+                    self.display_output(
+                        ret,
+                        self.cli.options.output or outputter,
+                    )
                 else:
-                    if self.cli.options.output_file is not None:
-                        with open(self.cli.options.output_file, 'a') as ofile:
-                            print(result, file=ofile)
-                    else:
-                        print(result)
-                if exit_code is not None:
-                    if exit_code == 0:
-                        return PepperRetcode().validate(self.cli.options, result)
-                    return exit_code
+                    self.display_output(
+                        {self.cli.options.client: ret},
+                        self.cli.options.output or ret.get('outputter', 'nested'),
+                    )
+            else:
+                self.display_output(
+                    {self.cli.options.client: ret},
+                    self.cli.options.output or 'nested',
+                )
+
+    def display_output(self, data, out):
+        '''
+        Print one unit of output, a minion return for example
+        '''
+        if self.salt_outputters:
+            import salt.output
+            salt.output.display_output(data, out, opts=self.opts)
+        else:
+            # the same formatting as the Salt json outputter
+            self.write(json.dumps(data, default=repr, indent=4, ensure_ascii=False))
+
+    def print_summary(self, summary):
+        '''
+        Print the retcode summary of the returns
+        '''
+        report = {'Summary': summary.report()}
+        if self.cli.options.output == NDJSON:
+            self.print_ndjson([report])
+        elif HAS_SALT:
+            self.display_output(report, self.cli.options.output or 'nested')
+        else:
+            self.print_json(report)
+
+    def print_ndjson(self, result):
+        '''
+        Print every return of a result as a compact JSON document on a line
+        of its own
+        '''
+        lines = []
+        for entry in result if isinstance(result, list) else [result]:
+            if isinstance(entry, dict):
+                lines.extend(codec.dumps({key: value}) for key, value in entry.items())
+            else:
+                lines.append(codec.dumps(entry))
+        if lines:
+            self.write(b'\n'.join(lines).decode('utf-8'))
+
+    def print_json(self, result):
+        '''
+        Print a result as JSON when Salt is not installed
+        '''
+        self.write(codec.dumps_pretty(result))
+
+    def write(self, text):
+        '''
+        Print text to the output file or stdout
+        '''
+        try:
+            print(text, file=self.sink or self.stdout or sys.stdout)
+        except (IOError, OSError) as exc:
+            if exc.errno != errno.EPIPE:
+                raise
+
+    def __call__(self):
+        if self.cli.options.daemon:
+            from pepper.daemon import PepperDaemon
+            try:
+                return PepperDaemon(
+                    self.cli.options.daemon_socket,
+                    idle_timeout=self.cli.options.daemon_idle_timeout,
+                ).serve_forever()
+            except PepperException as exc:
+                print('Pepper error: {0}'.format(exc), file=self.stderr or sys.stderr)
+                return 1
+
+        if not self.cli.options.no_daemon and os.path.exists(self.cli.options.daemon_socket):
+            from pepper.daemon import DaemonClient
+            try:
+                exit_code = DaemonClient(self.cli.options.daemon_socket).run(
+                    self.cli, self.stdout or sys.stdout, self.stderr or sys.stderr)
+            except (PepperException, PepperAuthException, PepperArgumentsException) as exc:
+                print('Pepper error: {0}'.format(exc), file=self.stderr or sys.stderr)
+                return 1
+            if exit_code is not None:
+                return exit_code
+
+        return self.render(self.cli.run(serialize=False))
+
+    def render(self, results):
+        '''
+        Print ``(exit_code, result)`` pairs and return the exit code
+
+        The retcodes of all the results are validated, not only those of the
+        last one, since returns may arrive one minion at a time. The output
+        of a run which failed does not replace ``--output-file``.
+        '''
+        stderr = self.stderr or sys.stderr
+        completed = False
+        try:
+            exit_code = self._render(results)
+            completed = True
+            return exit_code
         except (PepperException, PepperAuthException, PepperArgumentsException) as exc:
-            print('Pepper error: {0}'.format(exc), file=sys.stderr)
+            print('Pepper error: {0}'.format(exc), file=stderr)
             return 1
         except KeyboardInterrupt:
             # TODO: mimic CLI and output JID on ctrl-c
             return 0
         except Exception as e:
-            print(e)
-            print('Uncaught Pepper error (increase verbosity for the full traceback).', file=sys.stderr)
+            print(e, file=self.stdout or sys.stdout)
+            print('Uncaught Pepper error (increase verbosity for the full traceback).', file=stderr)
             logger.debug('Uncaught traceback:', exc_info=True)
             return 1
+        finally:
+            if self._sink is not None:
+                if completed:
+                    self._sink.close()
+                else:
+                    self._sink.discard()
+
+    def _render(self, results):
+        summary = RetcodeSummary()
+        exit_code = None
+        for exit_code, result in results:
+            if not HAS_SALT and self.cli.options.output != NDJSON:
+                self.print_json(result)
+
+            # unwrap ret in some cases
+            if isinstance(result, dict) and 'return' in result:
+                result = result['return']
+
+            if self.cli.options.output == NDJSON:
+                self.print_ndjson(result)
+            elif HAS_SALT:
+                self.display(result)
+            summary.add(result)
+            if exit_code is not None:
+                break
+
+        if self.cli.options.summary:
+            self.print_summary(summary)
+        if exit_code:
+            return exit_code
+        return PepperRetcode().validate(self.cli.options, summary)
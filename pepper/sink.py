@@ -0,0 +1,129 @@
+'''
+Buffered output to ``--output-file``
+
+The CLI prints one result per minion when it polls for returns; opening the
+output file for each of them is costly for large jobs. :class:`OutputSink`
+opens the file once and buffers what is written to it.
+
+'''
+import gzip
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# flush whenever this many bytes are buffered, by default
+BUFFER_SIZE = 65536
+
+
+class OutputSink(object):
+    '''
+    A text file object writing to a file opened once
+
+    In ``append`` mode output is added to the end of the file, as the Salt
+    outputters do. Otherwise it is written to a temporary file next to it
+    which replaces the file when the sink is closed, so readers never see a
+    partial output.
+
+    .. code-block:: python
+
+        with OutputSink('/var/log/pepper/highstate.json.gz', append=False, compress=True) as sink:
+            sink.write(text)
+
+    :param path: the output file
+
+    :param append: append to the file rather than replace it
+
+    :param compress: gzip the output; appended output is added as a new gzip
+        member, which ``gzip -d`` and ``zcat`` read as one stream
+
+    :param flush: ``'line'`` to write the output to the file after every
+        line, or the number of bytes to buffer before writing them
+    '''
+    def __init__(self, path, append=True, compress=False, flush=BUFFER_SIZE):
+        self.path = path
+        self.append = append
+        self.compress = compress
+        self.flush_policy = flush
+        self._buffer = bytearray()
+        self._file = None
+        self._target = path if append else self._temporary_path()
+        self.closed = False
+
+    def _temporary_path(self):
+        directory, name = os.path.split(self.path)
+        return os.path.join(directory, '.{0}.{1}.tmp'.format(name, os.getpid()))
+
+    def _open(self):
+        mode = 'ab' if self.append else 'wb'
+        if self.compress:
+            self._file = gzip.open(self._target, mode, compresslevel=6)
+        else:
+            self._file = open(self._target, mode)
+
+    def write(self, text):
+        data = text.encode('utf-8') if not isinstance(text, bytes) else text
+        self._buffer += data
+        if self.flush_policy == 'line':
+            if b'\n' in data:
+                self.flush()
+        elif len(self._buffer) >= self.flush_policy:
+            self.flush()
+        return len(text)
+
+    def flush(self):
+        '''
+        Write the buffered output to the file
+        '''
+        if self._file is None:
+            self._open()
+        if self._buffer:
+            self._file.write(bytes(self._buffer))
+            del self._buffer[:]
+        self._file.flush()
+
+    def isatty(self):
+        return False
+
+    def close(self):
+        '''
+        Write the remaining output and close the file, replacing the output
+        file unless appending
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self._file.close()
+        if not self.append:
+            os.replace(self._target, self.path)
+
+    def discard(self):
+        '''
+        Close the sink without replacing the output file; appended output is
+        still written, as the Salt outputters would have
+        '''
+        if self.closed:
+            return
+        self.closed = True
+        if self.append and self._buffer:
+            try:
+                self.flush()
+            except (IOError, OSError) as exc:
+                logger.debug('Unable to write to %s: %s', self.path, exc)
+        if self._file is not None:
+            self._file.close()
+        if not self.append:
+            try:
+                os.remove(self._target)
+            except OSError as exc:
+                logger.debug('Unable to remove %s: %s', self._target, exc)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,526 @@
+'''
+A keep-alive HTTP transport shared by all requests of one Pepper instance
+
+'''
+import collections
+import http.client as httplib
+import logging
+import os
+import select
+import ssl
+import threading
+import time
+import urllib.parse as urlparse
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Raised when the server silently closed a kept-alive connection
+STALE_CONNECTION_ERRORS = (
+    httplib.BadStatusLine,
+    httplib.CannotSendRequest,
+    BrokenPipeError,
+    ConnectionResetError,
+)
+
+# methods which may be sent twice without changing anything more
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+def _is_dropped(conn):
+    '''
+    Whether the server closed an idle connection, which then reads as ready
+    '''
+    if conn.sock is None:
+        return True
+    try:
+        return bool(select.select([conn.sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
+
+
+def create_ssl_context(verify=True, ca_bundle=None, client_cert=None, client_key=None):
+    '''
+    Build the SSL context shared by all the connections of a client
+
+    Loading certificates is costly, so it is done once here rather than for
+    every connection.
+
+    :param verify: verify the server certificate; without ``ca_bundle`` the
+        process default context is used, as for ``urllib``
+
+    :param ca_bundle: a file or directory of CA certificates the server
+        certificate is verified against
+
+    :param client_cert: a PEM file with the client certificate, and its key
+        unless ``client_key`` is given
+
+    :param client_key: the PEM file with the key of ``client_cert``
+    '''
+    if not verify:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    elif ca_bundle and os.path.isdir(ca_bundle):
+        context = ssl.create_default_context(capath=ca_bundle)
+    elif ca_bundle:
+        context = ssl.create_default_context(cafile=ca_bundle)
+    else:
+        context = ssl._create_default_https_context()
+    if client_cert:
+        context.load_cert_chain(client_cert, client_key)
+    return context
+
+
+class HTTPSConnection(httplib.HTTPSConnection):
+    '''
+    An HTTPS connection resuming a previous TLS session
+
+    Resuming a session skips the certificate exchange and verification of a
+    full handshake.
+    '''
+    def __init__(self, host, port=None, tls_session=None, **kwargs):
+        httplib.HTTPSConnection.__init__(self, host, port, **kwargs)
+        self.tls_session = tls_session
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        server_hostname = self._tunnel_host or self.host
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=server_hostname, session=self.tls_session)
+
+    def close(self):
+        # ``http.client`` closes the socket as soon as the headers of a
+        # ``Connection: close`` response are read
+        session = getattr(self.sock, 'session', None)
+        if session is not None:
+            self.tls_session = session
+        httplib.HTTPSConnection.close(self)
+
+
+class TransferStats(object):
+    '''
+    The bytes sent and received for a request
+
+    ``sent`` and ``received`` count the body bytes as they went over the
+    wire, ``sent_uncompressed`` and ``received_decoded`` the body bytes
+    before compression and after decompression.
+    '''
+    def __init__(self, method, url, sent=0, sent_uncompressed=None):
+        self.method = method
+        self.url = url
+        self.sent = sent
+        self.sent_uncompressed = sent if sent_uncompressed is None else sent_uncompressed
+        self.received = 0
+        self.received_decoded = 0
+
+    def __str__(self):
+        return '{0} {1}: sent {2} bytes ({3} uncompressed), received {4} bytes ({5} decoded)'.format(
+            self.method, self.url, self.sent, self.sent_uncompressed, self.received, self.received_decoded)
+
+
+class DeflateDecoder(object):
+    '''
+    Decode a ``deflate`` content encoding, zlib wrapped as the RFC says or
+    raw as some servers send it
+    '''
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._first = True
+
+    def decompress(self, data):
+        if not self._first:
+            return self._decoder.decompress(data)
+        self._first = False
+        try:
+            return self._decoder.decompress(data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            return self._decoder.decompress(data)
+
+    def flush(self):
+        return self._decoder.flush()
+
+
+def content_decoder(encoding):
+    '''
+    Return a decompressor for a ``Content-Encoding``, or None if the content
+    is not encoded
+
+    :raises ValueError: if the encoding is not supported
+    '''
+    encoding = (encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        return None
+    if encoding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if encoding == 'deflate':
+        return DeflateDecoder()
+    raise ValueError('Unsupported Content-Encoding: {0}'.format(encoding))
+
+
+class PooledResponse(object):
+    '''
+    A file-like HTTP response which hands its connection back to the pool
+    once the body has been fully read
+
+    Responses which are closed before the body is exhausted discard their
+    connection since it can not be reused for the next request.
+
+    Compressed bodies are decompressed while they are read; :attr:`stats`
+    counts the bytes received before and after decompression.
+    '''
+    def __init__(self, pool, key, conn, response, stats=None):
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+        self._response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.stats = stats if stats is not None else TransferStats(None, None)
+        self._decoder = content_decoder(response.getheader('Content-Encoding'))
+        self._decoded = bytearray()
+        self._callbacks = []
+
+    def add_done_callback(self, fn):
+        '''
+        Call ``fn`` without arguments once the response is read or closed
+        '''
+        if self._conn is None:
+            fn()
+        else:
+            self._callbacks.append(fn)
+
+    def _done(self):
+        callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn()
+
+    def getheader(self, name, default=None):
+        return self._response.getheader(name, default)
+
+    def _read_raw(self, read, *args):
+        data = read(*args)
+        self.stats.received += len(data)
+        if self._response.isclosed():
+            self._release()
+        return data
+
+    def _decode(self, data):
+        '''
+        Decompress the raw ``data`` into the decoded buffer, flushing the
+        decoder at the end of the body
+        '''
+        if data:
+            decoded = self._decoder.decompress(data)
+        else:
+            decoded = self._decoder.flush()
+        self.stats.received_decoded += len(decoded)
+        self._decoded += decoded
+
+    def _take(self, amt):
+        if amt is None or amt < 0 or amt >= len(self._decoded):
+            data = bytes(self._decoded)
+            del self._decoded[:]
+        else:
+            data = bytes(self._decoded[:amt])
+            del self._decoded[:amt]
+        return data
+
+    def read(self, amt=None):
+        if self._decoder is None:
+            data = self._read_raw(self._response.read, amt)
+            self.stats.received_decoded += len(data)
+            return data
+        if amt is None or amt < 0:
+            self._decode(self._read_raw(self._response.read))
+            self._decode(b'')
+            return self._take(None)
+        while len(self._decoded) < amt:
+            data = self._read_raw(self._response.read, amt)
+            self._decode(data)
+            if not data:
+                break
+        return self._take(amt)
+
+    def read1(self, amt=-1):
+        '''
+        Read at most ``amt`` bytes, waiting for the network only if nothing
+        is buffered
+        '''
+        if self._decoder is None:
+            data = self._read_raw(self._response.read1, amt)
+            self.stats.received_decoded += len(data)
+            return data
+        # a network read may not be enough to decode anything
+        while not self._decoded:
+            data = self._read_raw(self._response.read1, amt if amt and amt > 0 else 65536)
+            self._decode(data)
+            if not data:
+                break
+        return self._take(amt)
+
+    def readline(self, limit=-1):
+        if self._decoder is None:
+            data = self._read_raw(self._response.readline, limit)
+            self.stats.received_decoded += len(data)
+            return data
+        while b'\n' not in self._decoded and (limit < 0 or len(self._decoded) < limit):
+            data = self._read_raw(self._response.read1, 65536)
+            self._decode(data)
+            if not data:
+                break
+        end = self._decoded.find(b'\n') + 1 or len(self._decoded)
+        return self._take(end if limit < 0 else min(end, limit))
+
+    def __iter__(self):
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            yield line
+
+    def close(self):
+        if self._conn is None:
+            return
+        if not self._response.isclosed():
+            # the remainder of the body is still on the wire
+            self._response.close()
+            self._conn.close()
+            self._conn = None
+            self._done()
+            return
+        self._release()
+
+    def _release(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool._save_tls_session(self._key, conn)
+        if self._response.will_close:
+            conn.close()
+        else:
+            self._pool._put_conn(self._key, conn)
+        self._done()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ConnectionPool(object):
+    '''
+    A thread-safe pool of persistent HTTP/1.1 connections
+
+    Connections are kept per ``(scheme, host, port)``; at most ``maxsize``
+    idle connections are kept for each of them and connections idle for
+    longer than ``idle_timeout`` seconds are closed instead of being reused.
+
+    HTTPS connections share one SSL context, and new connections resume the
+    TLS session of the last connection to the same host.
+
+    The ``requests`` based code paths (kerberos auth and the GET/stream
+    helpers) get a :attr:`session` which is bounded and evicted the same way,
+    and uses ``session_ssl_context`` when it is given.
+
+    >>> pool = ConnectionPool(maxsize=4)
+    >>> with pool.urlopen('GET', 'http://localhost:8000/') as resp:
+    ...     body = resp.read()
+    '''
+    def __init__(self, maxsize=10, idle_timeout=60, timeout=None, debuglevel=0, ssl_context=None,
+                 session_ssl_context=None):
+        self.maxsize = maxsize
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.debuglevel = debuglevel
+        self.ssl_context = ssl_context
+        self.session_ssl_context = session_ssl_context
+        self._lock = threading.Lock()
+        self._idle = {}
+        self._tls_sessions = {}
+        self._session = None
+        self._session_used = 0
+
+    def _new_conn(self, key):
+        scheme, host, port = key
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+        if scheme == 'https':
+            if self.ssl_context is None:
+                self.ssl_context = create_ssl_context()
+            conn = HTTPSConnection(host, port, tls_session=self._tls_sessions.get(key),
+                                   context=self.ssl_context, **kwargs)
+        else:
+            conn = httplib.HTTPConnection(host, port, **kwargs)
+        conn.set_debuglevel(self.debuglevel)
+        return conn
+
+    def _evict(self, now):
+        '''
+        Drop connections which were idle for too long; the caller holds the lock
+        '''
+        expired = []
+        for key, idle in list(self._idle.items()):
+            while idle and now - idle[0][1] >= self.idle_timeout:
+                expired.append(idle.popleft()[0])
+            if not idle:
+                del self._idle[key]
+        return expired
+
+    def _get_conn(self, key):
+        '''
+        Return a ``(connection, reused)`` tuple for the given pool key
+        '''
+        conn = None
+        with self._lock:
+            expired = self._evict(time.time())
+            idle = self._idle.get(key)
+            while idle and conn is None:
+                conn = idle.pop()[0]
+                if _is_dropped(conn):
+                    expired.append(conn)
+                    conn = None
+        for stale in expired:
+            stale.close()
+        if conn is not None:
+            return conn, True
+        return self._new_conn(key), False
+
+    def _save_tls_session(self, key, conn):
+        '''
+        Remember the TLS session of a connection for the next connections to
+        the same host
+        '''
+        # TLS 1.3 sends the session ticket after the handshake, so the
+        # session is only known once a response was read
+        session = getattr(conn.sock, 'session', None) or getattr(conn, 'tls_session', None)
+        if session is not None:
+            self._tls_sessions[key] = session
+
+    def _put_conn(self, key, conn):
+        with self._lock:
+            expired = self._evict(time.time())
+            idle = self._idle.setdefault(key, collections.deque())
+            if len(idle) < self.maxsize:
+                idle.append((conn, time.time()))
+            else:
+                expired.append(conn)
+        for stale in expired:
+            stale.close()
+
+    def urlopen(self, method, url, body=None, headers=None, stats=None, idempotent=None):
+        '''
+        Send a request over a pooled connection
+
+        A request which could not be sent on a kept-alive connection the
+        server had closed is sent again on a new one. When the connection
+        fails after the request was sent, salt-api may have run it, so it is
+        only sent again if it is ``idempotent``; otherwise the error is
+        raised for the caller's retry policy to decide.
+
+        :param stats: the :class:`TransferStats` of the request, counting the
+            body it sends by default
+
+        :param idempotent: whether sending the request twice is harmless, by
+            default whether its method is ``GET``, ``HEAD`` or ``OPTIONS``
+
+        :rtype: :class:`PooledResponse`
+        '''
+        split = urlparse.urlsplit(url)
+        key = (split.scheme, split.hostname, split.port)
+        selector = split.path or '/'
+        if split.query:
+            selector = '{0}?{1}'.format(selector, split.query)
+        headers = headers or {}
+
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        conn, reused = self._get_conn(key)
+        sent = False
+        try:
+            conn.request(method, selector, body, headers)
+            sent = True
+            response = conn.getresponse()
+        except STALE_CONNECTION_ERRORS:
+            conn.close()
+            if not reused or (sent and not idempotent):
+                raise
+            if sent:
+                logger.debug('Connection to %s failed after sending an idempotent request, sending it again',
+                             split.netloc)
+            else:
+                logger.debug('Could not send the request on a kept-alive connection to %s, using a new one',
+                             split.netloc)
+            conn = self._new_conn(key)
+            try:
+                conn.request(method, selector, body, headers)
+                response = conn.getresponse()
+            except Exception:
+                conn.close()
+                raise
+        except Exception:
+            conn.close()
+            raise
+
+        if stats is None:
+            stats = TransferStats(method, url, len(body) if body else 0)
+        try:
+            return PooledResponse(self, key, conn, response, stats)
+        except ValueError:
+            conn.close()
+            raise
+
+    @property
+    def session(self):
+        '''
+        A ``requests.Session`` bounded to ``maxsize`` connections per host
+        '''
+        import requests
+
+        expired = None
+        with self._lock:
+            now = time.time()
+            if self._session is not None and now - self._session_used >= self.idle_timeout:
+                expired, self._session = self._session, None
+            if self._session is None:
+                session = requests.Session()
+                adapter = _adapter(requests, self.maxsize, self.session_ssl_context)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self._session = session
+            self._session_used = now
+            session = self._session
+        if expired is not None:
+            expired.close()
+        return session
+
+    def close(self):
+        '''
+        Close all idle connections
+        '''
+        with self._lock:
+            conns = [conn for idle in self._idle.values() for conn, _ in idle]
+            self._idle.clear()
+            session, self._session = self._session, None
+        for conn in conns:
+            conn.close()
+        if session is not None:
+            session.close()
+
+
+def _adapter(requests, maxsize, ssl_context):
+    '''
+    Return a ``requests`` adapter whose connections use ``ssl_context``, or
+    the ``requests`` default context if it is None
+    '''
+    class SSLContextAdapter(requests.adapters.HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            if ssl_context is not None:
+                kwargs['ssl_context'] = ssl_context
+            return super(SSLContextAdapter, self).init_poolmanager(*args, **kwargs)
+
+    return SSLContextAdapter(pool_maxsize=maxsize)
@@ -0,0 +1,487 @@
+'''
+A WebSocket client for the salt-api ``/ws`` event stream
+
+rest_cherrypy sends every Salt event as a text message once the client said
+``websocket client ready``; the message holds the JSON encoded event after a
+``data:`` prefix, as in the ``/events`` stream::
+
+    data: {"tag": "salt/job/20180414193904158892/new", "data": {...}}
+
+Each message is length prefixed, so it is decoded without scanning the stream
+for event boundaries. :class:`WebSocketProtocol` implements the client side of
+RFC 6455 without doing any I/O, so that :class:`WebSocket` and
+:class:`AsyncWebSocket` only move bytes between it and their socket.
+
+'''
+import asyncio
+import base64
+import hashlib
+import http.client as httplib
+import io
+import logging
+import os
+import socket
+import struct
+import urllib.parse as urlparse
+
+from pepper import codec
+from pepper.exceptions import PepperException
+
+logger = logging.getLogger(__name__)
+
+GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# the message which makes salt-api start sending events
+READY = 'websocket client ready'
+
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+
+# the longest handshake response accepted
+MAX_HEADER_SIZE = 65536
+
+
+class WebSocketClosed(PepperException):
+    '''
+    The connection was closed, cleanly or not
+    '''
+
+
+def accept_key(key):
+    '''
+    Return the ``Sec-WebSocket-Accept`` value expected for a
+    ``Sec-WebSocket-Key``
+    '''
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + GUID).digest()).decode('ascii')
+
+
+def _mask(payload, key):
+    if not payload:
+        return payload
+    length = len(payload)
+    repeated = (key * (length // 4 + 1))[:length]
+    return (int.from_bytes(payload, 'big') ^ int.from_bytes(repeated, 'big')).to_bytes(length, 'big')
+
+
+def encode_frame(opcode, payload=b'', fin=True):
+    '''
+    Encode a masked client frame
+    '''
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    head = bytearray([(0x80 if fin else 0) | opcode])
+    if length < 126:
+        head.append(0x80 | length)
+    elif length < 0x10000:
+        head.append(0x80 | 126)
+        head += struct.pack('!H', length)
+    else:
+        head.append(0x80 | 127)
+        head += struct.pack('!Q', length)
+    key = os.urandom(4)
+    return bytes(head) + key + _mask(payload, key)
+
+
+def handshake_request(url, headers=None):
+    '''
+    Return the upgrade request for a ``ws``, ``wss``, ``http`` or ``https``
+    URL, and the ``Sec-WebSocket-Key`` it sends
+    '''
+    split = urlparse.urlsplit(url)
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    lines = [
+        'GET {0} HTTP/1.1'.format((split.path or '/') + ('?' + split.query if split.query else '')),
+        'Host: {0}'.format(split.netloc),
+        'Upgrade: websocket',
+        'Connection: Upgrade',
+        'Sec-WebSocket-Key: {0}'.format(key),
+        'Sec-WebSocket-Version: 13',
+        'Origin: {0}://{1}'.format('https' if split.scheme in ('https', 'wss') else 'http', split.netloc),
+    ]
+    lines.extend('{0}: {1}'.format(name, value) for name, value in (headers or {}).items())
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'), key
+
+
+def check_handshake(head, key):
+    '''
+    Check the response to the upgrade request, given up to the blank line
+
+    :raises PepperException: if the server did not switch to the WebSocket
+        protocol
+    '''
+    status_line, _, rest = head.partition(b'\r\n')
+    try:
+        _, status, reason = status_line.decode('latin-1').split(' ', 2)
+        status = int(status)
+    except ValueError:
+        raise PepperException('Invalid WebSocket handshake response: {0!r}'.format(status_line))
+    headers = httplib.parse_headers(io.BytesIO(rest))
+    if status == 401:
+        raise PepperException('401:Authentication denied')
+    if status != 101:
+        raise PepperException('{0}:{1}'.format(status, reason.strip()))
+    if headers.get('Sec-WebSocket-Accept') != accept_key(key):
+        raise PepperException('Invalid Sec-WebSocket-Accept in the WebSocket handshake')
+    return headers
+
+
+def decode_event(message):
+    '''
+    Decode a salt-api event message, or return None if it is not one
+    '''
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    message = message.strip()
+    if message.startswith(b'data:'):
+        message = message[5:]
+    try:
+        return codec.loads(message)
+    except ValueError:
+        logger.debug('Unable to decode event message: %s', message)
+        return None
+
+
+class WebSocketProtocol(object):
+    '''
+    The client side of a WebSocket connection, without the I/O
+
+    Bytes received are given to :meth:`receive`, which returns the complete
+    messages; pings are answered and closing frames replied to by queuing
+    frames which :meth:`data_to_send` returns.
+
+    >>> protocol = WebSocketProtocol()
+    >>> protocol.receive(b'\\x81\\x05hel')
+    []
+    >>> protocol.receive(b'lo\\x89\\x00')
+    ['hello']
+    >>> len(protocol.data_to_send())  # the pong
+    6
+    '''
+    def __init__(self):
+        # received bytes not yet parsed into frames
+        self._buffer = bytearray()
+        self._fragments = []
+        self._opcode = None
+        self._outgoing = []
+        #: whether a closing frame was received
+        self.closed = False
+        #: whether a closing frame was sent
+        self.closing = False
+        #: whether a frame arrived since the last ping was sent
+        self.alive = True
+        #: the close code sent by the server
+        self.close_code = None
+
+    def receive(self, data):
+        '''
+        Feed received bytes and return the messages they completed, ``str``
+        for text messages and ``bytes`` for binary ones
+        '''
+        buf = self._buffer
+        buf += data
+        messages = []
+        # frames are parsed at an offset and the buffer trimmed once at the end
+        pos = 0
+        while not self.closed:
+            if len(buf) - pos < 2:
+                break
+            first, second = buf[pos], buf[pos + 1]
+            length = second & 0x7F
+            start = pos + 2
+            if length == 126:
+                if len(buf) - start < 2:
+                    break
+                length = struct.unpack_from('!H', buf, start)[0]
+                start += 2
+            elif length == 127:
+                if len(buf) - start < 8:
+                    break
+                length = struct.unpack_from('!Q', buf, start)[0]
+                start += 8
+            key = None
+            if second & 0x80:
+                if len(buf) - start < 4:
+                    break
+                key = bytes(buf[start:start + 4])
+                start += 4
+            if len(buf) - start < length:
+                break
+            payload = bytes(buf[start:start + length])
+            if key is not None:
+                payload = _mask(payload, key)
+            pos = start + length
+            self.alive = True
+
+            message = self._frame(first & 0x80, first & 0x0F, payload)
+            if message is not None:
+                messages.append(message)
+        del buf[:pos]
+        return messages
+
+    def _frame(self, fin, opcode, payload):
+        if opcode == OP_PING:
+            self._outgoing.append(encode_frame(OP_PONG, payload))
+            return None
+        if opcode == OP_PONG:
+            return None
+        if opcode == OP_CLOSE:
+            self.closed = True
+            self.close_code = struct.unpack('!H', payload[:2])[0] if len(payload) >= 2 else None
+            # a closing frame answering ours needs no reply
+            if not self.closing:
+                self.close(self.close_code)
+            return None
+        if opcode != OP_CONTINUATION:
+            self._opcode = opcode
+            self._fragments = []
+        self._fragments.append(payload)
+        if not fin:
+            return None
+        data = b''.join(self._fragments) if len(self._fragments) > 1 else self._fragments[0]
+        self._fragments = []
+        return data.decode('utf-8') if self._opcode == OP_TEXT else data
+
+    def send(self, message):
+        '''
+        Queue a text message, or a binary one if ``message`` is ``bytes``
+        '''
+        self._outgoing.append(encode_frame(OP_BINARY if isinstance(message, bytes) else OP_TEXT, message))
+
+    def ping(self, payload=b''):
+        self.alive = False
+        self._outgoing.append(encode_frame(OP_PING, payload))
+
+    def close(self, code=1000):
+        '''
+        Queue a closing frame with ``code``, or without a code if it is None;
+        only the first call queues one
+        '''
+        if self.closing:
+            return
+        self.closing = True
+        self._outgoing.append(encode_frame(OP_CLOSE, struct.pack('!H', code) if code is not None else b''))
+
+    def data_to_send(self):
+        '''
+        Return the bytes queued for the server
+        '''
+        data, self._outgoing = b''.join(self._outgoing), []
+        return data
+
+
+def _address(url):
+    split = urlparse.urlsplit(url)
+    secure = split.scheme in ('https', 'wss')
+    return split.hostname, split.port or (443 if secure else 80), secure
+
+
+class WebSocket(object):
+    '''
+    A blocking WebSocket connection
+
+    A ping is sent after ``ping_interval`` seconds without data from the
+    server, and the connection is considered dead when nothing arrived
+    ``ping_interval`` seconds later.
+
+    :param url: the ``http(s)`` or ``ws(s)`` URL to connect to
+
+    :param headers: extra headers for the upgrade request
+
+    :param ssl_context: the SSL context of ``https`` and ``wss`` URLs
+
+    :param timeout: seconds to wait for the connection and the handshake
+
+    :param ping_interval: seconds of silence after which the server is
+        pinged, None to never ping
+
+    :raises PepperException: if the connection or the handshake failed
+    '''
+    def __init__(self, url, headers=None, ssl_context=None, timeout=None, ping_interval=30):
+        self.url = url
+        self.ping_interval = ping_interval
+        self.protocol = WebSocketProtocol()
+        self._messages = []
+        host, port, secure = _address(url)
+        try:
+            sock = socket.create_connection((host, port), timeout)
+            if secure:
+                sock = ssl_context.wrap_socket(sock, server_hostname=host)
+        except (socket.error, OSError) as exc:
+            raise PepperException('Unable to reach salt-api: {0}'.format(exc))
+        self.sock = sock
+        try:
+            request, key = handshake_request(url, headers)
+            sock.sendall(request)
+            head = b''
+            while b'\r\n\r\n' not in head:
+                if len(head) > MAX_HEADER_SIZE:
+                    raise PepperException('WebSocket handshake response too long')
+                data = sock.recv(65536)
+                if not data:
+                    raise PepperException('salt-api closed the connection during the WebSocket handshake')
+                head += data
+            head, _, rest = head.partition(b'\r\n\r\n')
+            check_handshake(head, key)
+            self._messages.extend(self.protocol.receive(rest))
+        except (socket.error, OSError) as exc:
+            sock.close()
+            raise PepperException('Unable to reach salt-api: {0}'.format(exc))
+        except PepperException:
+            sock.close()
+            raise
+        sock.settimeout(ping_interval)
+
+    def send(self, message):
+        self.protocol.send(message)
+        self._flush()
+
+    def _flush(self):
+        data = self.protocol.data_to_send()
+        if data:
+            self.sock.sendall(data)
+
+    def recv(self):
+        '''
+        Return the next message
+
+        :raises WebSocketClosed: if the connection was closed or died
+        '''
+        while not self._messages:
+            if self.protocol.closed:
+                raise WebSocketClosed('salt-api closed the WebSocket ({0})'.format(self.protocol.close_code))
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                if not self.protocol.alive:
+                    raise WebSocketClosed('salt-api did not answer a ping for {0}s'.format(self.ping_interval))
+                self.protocol.ping()
+                self._flush()
+                continue
+            except (socket.error, OSError) as exc:
+                raise WebSocketClosed('The WebSocket failed: {0}'.format(exc))
+            if not data:
+                raise WebSocketClosed('salt-api closed the connection')
+            self._messages.extend(self.protocol.receive(data))
+            self._flush()
+        return self._messages.pop(0)
+
+    def __iter__(self):
+        while True:
+            try:
+                yield self.recv()
+            except WebSocketClosed:
+                if self.protocol.closed:
+                    return
+                raise
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            if not self.protocol.closed:
+                self.protocol.close()
+                self._flush()
+        except (socket.error, OSError):
+            pass
+        finally:
+            self.sock.close()
+            self.sock = None
+
+
+class AsyncWebSocket(object):
+    '''
+    A WebSocket connection for asyncio, see :class:`WebSocket`
+    '''
+    def __init__(self, url, ping_interval=30):
+        self.url = url
+        self.ping_interval = ping_interval
+        self.protocol = WebSocketProtocol()
+        self._messages = []
+        self._reader = self._writer = None
+
+    @classmethod
+    async def connect(cls, url, headers=None, ssl_context=None, timeout=None, ping_interval=30):
+        '''
+        Open a connection and return it once the handshake is done
+
+        :raises PepperException: if the connection or the handshake failed
+        '''
+        ws = cls(url, ping_interval)
+        host, port, secure = _address(url)
+        kwargs = {'ssl': ssl_context, 'server_hostname': host} if secure else {}
+        try:
+            ws._reader, ws._writer = await asyncio.wait_for(
+                asyncio.open_connection(host, port, limit=MAX_HEADER_SIZE, **kwargs), timeout)
+            request, key = handshake_request(url, headers)
+            ws._writer.write(request)
+            head = await asyncio.wait_for(ws._reader.readuntil(b'\r\n\r\n'), timeout)
+            check_handshake(head[:-4], key)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError) as exc:
+            ws.close()
+            raise PepperException('Unable to reach salt-api: {0}'.format(exc or 'timed out'))
+        except PepperException:
+            ws.close()
+            raise
+        return ws
+
+    async def send(self, message):
+        self.protocol.send(message)
+        await self._flush()
+
+    async def _flush(self):
+        data = self.protocol.data_to_send()
+        if data:
+            self._writer.write(data)
+            await self._writer.drain()
+
+    async def recv(self):
+        '''
+        Return the next message
+
+        :raises WebSocketClosed: if the connection was closed or died
+        '''
+        while not self._messages:
+            if self.protocol.closed:
+                raise WebSocketClosed('salt-api closed the WebSocket ({0})'.format(self.protocol.close_code))
+            try:
+                data = await asyncio.wait_for(self._reader.read(65536), self.ping_interval)
+            except asyncio.TimeoutError:
+                if not self.protocol.alive:
+                    raise WebSocketClosed('salt-api did not answer a ping for {0}s'.format(self.ping_interval))
+                self.protocol.ping()
+                await self._flush()
+                continue
+            except OSError as exc:
+                raise WebSocketClosed('The WebSocket failed: {0}'.format(exc))
+            if not data:
+                raise WebSocketClosed('salt-api closed the connection')
+            self._messages.extend(self.protocol.receive(data))
+            await self._flush()
+        return self._messages.pop(0)
+
+    async def __aiter__(self):
+        while True:
+            try:
+                yield await self.recv()
+            except WebSocketClosed:
+                if self.protocol.closed:
+                    return
+                raise
+
+    def close(self):
+        if self._writer is None:
+            return
+        try:
+            if not self.protocol.closed:
+                self.protocol.close()
+                self._writer.write(self.protocol.data_to_send())
+        except OSError:
+            pass
+        finally:
+            self._writer.close()
+            self._writer = None
@@ -40,6 +40,7 @@ setup_kwargs = {
     ],
     'extras_require': {
         'kerberos': ["requests-gssapi>=1.1.0"],
+        'fastjson': ["orjson"],
     },
     'scripts': [
         'scripts/pepper',
@@ -2,12 +2,24 @@
 from __future__ import absolute_import, unicode_literals, print_function
 
 # Import python libraries
+import contextlib
+import json
 import logging
 import os.path
 import shutil
+import ssl
+import subprocess
 import sys
 import tempfile
 import textwrap
+import threading
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
 
 # Import Salt Libraries
 import salt.utils.yaml as yaml
@@ -140,6 +152,172 @@ def pepper_client(session_salt_api, salt_api_port):
     return client
 
 
+class FakeRequest(object):
+    '''
+    A request recorded by the salt-api stand-in
+    '''
+    def __init__(self, command, path, headers, body):
+        self.command = command
+        self.path = path
+        self.headers = headers
+        self.body = body
+
+
+class FakeSaltApiHandler(BaseHTTPRequestHandler):
+    '''
+    Answer requests from the routes registered on the server
+
+    A route is a callable taking the handler and returning a
+    ``(status, headers, body)`` tuple, or None if it wrote the response itself.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length else b''
+        self.server.requests.append(FakeRequest(self.command, self.path, self.headers, self.body))
+        route = self.server.routes.get(self.path.split('?')[0])
+        if route is None:
+            status, headers, body = 404, {}, b'{}'
+        else:
+            ret = route(self)
+            if ret is None:
+                return
+            status, headers, body = ret
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        headers.setdefault('Content-Type', 'application/json')
+        headers.setdefault('Content-Length', str(len(body)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _handle
+
+
+class FakeSaltApi(ThreadingMixIn, HTTPServer):
+    '''
+    A local stand-in for salt-api
+    '''
+    daemon_threads = True
+
+    def __init__(self, ssl_context=None):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeSaltApiHandler)
+        self.scheme = 'http'
+        if ssl_context is not None:
+            self.scheme = 'https'
+            self.socket = ssl_context.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+        self.connections = 0
+        self.requests = []
+        self.routes = {
+            '/login': lambda req: (200, {}, {'return': [{'token': 'faketoken', 'expire': 9999999999}]}),
+            '/': self._index,
+        }
+
+    def handle_error(self, request, client_address):
+        log.debug('Error handling a request from %s', client_address, exc_info=True)
+
+    @staticmethod
+    def _index(req):
+        '''
+        Echo the lowstate, or welcome GET requests as salt-api does
+        '''
+        if req.command == 'GET':
+            return 200, {}, {'return': 'Welcome', 'clients': ['local', 'runner', 'wheel']}
+        return 200, {}, {'return': [json.loads(req.body.decode())]}
+
+    @property
+    def url(self):
+        return '{0}://127.0.0.1:{1}/'.format(self.scheme, self.server_address[1])
+
+
+@contextlib.contextmanager
+def _serve_fake_salt_api(ssl_context=None):
+    server = FakeSaltApi(ssl_context)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def fake_salt_api():
+    '''
+    A salt-api stand-in served from a background thread
+    '''
+    with _serve_fake_salt_api() as server:
+        yield server
+
+
+@pytest.fixture
+def other_fake_salt_api():
+    '''
+    A second salt-api stand-in, for tests with several salt-api instances
+    '''
+    with _serve_fake_salt_api() as server:
+        yield server
+
+
+def _make_certificate(directory, name):
+    '''
+    Create a self-signed certificate for 127.0.0.1 and return the path of
+    the PEM file holding it and its key
+    '''
+    key, cert = os.path.join(directory, name + '.key'), os.path.join(directory, name + '.crt')
+    subprocess.check_call([
+        'openssl', 'req', '-x509', '-nodes', '-days', '1',
+        '-newkey', 'ec', '-pkeyopt', 'ec_paramgen_curve:prime256v1',
+        '-subj', '/CN=localhost', '-addext', 'subjectAltName=IP:127.0.0.1,DNS:localhost',
+        '-keyout', key, '-out', cert,
+    ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(cert + '.pem', 'w') as pem:
+        for path in (cert, key):
+            with open(path) as part:
+                pem.write(part.read())
+    return cert + '.pem'
+
+
+@pytest.fixture(scope='session')
+def tls_certificates():
+    '''
+    Self-signed certificates for the salt-api stand-in (``server``), a client
+    (``client``) and an unrelated host (``other``)
+    '''
+    if shutil.which('openssl') is None:
+        pytest.skip('openssl is required to create certificates')
+    directory = tempfile.mkdtemp()
+    yield dict((name, _make_certificate(directory, name)) for name in ('server', 'client', 'other'))
+    shutil.rmtree(directory)
+
+
+@pytest.fixture
+def fake_salt_api_tls(tls_certificates):
+    '''
+    A salt-api stand-in served over HTTPS, with ``server`` as its certificate
+
+    Client certificates are verified against ``client`` when they are sent.
+    '''
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(tls_certificates['server'])
+    context.load_verify_locations(tls_certificates['client'])
+    context.verify_mode = ssl.CERT_OPTIONAL
+    with _serve_fake_salt_api(context) as server:
+        yield server
+
+
 @pytest.fixture
 def tokfile():
     tokdir = tempfile.mkdtemp()
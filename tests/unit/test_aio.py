@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import asyncio
+import json
+from urllib.error import URLError
+
+# Import Pepper Libraries
+from pepper.aio import AsyncPepper
+from pepper.exceptions import PepperException
+
+# Import Testing Libraries
+import pytest
+
+
+def test_concurrent_calls_share_connections(fake_salt_api):
+    async def run():
+        async with AsyncPepper(fake_salt_api.url, max_connections=4) as api:
+            await api.login('pepper', 'pepper', 'sharedsecret')
+            return await asyncio.gather(*[
+                api.local('minion{0}'.format(i), 'test.ping', expr_form='list') for i in range(50)
+            ])
+
+    rets = asyncio.run(run())
+    assert [ret['return'][0][0]['tgt'] for ret in rets] == ['minion{0}'.format(i) for i in range(50)]
+    assert fake_salt_api.connections <= 4
+    assert fake_salt_api.requests[-1].headers['X-Auth-Token'] == 'faketoken'
+
+
+def test_lowstate_matches_sync_client(fake_salt_api):
+    async def run():
+        async with AsyncPepper(fake_salt_api.url) as api:
+            return [
+                await api.local_async('*', 'test.arg', arg=['one'], kwarg={'two': 2}, timeout=5),
+                await api.local_batch('*', 'test.ping', batch='10%'),
+                await api.runner('jobs.list_jobs', search_function='test.ping'),
+                await api.wheel('key.accept', match='minion1'),
+                await api.lookup_jid('20180414193904158892'),
+            ]
+
+    assert [ret['return'][0][0] for ret in asyncio.run(run())] == [
+        {'client': 'local_async', 'tgt': '*', 'fun': 'test.arg', 'arg': ['one'], 'kwarg': {'two': 2},
+         'expr_form': 'glob', 'timeout': 5},
+        {'client': 'local_batch', 'tgt': '*', 'fun': 'test.ping', 'expr_form': 'glob', 'batch': '10%'},
+        {'client': 'runner', 'fun': 'jobs.list_jobs', 'search_function': 'test.ping'},
+        {'client': 'wheel', 'fun': 'key.accept', 'match': 'minion1'},
+        {'client': 'runner', 'fun': 'jobs.lookup_jid', 'jid': '20180414193904158892'},
+    ]
+
+
+def test_auth_denied(fake_salt_api):
+    fake_salt_api.routes['/login'] = lambda req: (401, {}, {})
+
+    async def run():
+        async with AsyncPepper(fake_salt_api.url) as api:
+            await api.login('pepper', 'bad', 'sharedsecret')
+
+    with pytest.raises(PepperException):
+        asyncio.run(run())
+
+
+def test_events(fake_salt_api):
+    def events(req):
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/event-stream')
+        req.send_header('Transfer-Encoding', 'chunked')
+        req.end_headers()
+        for chunk in (b'retry: 400\n\ntag: salt/job/1/new\ndata: {"tag": "salt/job/1/new", ',
+                      b'"data": {"jid": "1"}}\n\ntag: salt/job/1/ret/m1\ndata: {"tag": "salt/job/1/ret/m1", '
+                      b'"data": {"id": "m1"}}\n\n', b''):
+            req.wfile.write('{0:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+    fake_salt_api.routes['/events'] = events
+
+    async def run():
+        async with AsyncPepper(fake_salt_api.url) as api:
+            await api.login('pepper', 'pepper', 'sharedsecret')
+            return [event async for event in api.events()]
+
+    assert asyncio.run(run()) == [
+        {'tag': 'salt/job/1/new', 'data': {'jid': '1'}},
+        {'tag': 'salt/job/1/ret/m1', 'data': {'id': 'm1'}},
+    ]
+
+
+def test_dropped_connection_resends_only_idempotent_requests(fake_salt_api):
+    calls = []
+
+    def route(req):
+        calls.append(json.loads(req.body.decode())[0]['fun'])
+        # drop the kept-alive connection after reading every other request
+        if len(calls) % 2 == 0:
+            req.close_connection = True
+            return None
+        return 200, {}, {'return': ['ok']}
+
+    fake_salt_api.routes['/'] = route
+
+    async def run(fun):
+        async with AsyncPepper(fake_salt_api.url) as api:
+            await api.local('*', 'test.ping')
+            return await api.local('*', fun)
+
+    with pytest.raises(URLError):
+        asyncio.run(run('state.apply'))
+    assert calls == ['test.ping', 'state.apply']
+    assert asyncio.run(run('test.version')) == {'return': ['ok']}
+    assert calls[2:] == ['test.ping', 'test.version', 'test.version']
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import socket
+
+# Import Pepper Libraries
+import pepper
+from pepper.retry import RetryPolicy
+
+# Import Testing Libraries
+from mock import patch
+
+PING = [{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]
+RUN = [{'client': 'local', 'tgt': '*', 'fun': 'cmd.run', 'arg': ['uptime']}]
+
+
+def _lowstates(server):
+    return [req for req in server.requests if req.command == 'POST' and req.path == '/']
+
+
+def _api(*servers, **kwargs):
+    api = pepper.Pepper([server.url for server in servers], **kwargs)
+    api.login('pepper', 'pepper', 'sharedsecret')
+    return api
+
+
+def test_url_list():
+    api = pepper.Pepper('http://salt-api-0:8000/, http://salt-api-1:8000/')
+    assert api.api_urls == ['http://salt-api-0:8000/', 'http://salt-api-1:8000/']
+    assert api.api_url == 'http://salt-api-0:8000/'
+    assert len(api.balancer.endpoints) == 2
+
+
+def test_requests_are_spread(fake_salt_api, other_fake_salt_api):
+    api = _api(fake_salt_api, other_fake_salt_api)
+    for _ in range(4):
+        api.low(PING)
+    assert len(_lowstates(fake_salt_api)) == len(_lowstates(other_fake_salt_api)) == 2
+    assert [endpoint.outstanding for endpoint in api.balancer.endpoints] == [0, 0]
+    api.close()
+
+
+def test_least_outstanding(fake_salt_api, other_fake_salt_api):
+    api = _api(fake_salt_api, other_fake_salt_api)
+    busy = [api._open('/', PING) for _ in range(2)]
+    assert sorted(endpoint.outstanding for endpoint in api.balancer.endpoints) == [1, 1]
+
+    busy[0].close()
+    idle = next(endpoint for endpoint in api.balancer.endpoints if endpoint.outstanding == 0)
+    with api._open('/', PING) as resp:
+        assert idle.outstanding == 1
+        resp.read()
+    assert idle.outstanding == 0
+    busy[1].close()
+    api.close()
+
+
+def test_failover(fake_salt_api):
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    down = 'http://127.0.0.1:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+
+    api = pepper.Pepper([down, fake_salt_api.url], retry=RetryPolicy(retries=1), breaker_threshold=1)
+    api.auth = {'token': 'faketoken'}
+    with patch.object(api.retry, 'sleep'):
+        for _ in range(3):
+            assert api.low(RUN) == {'return': [RUN]}
+    # the instance which is down is ejected after its first failure
+    assert len(_lowstates(fake_salt_api)) == 3
+    assert not api.balancer.endpoints[0].available
+
+
+def test_health_check_ejects(fake_salt_api, other_fake_salt_api):
+    def index(req):
+        if req.command == 'GET':
+            return 503, {}, {}
+        return 200, {}, {'return': ['ok']}
+
+    other_fake_salt_api.routes['/'] = index
+    api = _api(fake_salt_api, other_fake_salt_api)
+    api.balancer.check_health()
+    assert [endpoint.healthy for endpoint in api.balancer.endpoints] == [True, False]
+    for _ in range(3):
+        api.low(PING)
+    assert len(_lowstates(fake_salt_api)) == 3
+
+    other_fake_salt_api.routes['/'] = fake_salt_api.routes['/']
+    api.balancer.check_health()
+    assert api.balancer.endpoints[1].available
+    api.close()
+
+
+def test_health_check_thread(fake_salt_api, other_fake_salt_api):
+    api = _api(fake_salt_api, other_fake_salt_api, health_interval=0.05)
+    api.low(PING)
+    api.balancer._thread.join(0.2)
+    assert [req for req in fake_salt_api.requests if req.command == 'GET']
+    api.close()
+    api.balancer._thread.join(1)
+    assert not api.balancer._thread.is_alive()
+
+
+def test_token_affinity(fake_salt_api, other_fake_salt_api):
+    api = _api(fake_salt_api, other_fake_salt_api, token_affinity=True)
+    issuer = fake_salt_api if fake_salt_api.requests[-1].path == '/login' else other_fake_salt_api
+    for _ in range(3):
+        api.low(PING)
+    assert len(_lowstates(issuer)) == 3
+
+    # the requests go elsewhere while the issuer is ejected
+    api._pinned.healthy = False
+    api.low(PING)
+    assert len(_lowstates(issuer)) == 3
+    api.close()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+
+# Import Pepper Libraries
+from pepper import Pepper, PepperException
+
+# Import Testing Libraries
+import pytest
+
+
+def _runs(fake_salt_api):
+    return [json.loads(req.body.decode()) for req in fake_salt_api.requests if req.path == '/']
+
+
+@pytest.fixture
+def api(fake_salt_api):
+    # answer every lowstate with its function and arguments
+    fake_salt_api.routes['/'] = lambda req: (200, {}, {'return': [
+        [low['client'], low['fun'], low.get('arg'), low.get('match')] for low in json.loads(req.body.decode())
+    ]})
+    api = Pepper(fake_salt_api.url)
+    api.login('saltdev', 'saltdev', 'pam')
+    yield api
+    api.close()
+
+
+def test_single_request(api, fake_salt_api):
+    with api.batch() as batch:
+        futures = [batch.runner('test.arg', [i]) for i in range(25)]
+        futures += [batch.wheel('key.list', match=str(i)) for i in range(25)]
+        futures.append(batch.local('*', 'test.ping'))
+        assert not any(future.done() for future in futures)
+
+    assert len(_runs(fake_salt_api)) == 1
+    assert futures[0].result() == ['runner', 'test.arg', [0], None]
+    assert futures[1].result() == ['runner', 'test.arg', [1], None]
+    assert futures[49].result() == ['wheel', 'key.list', None, '24']
+    assert futures[50].result() == ['local', 'test.ping', None, None]
+
+
+def test_max_size(api, fake_salt_api):
+    with api.batch(max_size=3) as batch:
+        futures = [batch.runner('test.arg', [i]) for i in range(7)]
+        # full batches are sent right away
+        assert [future.done() for future in futures] == [True] * 6 + [False]
+
+    assert [len(run) for run in _runs(fake_salt_api)] == [3, 3, 1]
+    assert [future.result()[2] for future in futures] == [[i] for i in range(7)]
+
+
+def test_max_bytes(api, fake_salt_api):
+    with api.batch(max_bytes=250) as batch:
+        futures = [batch.runner('test.arg', ['x' * 60]) for i in range(5)]
+
+    runs = _runs(fake_salt_api)
+    assert [len(run) for run in runs] == [2, 2, 1]
+    assert all(len(json.dumps(run)) <= 250 for run in runs)
+    assert all(future.result()[1] == 'test.arg' for future in futures)
+
+
+def test_server_error(api, fake_salt_api):
+    fake_salt_api.routes['/'] = lambda req: (500, {}, {})
+    with api.batch() as batch:
+        futures = [batch.runner('test.arg'), batch.wheel('key.list_all')]
+
+    for future in futures:
+        with pytest.raises(PepperException):
+            future.result()
+
+
+def test_missing_return(api, fake_salt_api):
+    fake_salt_api.routes['/'] = lambda req: (200, {}, {'return': [True]})
+    with api.batch() as batch:
+        first, second = batch.runner('test.arg'), batch.runner('test.arg')
+
+    assert first.result() is True
+    with pytest.raises(PepperException):
+        second.result()
+
+
+def test_exception_cancels(api, fake_salt_api):
+    with pytest.raises(RuntimeError):
+        with api.batch() as batch:
+            future = batch.runner('test.arg')
+            raise RuntimeError()
+
+    assert future.cancelled()
+    assert _runs(fake_salt_api) == []
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+
+# Import Pepper Libraries
+from pepper import codec
+
+# Import Testing Libraries
+import pytest
+
+JID = '20180414193904158892'
+PAYLOAD = {
+    'return': [{
+        'minion{0}'.format(i): {
+            'ret': {
+                'file_|-/etc/motd_|-/etc/motd_|-managed': {
+                    'changes': {'diff': '--- \n+++ \n@@ -1 +1 @@\n-old\n+new\n'},
+                    'comment': 'File /etc/motd updated',
+                    'result': True,
+                    '__run_num__': i,
+                    'duration': 12.5,
+                },
+                'pkg_|-vim_|-vim_|-installed': {'changes': {}, 'result': None, 'pchanges': []},
+            },
+            'retcode': 0,
+            'jid': JID,
+        } for i in range(3)
+    }]
+}
+
+
+@pytest.fixture(params=codec.available_backends())
+def backend(request):
+    previous = codec.get_backend().name
+    yield codec.set_backend(request.param)
+    codec.set_backend(previous)
+
+
+def test_roundtrip(backend):
+    encoded = codec.dumps(PAYLOAD)
+    assert isinstance(encoded, bytes)
+    assert codec.loads(encoded) == PAYLOAD
+    assert codec.loads(encoded.decode('utf-8')) == PAYLOAD
+
+
+def test_dumps_pretty_matches_stdlib(backend):
+    assert codec.dumps_pretty(PAYLOAD) == json.dumps(PAYLOAD, sort_keys=True, indent=4)
+
+
+def test_big_integers(backend):
+    big = 2 ** 70 + 1
+    size = codec.loads(codec.dumps({'size': big}))['size']
+    assert size == big and type(size) is int
+    size = codec.loads(codec.dumps_pretty({'size': -big}))['size']
+    assert size == -big and type(size) is int
+    assert codec.loads(b'{"jid": "20180414193904158892", "size": 18446744073709551615}')['size'] == 2 ** 64 - 1
+
+
+def test_non_finite_numbers(backend):
+    decoded = codec.loads(b'{"load": NaN, "max": Infinity}')
+    assert decoded['load'] != decoded['load'] and decoded['max'] == float('inf')
+
+
+def test_dumps_pretty_escapes_non_ascii(backend):
+    payload = {'ms-0': {'ret': 'häj 😀 ✓', 'jid': JID}}
+    assert codec.dumps_pretty(payload) == json.dumps(payload, sort_keys=True, indent=4)
+    assert codec.dumps_pretty(payload).isascii()
+
+
+def test_invalid_document(backend):
+    with pytest.raises(codec.JSONDecodeError):
+        codec.loads(b'{"return": [')
+
+
+def test_unknown_backend():
+    with pytest.raises(ImportError):
+        codec.set_backend('simplejson')
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import gzip
+import json
+import sys
+import threading
+import zlib
+
+# Import Pepper Libraries
+import pepper
+import pepper.cli
+
+JID = '20180414193904158892'
+GRAINS = [{'client': 'local', 'tgt': '*', 'fun': 'grains.items'}]
+
+
+def _grains(minions):
+    return {'return': [dict(
+        ('ms-{0}'.format(minion), {'ret': {'os': 'Ubuntu', 'num_cpus': 8}, 'retcode': 0, 'jid': JID})
+        for minion in range(minions)
+    )]}
+
+
+def _compress(encoding, data):
+    if encoding == 'gzip':
+        return gzip.compress(data)
+    if encoding == 'deflate':
+        return zlib.compress(data)
+    # raw deflate, as some servers send it
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compressing_route(encoding, payload):
+    def route(req):
+        assert 'gzip' in req.headers['Accept-Encoding']
+        return 200, {'Content-Encoding': 'gzip' if encoding == 'gzip' else 'deflate'}, _compress(
+            encoding, json.dumps(payload).encode())
+    return route
+
+
+def _api(fake_salt_api, **kwargs):
+    api = pepper.Pepper(fake_salt_api.url, **kwargs)
+    api.auth = {'token': 'faketoken'}
+    return api
+
+
+def test_compressed_responses(fake_salt_api):
+    payload = _grains(100)
+    transfers = []
+    api = _api(fake_salt_api, on_transfer=transfers.append)
+    for encoding in ('gzip', 'deflate', 'raw'):
+        fake_salt_api.routes['/'] = _compressing_route(encoding, payload)
+        assert api.low(GRAINS) == payload
+    # the connection was reused
+    assert fake_salt_api.connections == 1
+
+    assert len(transfers) == 3
+    size = len(json.dumps(payload))
+    for stats in transfers:
+        assert stats.received_decoded == size
+        assert stats.received < size / 5
+        assert stats.sent == stats.sent_uncompressed == len(fake_salt_api.requests[-1].body)
+
+
+def test_compressed_response_is_streamed(fake_salt_api):
+    printed, streamed = threading.Event(), []
+
+    def route(req):
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)
+        head = compressor.compress('{{"return": [{{"ms-0": {{"ret": true, "jid": "{0}"}}'.format(JID).encode())
+        head += compressor.flush(zlib.Z_SYNC_FLUSH)
+        tail = compressor.compress(', "ms-1": {{"ret": false, "jid": "{0}"}}}}]}}'.format(JID).encode())
+        tail += compressor.flush()
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Encoding', 'gzip')
+        req.send_header('Content-Length', str(len(head) + len(tail)))
+        req.end_headers()
+        req.wfile.write(head)
+        req.wfile.flush()
+        streamed.append(printed.wait(5))
+        req.wfile.write(tail)
+
+    fake_salt_api.routes['/'] = route
+    api = _api(fake_salt_api)
+    returns = []
+    for minion, ret in api.iter_low(GRAINS):
+        returns.append(minion)
+        printed.set()
+    assert returns == ['ms-0', 'ms-1']
+    # the first return was decoded before the response was complete
+    assert streamed == [True]
+
+    # the connection is reused after the compressed stream
+    fake_salt_api.routes['/'] = _compressing_route('gzip', _grains(1))
+    assert api.low(GRAINS) == _grains(1)
+    assert fake_salt_api.connections == 1
+
+
+def test_compressed_requests(fake_salt_api):
+    bodies = []
+
+    def route(req):
+        body = req.body
+        if req.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        bodies.append((req.headers.get('Content-Encoding'), json.loads(body.decode())))
+        return 200, {}, {'return': ['ok']}
+
+    fake_salt_api.routes['/'] = route
+    transfers = []
+    api = _api(fake_salt_api, gzip_threshold=512, on_transfer=transfers.append)
+    large = [{'client': 'local', 'tgt': ['ms-{0}'.format(i) for i in range(100)],
+              'tgt_type': 'list', 'fun': 'test.ping'}]
+    api.low(GRAINS)
+    api.low(large)
+    assert bodies == [(None, GRAINS), ('gzip', large)]
+    assert transfers[0].sent == transfers[0].sent_uncompressed
+    assert transfers[1].sent < transfers[1].sent_uncompressed / 3
+
+
+def test_gzip_requests_option():
+    sys.argv = ['pepper', '--gzip-requests', '4096', '*', 'test.ping']
+    options = pepper.cli.PepperCli().client_options()
+    assert options['gzip_threshold'] == 4096
+    assert options['retry'] == 3
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import argparse
+import os
+import socket
+import sys
+import threading
+
+# Import Pepper Libraries
+import pepper.script
+from pepper.daemon import PepperDaemon
+
+# Import Testing Libraries
+import pytest
+
+RETURN = {'return': [{'ms-0': {'ret': {'häj': True}, 'retcode': 0, 'jid': '1'},
+                      'ms-1': {'ret': False, 'retcode': 2, 'jid': '1'}}]}
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    daemon = PepperDaemon(str(tmpdir.join('run', 'pepper.sock')), idle_timeout=30)
+    daemon.bind()
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield daemon
+    if thread.is_alive():
+        daemon.shutdown()
+        thread.join(5)
+
+
+def _pepper(fake_salt_api, tmpdir, socket_path, *args):
+    fake_salt_api.routes['/'] = lambda req: (200, {}, RETURN)
+    sys.argv = [
+        'pepper', '--daemon-socket', socket_path, '-u', fake_salt_api.url,
+        '--username', 'saltdev', '--password', 'saltdev', '--eauth', 'pam',
+        '-m', str(tmpdir.join('master')), '--out', 'json',
+    ] + list(args) + ['*', 'test.ping']
+    return pepper.script.Pepper()()
+
+
+def _output(capsys):
+    '''
+    The captured output, without the log line of the daemon thread starting
+    '''
+    out, err = capsys.readouterr()
+    return out, ''.join(line for line in err.splitlines(True) if 'pepper daemon listening' not in line)
+
+
+def _logins(fake_salt_api):
+    return len([req for req in fake_salt_api.requests if req.path == '/login'])
+
+
+def test_forwarded_commands_reuse_the_session(fake_salt_api, daemon, tmpdir, capsys):
+    assert _pepper(fake_salt_api, tmpdir, daemon.path, '--no-daemon', '--fail-any') == 2
+    local = _output(capsys)
+    assert _logins(fake_salt_api) == 1
+
+    for _ in range(3):
+        assert _pepper(fake_salt_api, tmpdir, daemon.path, '--fail-any') == 2
+        assert _output(capsys) == local
+
+    # one more login and connection for the daemon, shared by all commands
+    assert _logins(fake_salt_api) == 2
+    assert fake_salt_api.connections == 2
+    assert os.stat(os.path.dirname(daemon.path)).st_mode & 0o077 == 0
+
+
+def test_errors_are_forwarded(fake_salt_api, daemon, tmpdir, capsys):
+    fake_salt_api.routes['/login'] = lambda req: (401, {}, {})
+    assert _pepper(fake_salt_api, tmpdir, daemon.path) == 1
+    assert 'Pepper error: Authentication denied' in capsys.readouterr().err
+
+
+def test_stale_socket_runs_locally(fake_salt_api, tmpdir, capsys):
+    path = str(tmpdir.join('pepper.sock'))
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.close()
+
+    assert _pepper(fake_salt_api, tmpdir, path) == 0
+    assert '"ms-0"' in capsys.readouterr().out
+
+
+def test_idle_timeout(tmpdir):
+    daemon = PepperDaemon(str(tmpdir.join('pepper.sock')), idle_timeout=0.2)
+    thread = threading.Thread(target=daemon.serve_forever)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert not os.path.exists(daemon.path)
+
+
+class _Cli(object):
+    '''
+    The parts of PepperCli the daemon uses to pick a session
+    '''
+    def __init__(self, username, login=None):
+        self.options = argparse.Namespace(userun=False)
+        self.username = username
+        self.logins = []
+        self._login = login
+
+    def client_options(self):
+        return {}
+
+    def parse_url(self):
+        return 'http://127.0.0.1:1/'
+
+    def parse_login(self):
+        return {'username': self.username}
+
+    def login(self, api):
+        self.logins.append(api)
+        if self._login is not None:
+            self._login()
+
+
+def test_login_only_blocks_the_same_session(tmpdir):
+    daemon = PepperDaemon(str(tmpdir.join('pepper.sock')))
+    started, release = threading.Event(), threading.Event()
+
+    def slow_login():
+        started.set()
+        release.wait(5)
+
+    slow = _Cli('slow', slow_login)
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(daemon.session(slow))) for _ in range(2)]
+    threads[0].start()
+    assert started.wait(5)
+    threads[1].start()
+
+    # another profile logs in while the slow login is running
+    other = threading.Thread(target=daemon.session, args=(_Cli('other'),))
+    other.start()
+    other.join(5)
+    assert not other.is_alive()
+
+    # the second command waits for the login to its own session
+    threads[1].join(0.2)
+    assert threads[1].is_alive() and len(slow.logins) == 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert sessions[0] == sessions[1]
+    assert slow.logins == [sessions[0][1]] * 2
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+import queue
+import threading
+import time
+
+# Import Pepper Libraries
+import pepper
+from pepper.libpepper import Subscription
+from pepper.retry import RetryPolicy
+
+# Import Testing Libraries
+import pytest
+from pepper.exceptions import PepperException
+
+
+def _event(tag, **data):
+    return {'tag': tag, 'data': data}
+
+
+def _events_route(*streams):
+    '''
+    Send the events of the next stream on every connection once its
+    ``subscribed`` gate is set, and end it once its ``done`` gate is set
+    '''
+    streams = list(streams)
+
+    def route(req):
+        events, subscribed, done = streams.pop(0) if streams else ([], None, threading.Event())
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/event-stream')
+        req.send_header('Transfer-Encoding', 'chunked')
+        req.end_headers()
+        chunks = [b'retry: 400\n\n'] + [
+            'tag: {0}\ndata: {1}\n\n'.format(event['tag'], json.dumps(event)).encode() for event in events]
+        try:
+            for chunk in chunks:
+                req.wfile.write('{0:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+                req.wfile.flush()
+                if subscribed is not None:
+                    subscribed.wait(5)
+            if done is not None:
+                done.wait(5)
+            req.wfile.write(b'0\r\n\r\n')
+        except (IOError, OSError):
+            pass
+    return route
+
+
+def _api(fake_salt_api):
+    api = pepper.Pepper(fake_salt_api.url, retry=RetryPolicy(initial=0.01, maximum=0.05))
+    api.auth = {'token': 'faketoken'}
+    return api
+
+
+def _streams(fake_salt_api):
+    return [req for req in fake_salt_api.requests if req.path == '/events']
+
+
+def test_fan_out(fake_salt_api):
+    events = [
+        _event('salt/job/1/new', jid='1'),
+        _event('salt/job/1/ret/m1', id='m1'),
+        _event('salt/auth', id='m2'),
+        _event('salt/job/1/ret/m2', id='m2'),
+    ]
+    subscribed, done = threading.Event(), threading.Event()
+    fake_salt_api.routes['/events'] = _events_route((events, subscribed, done))
+    with pepper.EventHub(_api(fake_salt_api)) as hub:
+        returns = hub.subscribe('salt/job/*/ret/*')
+        auth = hub.subscribe(['salt/auth', 'salt/job/*/new'])
+        everything = hub.subscribe()
+        assert hub.start(5)
+        subscribed.set()
+
+        assert [returns.get(5)['data']['id'] for _ in range(2)] == ['m1', 'm2']
+        assert [auth.get(5)['tag'] for _ in range(2)] == ['salt/job/1/new', 'salt/auth']
+        assert [everything.get(5) for _ in range(4)] == events
+        with pytest.raises(queue.Empty):
+            returns.get(0.01)
+        assert hub.received == 4
+        assert len(_streams(fake_salt_api)) == 1
+        done.set()
+
+
+def test_drop_policy():
+    hub = pepper.EventHub(None)
+    subscription = Subscription(hub, ['*'], maxsize=2)
+    for i in range(5):
+        assert subscription.put(_event('salt/job/{0}/new'.format(i)))
+    time.sleep(0.01)
+    metrics = subscription.metrics()
+    assert metrics['pending'] == 2
+    assert metrics['dropped'] == 3
+    assert metrics['lag'] > 0
+    # the oldest events were dropped
+    assert [subscription.get()['tag'] for _ in range(2)] == ['salt/job/3/new', 'salt/job/4/new']
+    assert subscription.metrics()['consumed'] == 2
+    assert subscription.lag == 0
+
+
+def test_block_policy():
+    hub = pepper.EventHub(None)
+    subscription = Subscription(hub, ['*'], maxsize=1, policy=Subscription.BLOCK)
+    subscription.put(_event('first'))
+    publisher = threading.Thread(target=subscription.put, args=(_event('second'),))
+    publisher.start()
+    publisher.join(0.1)
+    # the publisher waits until there is room
+    assert publisher.is_alive()
+    assert subscription.get()['tag'] == 'first'
+    publisher.join(5)
+    assert subscription.get()['tag'] == 'second'
+    assert subscription.dropped == 0
+
+    with pytest.raises(PepperException):
+        Subscription(hub, ['*'], policy='spill')
+
+
+def test_reconnects(fake_salt_api):
+    done = threading.Event()
+    fake_salt_api.routes['/events'] = _events_route(
+        ([_event('salt/job/1/new', jid='1')], None, None),
+        ([_event('salt/job/2/new', jid='2')], None, done),
+    )
+    hub = pepper.EventHub(_api(fake_salt_api))
+    subscription = hub.subscribe('salt/job/*')
+    assert [subscription.get(5)['data']['jid'] for _ in range(2)] == ['1', '2']
+    assert hub.reconnects == 1
+    assert len(_streams(fake_salt_api)) == 2
+
+    hub.close()
+    # the reading thread was interrupted
+    assert not hub._thread.is_alive()
+    assert subscription.closed
+    assert list(subscription) == []
+    assert hub.metrics()['subscriptions'] == []
+    done.set()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+import sys
+import threading
+
+# Import Pepper Libraries
+import pepper.cli
+
+# Import Testing Libraries
+from mock import patch
+
+JID = '20180414193904158892'
+
+
+def _lowstate_route(submitted):
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['client'] == 'local_async':
+            submitted.set()
+            return 200, {}, {'return': [{'jid': JID, 'minions': ['m1', 'm2']}]}
+        # jobs.list_job
+        result = dict((minion, {'return': True, 'retcode': 0, 'success': True}) for minion in ('m1', 'm2'))
+        return 200, {}, {'return': [{'jid': JID, 'Result': result}]}
+    return route
+
+
+def _events_route(submitted):
+    def route(req):
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/event-stream')
+        req.send_header('Transfer-Encoding', 'chunked')
+        req.end_headers()
+        chunks = [b'retry: 400\n\n']
+        for minion in ('m1', 'm2'):
+            tag = 'salt/job/{0}/ret/{1}'.format(JID, minion)
+            data = {'tag': tag, 'data': {'id': minion, 'return': True, 'retcode': 0, 'jid': JID}}
+            chunks.append('tag: {0}\ndata: {1}\n\n'.format(tag, json.dumps(data)).encode())
+        try:
+            req.wfile.write('{0:x}\r\n'.format(len(chunks[0])).encode() + chunks[0] + b'\r\n')
+            req.wfile.flush()
+            submitted.wait(5)
+            for chunk in chunks[1:] + [b'']:
+                req.wfile.write('{0:x}\r\n'.format(len(chunk)).encode() + chunk + b'\r\n')
+        except (IOError, OSError):
+            pass
+    return route
+
+
+def _run(fake_salt_api):
+    sys.argv = ['pepper', '-u', fake_salt_api.url, '--event-returns', '*', 'test.ping']
+    cli = pepper.cli.PepperCli()
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login):
+        return [(exit_code, json.loads(ret)) for exit_code, ret in cli.run()]
+
+
+def test_event_returns(fake_salt_api):
+    submitted = threading.Event()
+    fake_salt_api.routes['/'] = _lowstate_route(submitted)
+    fake_salt_api.routes['/events'] = _events_route(submitted)
+
+    assert _run(fake_salt_api) == [
+        (None, [{'m1': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+        (None, [{'m2': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+    ]
+    lowstates = [json.loads(req.body.decode())[0] for req in fake_salt_api.requests if req.path == '/']
+    assert [low['client'] for low in lowstates] == ['local_async']
+
+
+def test_event_returns_falls_back_to_polling(fake_salt_api):
+    fake_salt_api.routes['/'] = _lowstate_route(threading.Event())
+
+    rets = _run(fake_salt_api)
+    assert sorted(rets, key=lambda ret: list(ret[1][0])) == [
+        (None, [{'m1': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+        (None, [{'m2': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+    ]
+    lowstates = [json.loads(req.body.decode())[0] for req in fake_salt_api.requests if req.path == '/']
+    assert [low['client'] for low in lowstates] == ['local_async', 'runner']
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+
+# Import Pepper Libraries
+import pepper
+from pepper import codec
+from pepper.events import SSEDecoder, TagMatcher
+
+# Import Testing Libraries
+from mock import patch
+
+JID = '20180414193904158892'
+
+
+def _stream(events, newline='\n'):
+    return ''.join(
+        'tag: {1}{0}data: {2}{0}{0}'.format(newline, event['tag'], json.dumps(event)) for event in events
+    ).encode('utf-8')
+
+
+EVENTS = [
+    {'tag': 'salt/job/{0}/new'.format(JID), 'data': {'jid': JID, 'minions': ['ms-0', 'ms-1']}},
+    {'tag': 'salt/job/{0}/ret/ms-0'.format(JID), 'data': {'id': 'ms-0', 'return': 'häj'}},
+    {'tag': 'salt/auth', 'data': {'id': 'ms-2', 'act': 'accept'}},
+    {'tag': 'salt/job/{0}/ret/ms-1'.format(JID), 'data': {'id': 'ms-1', 'return': True}},
+]
+
+
+def test_tag_matcher():
+    matcher = TagMatcher(['salt/job/*/ret/*', 'salt/auth', 'salt/beacon/ms-[0-9]/*'])
+    assert matcher.match('salt/job/{0}/ret/ms-0'.format(JID))
+    assert matcher.match(b'salt/job/1/ret/ms-0')
+    assert matcher.match('salt/auth')
+    assert matcher.match(b'salt/auth')
+    assert matcher.match(b'salt/beacon/ms-1/inotify/')
+    assert not matcher.match('salt/job/1/new')
+    assert not matcher.match(b'salt/auth/extra')
+    assert not matcher.match(b'salt/beacon/ms-a/inotify/')
+
+    assert TagMatcher('*').match(b'anything')
+    assert not TagMatcher([]).match('salt/auth')
+    # non-ASCII patterns fall back to matching the decoded tag
+    assert TagMatcher('minion/häj-[äö]/*').match('minion/häj-ö/start'.encode('utf-8'))
+
+
+def test_chunks_split_anywhere():
+    stream = _stream(EVENTS)
+    decoder = SSEDecoder()
+    assert [event for i in range(len(stream)) for event in decoder.feed(stream[i:i + 1])] == EVENTS
+    # and with CRLF line endings, split between CR and LF
+    stream = _stream(EVENTS, '\r\n')
+    for size in (1, 7):
+        decoder = SSEDecoder()
+        assert [event for i in range(0, len(stream), size) for event in decoder.feed(stream[i:i + size])] == EVENTS
+
+
+def test_large_event_in_small_chunks():
+    event = {'tag': 'salt/job/{0}/ret/ms-0'.format(JID), 'data': {'id': 'ms-0', 'return': 'häj' * 300000}}
+    stream = _stream([event] + EVENTS[:1], '\r\n')
+    decoder = SSEDecoder()
+    events = [event for i in range(0, len(stream), 1024) for event in decoder.feed(stream[i:i + 1024])]
+    assert events == [event] + EVENTS[:1]
+    assert not decoder._pending
+
+
+def test_multiline_data_and_other_fields():
+    decoder = SSEDecoder()
+    assert decoder.feed(b'retry: 400\n\n: keepalive\n\ndata: {"tag": "salt/auth",\ndata:"data": {}}\n\n') == [
+        {'tag': 'salt/auth', 'data': {}}]
+    assert decoder.feed('data: {"tag": "héj"}\n\n') == [{'tag': 'héj'}]
+    assert decoder.feed(b'data: {"tag": \n\n') == []
+
+
+def test_filtered_events_are_not_decoded():
+    decoder = SSEDecoder(TagMatcher('salt/job/*/ret/*'))
+    backend = codec.get_backend()
+    with patch.object(backend, 'loads', wraps=backend.loads) as loads:
+        assert decoder.feed(_stream(EVENTS)) == [EVENTS[1], EVENTS[3]]
+    assert loads.call_count == 2
+    assert decoder.skipped == 2
+
+    # events without a tag line are checked once decoded
+    assert decoder.feed(b'data: {"tag": "salt/auth"}\n\ndata: {"tag": "salt/job/1/ret/ms-0"}\n\n') == [
+        {'tag': 'salt/job/1/ret/ms-0'}]
+    assert decoder.skipped == 3
+
+
+def test_events_tags(fake_salt_api):
+    def events(req):
+        req.send_response(200)
+        req.send_header('Content-Type', 'text/event-stream')
+        req.send_header('Content-Length', str(len(stream)))
+        req.end_headers()
+        req.wfile.write(stream)
+
+    stream = b'retry: 400\n\n' + _stream(EVENTS)
+    fake_salt_api.routes['/events'] = events
+    api = pepper.Pepper(fake_salt_api.url)
+    api.auth = {'token': 'faketoken'}
+    assert list(api.events(tags=['salt/job/*/ret/*'])) == [EVENTS[1], EVENTS[3]]
+    assert list(api.events()) == EVENTS
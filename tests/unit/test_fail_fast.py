@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+import sys
+import time
+
+# Import Pepper Libraries
+import pepper.cli
+import pepper.script
+from pepper.retcode import RetcodeEvaluator
+
+# Import Testing Libraries
+import pytest
+from mock import patch
+
+JID = '20180414193904158892'
+MINIONS = ['m{0}'.format(i) for i in range(10)]
+
+
+def test_evaluator():
+    evaluator = RetcodeEvaluator('fail_any')
+    assert evaluator.feed([{'m0': {'ret': True, 'retcode': 0, 'jid': JID}}]) is None
+    assert evaluator.feed({'return': [{'m1': {'ret': True, 'jid': JID}, 'm2': True}]}) is None
+    assert evaluator.feed([{'m3': {'ret': False, 'retcode': 2, 'jid': JID}}]) == 2
+    assert evaluator.feed([{'m4': {'ret': False, 'retcode': 3, 'jid': JID}}]) == 2
+    assert evaluator.failed == ('m3', 2, JID)
+
+
+def test_evaluator_fail_all():
+    # fail_all can only be decided once every return is in
+    evaluator = RetcodeEvaluator('fail_all')
+    assert evaluator.feed([{'m3': {'ret': False, 'retcode': 2, 'jid': JID}}]) is None
+    assert evaluator.failed == ('m3', 2, JID)
+
+
+def _master(fake_salt_api):
+    # m2 fails on the second lookup, the other minions never return
+    state = {'lookups': 0}
+
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['fun'] == 'saltutil.kill_job':
+            return 200, {}, {'return': [{'jid': '2', 'minions': MINIONS}]}
+        if low['client'] == 'local_async':
+            return 200, {}, {'return': [{'jid': JID, 'minions': MINIONS}]}
+        state['lookups'] += 1
+        result = {'m0': {'return': True, 'retcode': 0}}
+        if state['lookups'] > 1:
+            result['m2'] = {'return': False, 'retcode': 2}
+        return 200, {}, {'return': [{'jid': JID, 'Result': result}]}
+
+    fake_salt_api.routes['/'] = route
+
+
+def _argv(fake_salt_api, *args):
+    return ['pepper', '-u', fake_salt_api.url, '--timeout', '30'] + list(args) + ['ms-*', 'state.apply']
+
+
+def _run(fake_salt_api, *args):
+    sys.argv = _argv(fake_salt_api, *args)
+    cli = pepper.cli.PepperCli(seconds_to_wait=0.1)
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login):
+        start = time.time()
+        rets = [(exit_code, json.loads(ret)) for exit_code, ret in cli.run()]
+    assert time.time() - start < 10
+    return rets
+
+
+def _lowstates(fake_salt_api):
+    return [json.loads(req.body.decode())[0] for req in fake_salt_api.requests if req.path == '/']
+
+
+def test_fail_fast(fake_salt_api):
+    _master(fake_salt_api)
+    rets = _run(fake_salt_api, '--fail-any', '--fail-fast')
+    assert rets == [
+        (None, [{'m0': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+        (None, [{'m2': {'ret': False, 'retcode': 2, 'jid': JID}}]),
+        (2, [{'Aborted': {'jid': JID, 'minion': 'm2', 'retcode': 2, 'killed': False}}]),
+    ]
+    assert 'saltutil.kill_job' not in [low['fun'] for low in _lowstates(fake_salt_api)]
+
+
+def test_kill_on_fail(fake_salt_api):
+    _master(fake_salt_api)
+    rets = _run(fake_salt_api, '--fail-any-none', '--kill-on-fail')
+    assert rets[-1] == (2, [{'Aborted': {'jid': JID, 'minion': 'm2', 'retcode': 2, 'killed': True}}])
+    kill = _lowstates(fake_salt_api)[-1]
+    assert kill['fun'] == 'saltutil.kill_job'
+    assert kill['arg'] == [JID]
+    assert kill['tgt'] == 'ms-*'
+
+
+def test_exit_code(fake_salt_api):
+    _master(fake_salt_api)
+    sys.argv = _argv(fake_salt_api, '--fail-any', '--fail-fast')
+    with patch('pepper.cli.PepperCli.login', lambda self, api: None):
+        assert pepper.script.Pepper(pepper.cli.PepperCli(seconds_to_wait=0.1))() == 2
+
+
+def test_requires_fail_any():
+    sys.argv = ['pepper', '--fail-all', '--fail-fast', 'ms-*', 'state.apply']
+    with pytest.raises(SystemExit):
+        pepper.cli.PepperCli()
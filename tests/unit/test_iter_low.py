@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import, unicode_literals
+import io
+import json
+
+# Import Pepper Libraries
+import pepper
+from pepper.jsonstream import iter_return_items
+
+# Import Testing Libraries
+import pytest
+
+RETURN = {
+    'return': [{
+        'minion{0}'.format(i): {
+            'ret': {'cmd_|-héllo_|-echo ✓_|-run': {'result': True, 'changes': {'pid': 1000 + i}}},
+            'retcode': i % 3,
+            'jid': '20180414193904158892',
+        } for i in range(2000)
+    }]
+}
+
+
+class CountingReader(io.BytesIO):
+    def __init__(self, *args):
+        io.BytesIO.__init__(self, *args)
+        self.consumed = 0
+
+    def read(self, size=-1):
+        data = io.BytesIO.read(self, size)
+        self.consumed += len(data)
+        return data
+
+
+@pytest.mark.parametrize('chunk_size', [1, 7, 4096])
+def test_iter_return_items(chunk_size):
+    body = json.dumps(RETURN, indent=4).encode('utf-8')
+    assert dict(iter_return_items(io.BytesIO(body), chunk_size)) == RETURN['return'][0]
+
+
+def test_iter_return_items_is_incremental():
+    body = json.dumps(RETURN).encode('utf-8')
+    fp = CountingReader(body)
+    items = iter_return_items(fp, 1024)
+    minion, ret = next(items)
+    assert minion == 'minion0'
+    assert ret == RETURN['return'][0]['minion0']
+    assert fp.consumed < 2048 < len(body)
+
+
+@pytest.mark.parametrize('body, expected', [
+    ('{"return": [{"ms-0": true}, {"ms-1": 12345}]}', [('ms-0', True), ('ms-1', 12345)]),
+    ('{"return": [{}, "Failed to authenticate", [1, 2]]}', [(None, 'Failed to authenticate'), (None, [1, 2])]),
+    ('{"_links": {"jobs": []}, "return": []}', []),
+    ('[{"token": "abc"}]', [('token', 'abc')]),
+])
+def test_iter_return_items_shapes(body, expected):
+    assert list(iter_return_items(io.BytesIO(body.encode()), 3)) == expected
+
+
+def test_iter_return_items_invalid():
+    with pytest.raises(ValueError):
+        list(iter_return_items(io.BytesIO(b'{"return": [{"ms-0": tru'), 4))
+
+
+def test_iter_low(fake_salt_api):
+    fake_salt_api.routes['/'] = lambda req: (200, {}, RETURN)
+    api = pepper.Pepper(fake_salt_api.url)
+    api.login('pepper', 'pepper', 'sharedsecret')
+    low = [{'client': 'local', 'tgt': '*', 'fun': 'state.apply'}]
+    assert dict(api.iter_low(low)) == RETURN['return'][0]
+    # the connection was fully read and goes back to the pool
+    assert api.low(low) == RETURN
+    assert fake_salt_api.connections == 1
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+import threading
+
+# Import Pepper Libraries
+from pepper import JobTracker, Pepper, PepperException
+
+# Import Testing Libraries
+import pytest
+
+
+class FakeMaster(object):
+    '''
+    Publishes jobs to two minions; a minion returns after the job was looked
+    up ``returns_after[minion]`` times, ``None`` for never
+    '''
+    def __init__(self, returns_after):
+        self.returns_after = returns_after
+        self.lookups = {}
+        self.ticks = []
+        self.lock = threading.Lock()
+
+    def route(self, req):
+        load = json.loads(req.body.decode())
+        if load[0]['fun'] == 'jobs.list_job':
+            self.ticks.append(sorted(low['kwarg']['jid'] for low in load))
+        return 200, {}, {'return': [self.low(low) for low in load]}
+
+    def low(self, low):
+        with self.lock:
+            if low['client'] == 'local_async':
+                jid = str(len(self.lookups))
+                self.lookups[jid] = 0
+                return {'jid': jid, 'minions': ['ms-0', 'ms-1']} if low['tgt'] != 'nomatch' else {}
+            jid = low['kwarg']['jid']
+            self.lookups[jid] += 1
+            result = {}
+            for minion, after in self.returns_after(jid).items():
+                if after is not None and self.lookups[jid] >= after:
+                    result[minion] = {'return': jid, 'retcode': 0, 'success': True}
+            return {'jid': jid, 'Result': result}
+
+
+@pytest.fixture
+def api(fake_salt_api):
+    api = Pepper(fake_salt_api.url)
+    yield api
+    api.close()
+
+
+def test_one_request_per_tick(api, fake_salt_api):
+    # job N completes after N % 3 + 1 lookups
+    master = FakeMaster(lambda jid: {'ms-0': 1, 'ms-1': int(jid) % 3 + 1})
+    fake_salt_api.routes['/'] = master.route
+    tracker = JobTracker(api, poll_interval=0)
+    done = []
+    for i in range(30):
+        tracker.local_async('ms-*', 'test.sleep', callback=done.append)
+
+    jobs = list(tracker)
+
+    assert len(master.ticks) == 3
+    assert [len(tick) for tick in master.ticks] == [30, 20, 10]
+    assert sorted(job.jid for job in jobs) == sorted(str(i) for i in range(30))
+    assert done == jobs
+    job = jobs[0]
+    assert job.done and not job.timed_out and job.missing == []
+    assert job.returns['ms-1'] == {'ret': job.jid, 'retcode': 0, 'jid': job.jid}
+    assert len(tracker) == 0
+
+
+def test_timeout(api, fake_salt_api):
+    master = FakeMaster(lambda jid: {'ms-0': 1, 'ms-1': None})
+    fake_salt_api.routes['/'] = master.route
+    tracker = JobTracker(api, poll_interval=0.01, timeout=0.1)
+    job = tracker.local_async('ms-*', 'test.sleep')
+
+    assert list(tracker) == [job]
+    assert job.timed_out
+    assert job.missing == ['ms-1']
+    assert list(job.returns) == ['ms-0']
+
+
+def test_poll(api, fake_salt_api):
+    master = FakeMaster(lambda jid: {'ms-0': 1, 'ms-1': 2})
+    fake_salt_api.routes['/'] = master.route
+    tracker = JobTracker(api)
+    job = tracker.local_async('ms-*', 'test.sleep')
+
+    assert tracker.poll() == []
+    assert tracker.pending == [job.jid] and job.missing == ['ms-1']
+    assert tracker.poll() == [job]
+    assert tracker.pending == []
+    assert tracker.poll() == []
+    assert len(master.ticks) == 2
+
+
+def test_not_published(api, fake_salt_api):
+    fake_salt_api.routes['/'] = FakeMaster(lambda jid: {}).route
+    with pytest.raises(PepperException):
+        JobTracker(api).local_async('nomatch', 'test.ping')
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+import sys
+import threading
+
+# Import Pepper Libraries
+import pepper.cli
+import pepper.script
+
+# Import Testing Libraries
+from mock import patch
+
+JID = '20180414193904158892'
+
+
+def _streaming_route(printed, streamed):
+    '''
+    Send the first minion return, then wait until pepper printed it before
+    sending the rest of the response
+    '''
+    def route(req):
+        head = '{{"return": [{{"ms-0": {{"ret": true, "retcode": 0, "jid": "{0}"}}'.format(JID).encode()
+        tail = ', "ms-1": {{"ret": "häj", "retcode": 3, "jid": "{0}"}}}}]}}'.format(JID).encode('utf-8')
+        req.send_response(200)
+        req.send_header('Content-Type', 'application/json')
+        req.send_header('Content-Length', str(len(head) + len(tail)))
+        req.end_headers()
+        req.wfile.write(head)
+        req.wfile.flush()
+        streamed.append(printed.wait(5))
+        req.wfile.write(tail)
+    return route
+
+
+def _pepper(fake_salt_api, *args):
+    sys.argv = ['pepper', '-u', fake_salt_api.url, '--out', 'ndjson'] + list(args) + ['ms-*', 'test.ping']
+    cli = pepper.cli.PepperCli(seconds_to_wait=0.1)
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login):
+        return pepper.script.Pepper(cli)()
+
+
+def test_ndjson_streams(fake_salt_api, capsys):
+    printed, streamed = threading.Event(), []
+    fake_salt_api.routes['/'] = _streaming_route(printed, streamed)
+    write = pepper.script.Pepper.write
+
+    def write_and_signal(self, text):
+        write(self, text)
+        printed.set()
+
+    with patch('pepper.script.Pepper.write', write_and_signal):
+        assert _pepper(fake_salt_api, '--fail-any') == 3
+    # the first return was printed before the response was complete
+    assert streamed == [True]
+
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {'ms-0': {'ret': True, 'retcode': 0, 'jid': JID}},
+        {'ms-1': {'ret': 'häj', 'retcode': 3, 'jid': JID}},
+    ]
+
+
+def test_ndjson_polled(fake_salt_api, capsys):
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['client'] == 'local_async':
+            return 200, {}, {'return': [{'jid': JID, 'minions': ['ms-0', 'ms-1']}]}
+        return 200, {}, {'return': [{'jid': JID, 'Result': {'ms-0': {'return': True, 'retcode': 0}}}]}
+
+    fake_salt_api.routes['/'] = route
+    assert _pepper(fake_salt_api, '--fail-if-incomplete', '--timeout', '1', '--summary') == 1
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert lines == [
+        {'ms-0': {'ret': True, 'retcode': 0, 'jid': JID}},
+        {'Failed': ['ms-1']},
+        {'Summary': {'Returned': 1, 'Retcodes': {'0': 1}}},
+    ]
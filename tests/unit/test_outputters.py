@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import os
+import sys
+
+# Import Pepper Libraries
+import pepper.script
+from pepper.outputters import OutputterIndex
+
+from mock import patch, MagicMock
+
+
+def _highstate():
+    pass
+
+
+_highstate.__outputter__ = 'highstate'
+
+
+def _ping():
+    pass
+
+
+MODULES = {'state.apply': _highstate, 'test.ping': _ping}
+
+
+def _index(tmpdir):
+    module_dir = tmpdir.ensure('_modules', dir=True)
+    module_dir.ensure('custom.py')
+    return OutputterIndex(str(tmpdir.join('cache', 'outputters.json')), {'module_dirs': [str(module_dir)]})
+
+
+def test_built_once_and_persisted(tmpdir):
+    with patch('salt.loader.minion_mods', MagicMock(return_value=MODULES)) as minion_mods:
+        index = _index(tmpdir)
+        assert index.get('state.apply') == 'highstate'
+        assert index.get('test.ping') == 'nested'
+        assert index.get('state.apply') == 'highstate'
+        assert minion_mods.call_count == 1
+
+        assert _index(tmpdir).get('state.apply') == 'highstate'
+        assert minion_mods.call_count == 1
+
+
+def test_rebuilt_when_modules_change(tmpdir):
+    with patch('salt.loader.minion_mods', MagicMock(return_value=MODULES)) as minion_mods:
+        _index(tmpdir).get('state.apply')
+        custom = tmpdir.join('_modules', 'custom.py')
+        os.utime(str(custom), (1, 1))
+        _index(tmpdir).get('state.apply')
+        assert minion_mods.call_count == 2
+
+
+def test_corrupt_index_is_rebuilt(tmpdir):
+    with patch('salt.loader.minion_mods', MagicMock(return_value=MODULES)) as minion_mods:
+        index = _index(tmpdir)
+        tmpdir.ensure('cache', 'outputters.json').write('{"fingerprint"')
+        assert index.get('state.apply') == 'highstate'
+        assert minion_mods.call_count == 1
+    assert _index(tmpdir).load() == {'state.apply': 'highstate'}
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: {'return': [{'ms-0': True}]}))
+def test_script_does_not_load_minion_modules(tmpdir):
+    sys.argv = ['pepper', '--outputter-cache', str(tmpdir.join('outputters.json')), '*', 'test.ping']
+    with patch('salt.loader.minion_mods') as minion_mods, \
+            patch('salt.output.display_output') as display_output, \
+            patch('pepper.outputters.OutputterIndex.fingerprint', return_value='x'):
+        assert pepper.script.Pepper()() == 0
+        assert pepper.script.Pepper()() == 0
+    assert minion_mods.call_count == 1
+    assert display_output.call_args[0][:2] == ({'ms-0': True}, 'nested')
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+import sys
+import time
+
+# Import Pepper Libraries
+import pepper.cli
+import pepper.script
+from pepper.poll import Backoff, quorum_size
+
+# Import Testing Libraries
+from mock import patch
+
+JID = '20180414193904158892'
+MINIONS = ['m{0}'.format(i) for i in range(10)]
+
+
+def test_backoff():
+    backoff = Backoff(initial=0.25, maximum=3, jitter=0)
+    assert [backoff.next() for _ in range(6)] == [0.25, 0.5, 1, 2, 3, 3]
+    backoff.reset()
+    assert backoff.next() == 0.25
+
+
+def test_backoff_long_wait():
+    backoff = Backoff(maximum=3, jitter=0)
+    assert [backoff.next() for _ in range(5000)][-1] == 3
+
+
+def test_backoff_jitter():
+    backoff = Backoff(initial=1, maximum=1, jitter=0.5)
+    delays = [backoff.next() for _ in range(100)]
+    assert all(0.5 <= delay <= 1 for delay in delays)
+    assert len(set(delays)) > 1
+
+
+def test_quorum_size():
+    assert quorum_size('90%', 55) == 50
+    assert quorum_size('100%', 55) == 55
+    assert quorum_size(' 3 ', 55) == 3
+    assert quorum_size(80, 10) == 10
+
+
+def _master(fake_salt_api, returned):
+    lookups = []
+
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['client'] == 'local_async':
+            return 200, {}, {'return': [{'jid': JID, 'minions': MINIONS}]}
+        lookups.append(time.time())
+        # one more minion returns with every lookup
+        count = min(len(lookups), len(returned))
+        result = dict((minion, {'return': True, 'retcode': 0}) for minion in returned[:count])
+        return 200, {}, {'return': [{'jid': JID, 'Result': result}]}
+
+    fake_salt_api.routes['/'] = route
+    return lookups
+
+
+def _run(fake_salt_api, *args, **kwargs):
+    sys.argv = ['pepper', '-u', fake_salt_api.url] + list(args) + ['*', 'test.ping']
+    cli = pepper.cli.PepperCli(seconds_to_wait=kwargs.get('seconds_to_wait', 0.2))
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login):
+        return [(exit_code, json.loads(ret)) for exit_code, ret in cli.run()]
+
+
+def test_quorum(fake_salt_api):
+    _master(fake_salt_api, MINIONS[:8])
+    start = time.time()
+    rets = _run(fake_salt_api, '--quorum', '70%', '--timeout', '30')
+    assert time.time() - start < 10
+    assert len([ret for exit_code, ret in rets if exit_code is None]) == 7
+    assert rets[-1] == (0, [{'Stragglers': ['m7', 'm8', 'm9']}])
+
+
+def test_stall_timeout(fake_salt_api):
+    _master(fake_salt_api, MINIONS[:2])
+    start = time.time()
+    rets = _run(fake_salt_api, '--stall-timeout', '0.5', '--fail-if-incomplete', '--timeout', '30')
+    assert time.time() - start < 10
+    assert [list(ret[0]) for exit_code, ret in rets[:-1]] == [['m0'], ['m1']]
+    assert rets[-1] == (1, [{'Stragglers': MINIONS[2:]}])
+
+
+def test_timeout(fake_salt_api):
+    lookups = _master(fake_salt_api, MINIONS[:3])
+    rets = _run(fake_salt_api, '--fail-if-incomplete', '--timeout', '2', seconds_to_wait=1)
+    assert rets[-1][0] == 1
+    assert sorted(rets[-1][1][0]['Failed']) == MINIONS[3:]
+    # polled fast at first, backing off up to seconds_to_wait
+    intervals = [b - a for a, b in zip(lookups, lookups[1:])]
+    assert intervals[0] < 0.4
+    assert 0.45 < max(intervals) < 1.2
+
+
+def test_missing_retcodes(fake_salt_api):
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['client'] == 'local_async':
+            return 200, {}, {'return': [{'jid': JID, 'minions': MINIONS[:2]}]}
+        # older masters only record whether the job succeeded
+        result = dict((minion, {'return': True, 'success': True}) for minion in MINIONS[:2])
+        return 200, {}, {'return': [{'jid': JID, 'Result': result}]}
+
+    fake_salt_api.routes['/'] = route
+    rets = _run(fake_salt_api, '--fail-if-incomplete')
+    returns = dict(item for exit_code, ret in rets if exit_code is None for item in ret[0].items())
+    assert returns == dict((minion, {'ret': True, 'jid': JID}) for minion in MINIONS[:2])
+
+    # so the returns count as having no retcode
+    sys.argv = ['pepper', '-u', fake_salt_api.url, '--fail-if-incomplete', '--fail-any-none', '*', 'test.ping']
+    with patch('pepper.cli.PepperCli.login', lambda cli, api: setattr(api, 'auth', {'token': 'faketoken'})):
+        assert pepper.script.Pepper()() == -1
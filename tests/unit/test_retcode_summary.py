@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+import sys
+
+# Import Pepper Libraries
+import pepper.script
+from pepper.retcode import PepperRetcode, RetcodeSummary
+
+# Import Testing Libraries
+from mock import patch, MagicMock
+
+JID = '20180414193904158892'
+
+# two lowstates; the second one has the failure
+PAYLOAD = {
+    'return': [
+        {
+            'ms-0': {'jid': JID, 'ret': True, 'retcode': 0},
+            'ms-1': {'jid': JID, 'ret': True, 'retcode': 0},
+        },
+        {
+            'ms-0': {'jid': JID, 'ret': 'not found', 'retcode': 127},
+            'ms-1': {'jid': JID, 'ret': 'no retcode'},
+        },
+    ]
+}
+
+
+def test_summary():
+    summary = RetcodeSummary.of(PAYLOAD)
+    assert summary.counts == {0: 2, 127: 1}
+    assert summary.failed == ['ms-0']
+    assert summary.missing == ['ms-1']
+    assert summary.first_failure == ('ms-0', 127, JID)
+    assert summary.report() == {
+        'Returned': 4,
+        'Retcodes': {'0': 2, '127': 1},
+        'Failed': ['ms-0'],
+        'Missing retcode': ['ms-1'],
+    }
+
+
+def test_chunks_and_reports():
+    summary = RetcodeSummary()
+    summary.add([{'ms-0': {'ret': True, 'retcode': 0}}])
+    summary.add([{'ms-1': {'ret': False, 'retcode': 2}}])
+    summary.add([{'Failed': ['ms-2']}])
+    assert summary.counts == {0: 1, 2: 1}
+    assert summary.missing == []
+    assert summary.fail_any() == 2
+    assert summary.fail_all() == 0
+
+
+def test_runner_and_wheel_results_are_left_out():
+    runner = {'fun': 'runner.jobs.list_jobs', 'jid': JID, 'user': 'saltdev', 'return': {}, 'success': True}
+    wheel = {'tag': 'salt/wheel/{0}'.format(JID), 'data': {
+        'fun': 'wheel.key.list_all', 'jid': JID, 'return': {'minions': ['ms-0']}, 'success': True}}
+    summary = RetcodeSummary.of({'return': [runner, wheel, {'ms-0': {'jid': JID, 'ret': True, 'retcode': 0}}]})
+    assert summary.counts == {0: 1}
+    assert summary.missing == []
+    assert summary.report() == {'Returned': 1, 'Retcodes': {'0': 1}}
+    assert PepperRetcode.validate_fail_any_none({'return': [runner]}) == -1
+
+
+def test_policies():
+    assert PepperRetcode.validate_fail_any(PAYLOAD) == 127
+    assert PepperRetcode.validate_fail_any_none(PAYLOAD) == 127
+    assert PepperRetcode.validate_fail_all(PAYLOAD) == 0
+    assert PepperRetcode.validate_fail_all_none(PAYLOAD) == 0
+
+    failing = {'return': [{'ms-0': {'retcode': 2}}, {'ms-1': {'retcode': 3}}]}
+    assert PepperRetcode.validate_fail_all(failing) == 2
+    assert PepperRetcode.validate_fail_all_none(failing) == 2
+
+    for empty in ({'return': [{}]}, {'return': ['Failed to authenticate']}, None):
+        assert PepperRetcode.validate_fail_any(empty) == 0
+        assert PepperRetcode.validate_fail_any_none(empty) == -1
+        assert PepperRetcode.validate_fail_all(empty) == 0
+        assert PepperRetcode.validate_fail_all_none(empty) == -1
+
+
+def test_streamed_chunks_are_validated():
+    chunks = [
+        (None, [{'ms-0': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+        (None, [{'ms-1': {'ret': False, 'retcode': 2, 'jid': JID}}]),
+        (None, [{'ms-2': {'ret': True, 'retcode': 0, 'jid': JID}}]),
+    ]
+    sys.argv = ['pepper', '--fail-any', 'ms-*', 'test.ping']
+    output = pepper.script.Pepper()
+    with patch.object(output, 'display'):
+        assert output.render(iter(chunks)) == 2
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_summary_option(capsys):
+    sys.argv = ['pepper', '--summary', '--fail-any', 'ms-*', 'test.ping']
+    with patch('pepper.script.HAS_SALT', False):
+        ret_code = pepper.script.Pepper()()
+    assert ret_code == 127
+    out = capsys.readouterr().out
+    summary = json.loads(out[out.index('{\n    "Summary"'):])
+    assert summary['Summary']['Retcodes'] == {'0': 2, '127': 1}
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import email.utils
+import socket
+import time
+
+try:
+    from urllib.error import HTTPError, URLError
+except ImportError:
+    from urllib2 import HTTPError, URLError
+
+# Import Pepper Libraries
+import pepper
+from pepper.exceptions import PepperCircuitOpenException, PepperException
+from pepper.retry import CircuitBreaker, RetryPolicy
+
+# Import Testing Libraries
+import pytest
+from mock import patch
+
+PING = [{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]
+RUN = [{'client': 'local', 'tgt': '*', 'fun': 'cmd.run', 'arg': ['reboot']}]
+
+
+def _failing(*responses):
+    '''
+    A route answering with ``responses`` in turn, then echoing the lowstate
+    '''
+    responses = list(responses)
+
+    def route(req):
+        if responses:
+            status, headers = responses.pop(0)
+            return status, headers, {'return': ['unavailable']}
+        return 200, {}, {'return': ['ok']}
+    return route
+
+
+def _api(fake_salt_api, **kwargs):
+    api = pepper.Pepper(fake_salt_api.url, **kwargs)
+    api.auth = {'token': 'faketoken'}
+    return api
+
+
+def test_policy():
+    policy = RetryPolicy()
+    assert policy.is_idempotent('GET', '/keys')
+    assert policy.is_idempotent('POST', '/login', {'username': 'pepper'})
+    assert policy.is_idempotent('POST', '/', PING + [{'client': 'runner', 'fun': 'jobs.lookup_jid'}])
+    assert not policy.is_idempotent('POST', '/', PING + RUN)
+    assert not policy.should_retry(0, False, status=502)
+    assert policy.should_retry(0, False, status=503)
+    assert policy.should_retry(0, False, error=ConnectionRefusedError(111, 'refused'))
+    assert not policy.should_retry(0, False, error=ConnectionResetError(104, 'reset'))
+    assert policy.should_retry(0, True, error=ConnectionResetError(104, 'reset'))
+    assert not policy.should_retry(3, True, status=503)
+
+    date = email.utils.formatdate(time.time() + 30, usegmt=True)
+    assert 28 < policy.retry_after({'Retry-After': date}) <= 30
+    assert policy.retry_after({'Retry-After': '7'}) == 7
+
+
+def test_retry_after_is_honoured(fake_salt_api):
+    fake_salt_api.routes['/'] = _failing((503, {'Retry-After': '2'}), (502, {}))
+    api = _api(fake_salt_api)
+    with patch.object(api.retry, 'sleep') as sleep:
+        assert api.low(PING) == {'return': ['ok']}
+    assert len(fake_salt_api.requests) == 3
+    delays = [call[0][0] for call in sleep.call_args_list]
+    assert delays[0] >= 2 and delays[1] < 2
+
+
+def test_long_retry_after_gives_up(fake_salt_api):
+    fake_salt_api.routes['/'] = _failing((503, {'Retry-After': '3600'}))
+    api = _api(fake_salt_api)
+    with patch.object(api.retry, 'sleep') as sleep:
+        with pytest.raises(HTTPError):
+            api.low(PING)
+    assert not sleep.called
+
+
+def test_unsafe_command_is_not_retried(fake_salt_api):
+    fake_salt_api.routes['/'] = _failing((502, {}))
+    api = _api(fake_salt_api)
+    with patch.object(api.retry, 'sleep'):
+        with pytest.raises(HTTPError):
+            api.low(RUN)
+        assert len(fake_salt_api.requests) == 1
+
+        # salt-api declined it, so it was not run
+        fake_salt_api.routes['/'] = _failing((503, {}))
+        assert api.low(RUN) == {'return': ['ok']}
+
+
+def test_unreachable_master_is_retried():
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    url = 'http://127.0.0.1:{0}/'.format(sock.getsockname()[1])
+    sock.close()
+
+    api = pepper.Pepper(url, retry=RetryPolicy(retries=2))
+    with patch.object(api.retry, 'sleep') as sleep:
+        with pytest.raises(URLError):
+            api.low(RUN)
+    assert sleep.call_count == 2
+
+
+def test_breaker_fails_fast(fake_salt_api):
+    fake_salt_api.routes['/'] = _failing(*[(503, {})] * 2)
+    api = _api(fake_salt_api, retry=RetryPolicy(retries=0), breaker_threshold=2, breaker_timeout=0.2)
+    for _ in range(2):
+        with pytest.raises(HTTPError):
+            api.low(PING)
+    with pytest.raises(PepperCircuitOpenException):
+        api.low(PING)
+    assert len(fake_salt_api.requests) == 2
+    assert api.breaker(fake_salt_api.url).state == CircuitBreaker.OPEN
+
+    # a single request probes the master once the timeout elapsed
+    time.sleep(0.25)
+    assert api.low(PING) == {'return': ['ok']}
+    assert api.breaker(fake_salt_api.url).state == CircuitBreaker.CLOSED
+
+
+def test_breaker_reopens_after_failed_probe():
+    breaker = CircuitBreaker('http://salt-api', threshold=1, reset_timeout=0.1)
+    breaker.before_request()
+    breaker.failure()
+    time.sleep(0.15)
+    breaker.before_request()
+    # only one probe at a time
+    with pytest.raises(PepperCircuitOpenException):
+        breaker.before_request()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+
+def test_breaker_probe_ends_on_unexpected_error(fake_salt_api):
+    fake_salt_api.routes['/'] = _failing((503, {}))
+    api = _api(fake_salt_api, retry=RetryPolicy(retries=0), breaker_threshold=1, breaker_timeout=0.1)
+    with pytest.raises(HTTPError):
+        api.low(PING)
+    time.sleep(0.15)
+    with patch.object(api._pool, 'urlopen', side_effect=ValueError('unexpected')):
+        with pytest.raises(ValueError):
+            api.low(PING)
+    assert api.breaker(fake_salt_api.url).state == CircuitBreaker.OPEN
+
+    # the failed probe does not keep the breaker from probing again
+    time.sleep(0.15)
+    assert api.low(PING) == {'return': ['ok']}
+    assert api.breaker(fake_salt_api.url).state == CircuitBreaker.CLOSED
+
+
+def test_req_get_raises(fake_salt_api):
+    fake_salt_api.routes['/keys'] = _failing((503, {}))
+    api = _api(fake_salt_api)
+    with patch.object(api.retry, 'sleep') as sleep:
+        assert api.req_get('/keys') == {'return': ['ok']}
+    assert sleep.call_count == 1
+
+    with pytest.raises(PepperException):
+        api.req_get('/minions')
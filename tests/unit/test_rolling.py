@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import json
+import sys
+import threading
+import time
+
+# Import Pepper Libraries
+import pepper
+import pepper.cli
+from pepper.rolling import RollingBatch, window_size
+
+# Import Testing Libraries
+from mock import patch
+
+MINIONS = ['ms-{0}'.format(i) for i in range(10)]
+
+
+class FakeMaster(object):
+    '''
+    Runs jobs on simulated minions: ``ms-N`` returns ``(N % 3 + 1) * delay``
+    seconds after its job was published, ``ms-3`` fails and ``ms-7`` never
+    returns
+    '''
+    def __init__(self, delay=0.06):
+        self.delay = delay
+        self.jobs = {}
+        self.running = set()
+        self.max_running = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def route(self, req):
+        self.requests += 1
+        return 200, {}, {'return': [self.low(low) for low in json.loads(req.body.decode())]}
+
+    def low(self, low):
+        with self.lock:
+            if low['client'] == 'local_async' and low['tgt_type'] != 'list':
+                assert low['fun'] == 'test.ping'
+                return {'jid': 'ping', 'minions': MINIONS}
+            if low['client'] == 'local_async':
+                jid = str(len(self.jobs))
+                self.jobs[jid] = (time.time(), low['tgt'])
+                self.running.update(low['tgt'])
+                self.max_running = max(self.max_running, len(self.running))
+                return {'jid': jid, 'minions': low['tgt']}
+            assert low['fun'] == 'jobs.list_job'
+            published, minions = self.jobs[low['kwarg']['jid']]
+            result = {}
+            for minion in minions:
+                if minion == 'ms-7' or time.time() - published < (int(minion[3:]) % 3 + 1) * self.delay:
+                    continue
+                self.running.discard(minion)
+                result[minion] = {'return': minion != 'ms-3', 'retcode': int(minion == 'ms-3'), 'success': True}
+            return {'jid': low['kwarg']['jid'], 'Result': result}
+
+
+def _batch(fake_salt_api, **kwargs):
+    master = FakeMaster()
+    fake_salt_api.routes['/'] = master.route
+    api = pepper.Pepper(fake_salt_api.url)
+    kwargs.setdefault('poll_interval', 0.01)
+    kwargs.setdefault('timeout', 0.6)
+    return master, RollingBatch(api, 'ms-*', 'state.apply', **kwargs)
+
+
+def test_window_size():
+    assert window_size('10%', 55) == 5
+    assert window_size('1%', 5) == 1
+    assert window_size(' 3 ', 55) == 3
+
+
+def test_rolling_window(fake_salt_api):
+    master, batch = _batch(fake_salt_api, size=3)
+    rets = dict(batch)
+    assert sorted(rets) == sorted(set(MINIONS) - {'ms-7'})
+    assert rets['ms-3']['retcode'] == 1
+    assert rets['ms-0'] == {'ret': True, 'retcode': 0, 'jid': '0'}
+    assert master.max_running <= 3
+    # refilled as minions returned rather than in fixed batches of three
+    assert len(master.jobs) > 4
+    assert batch.failed == ['ms-3']
+    assert batch.missing == ['ms-7']
+    assert not batch.aborted and batch.not_run == []
+
+
+def test_percentage_window(fake_salt_api):
+    master, batch = _batch(fake_salt_api, size='20%')
+    list(batch)
+    assert master.max_running == 2
+
+
+def test_returns_are_streamed(fake_salt_api):
+    master, batch = _batch(fake_salt_api, size=2)
+    rets = iter(batch)
+    next(rets)
+    # the first return is seen before the later minions were even started
+    assert len(master.jobs) < 5
+
+
+def test_max_failures_abort(fake_salt_api):
+    master, batch = _batch(fake_salt_api, size=2, max_failures=0)
+    rets = dict(batch)
+    assert batch.aborted
+    assert batch.failed == ['ms-3']
+    assert batch.not_run and set(batch.not_run).isdisjoint(rets)
+    assert sorted(set(rets) | set(batch.not_run) | set(batch.missing)) == sorted(MINIONS)
+
+
+def test_cli_batch(fake_salt_api):
+    master = FakeMaster()
+    fake_salt_api.routes['/'] = master.route
+    sys.argv = ['pepper', '-u', fake_salt_api.url, '--batch', '50%', '--batch-max-failures', '0', '-t', '1',
+                'ms-*', 'test.ping']
+    cli = pepper.cli.PepperCli(seconds_to_wait=0.01)
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login):
+        rets = list(cli.run(serialize=False))
+
+    assert master.max_running == 5
+    assert rets[-1][0] == 1
+    # aborted after ms-3 failed, before ms-7 was started
+    summary = rets[-1][1][0]
+    assert 'Failed' not in summary
+    assert 'ms-7' in summary['Not run']
+    assert all(exit_code is None for exit_code, _ in rets[:-1])
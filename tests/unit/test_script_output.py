@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+import sys
+
+# Import Pepper Libraries
+import pepper.script
+
+from mock import patch, MagicMock
+
+PAYLOAD = {
+    "return": [
+        {
+            "ezh.msk.ru": {
+                "jid": "20180414193904158892",
+                "ret": "Hello from SaltStack",
+                "retcode": 1
+            }
+        }
+    ]
+}
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_run_yields_structured_results():
+    sys.argv = ['pepper', 'minion_id', 'request']
+    assert list(pepper.cli.PepperCli().run(serialize=False)) == [(0, PAYLOAD)]
+    assert [(exit_code, json.loads(ret)) for exit_code, ret in pepper.cli.PepperCli().run()] == [(0, PAYLOAD)]
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_salt_outputter_gets_structured_result():
+    sys.argv = ['pepper', '--fail-any', 'minion_id', 'request']
+    with patch('pepper.codec.dumps_pretty') as dumps_pretty, \
+            patch('pepper.codec.loads') as loads, \
+            patch('salt.output.display_output') as display_output:
+        ret_code = pepper.script.Pepper()()
+    assert ret_code == 1
+    assert not dumps_pretty.called
+    assert not loads.called
+    display_output.assert_called_once_with(
+        {'ezh.msk.ru': 'Hello from SaltStack'}, 'nested', opts=display_output.call_args[1]['opts'])
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_json_without_salt(capsys):
+    sys.argv = ['pepper', '--fail-any', 'minion_id', 'request']
+    with patch('pepper.script.HAS_SALT', False):
+        ret_code = pepper.script.Pepper()()
+    assert ret_code == 1
+    assert json.loads(capsys.readouterr().out) == PAYLOAD
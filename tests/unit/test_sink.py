@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import gzip
+import io
+import json
+import os
+import sys
+
+# Import Pepper Libraries
+import pepper.cli
+import pepper.script
+from pepper.exceptions import PepperException
+from pepper.sink import OutputSink
+
+# Import Testing Libraries
+from mock import patch
+
+JID = '20180414193904158892'
+MINIONS = ['m{0}'.format(i) for i in range(5)]
+
+
+def test_append(tmpdir):
+    path = tmpdir.join('out')
+    path.write('before\n')
+    with patch('pepper.sink.open', side_effect=open, create=True) as opened:
+        with OutputSink(str(path)) as sink:
+            for i in range(100):
+                print('line {0}'.format(i), file=sink)
+    assert opened.call_count == 1
+    assert path.read().splitlines() == ['before'] + ['line {0}'.format(i) for i in range(100)]
+
+
+def test_replace_is_atomic(tmpdir):
+    path = tmpdir.join('out')
+    path.write('before\n')
+    sink = OutputSink(str(path), append=False, flush=1)
+    print('häj', file=sink)
+    # written to a temporary file next to the output file
+    assert path.read() == 'before\n'
+    assert len(tmpdir.listdir()) == 2
+    sink.close()
+    assert path.read_text('utf-8') == 'häj\n'
+    assert tmpdir.listdir() == [path]
+
+
+def test_discard(tmpdir):
+    path = tmpdir.join('out')
+    path.write('before\n')
+    try:
+        with OutputSink(str(path), append=False, flush=1) as sink:
+            print('partial', file=sink)
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    assert path.read() == 'before\n'
+    assert tmpdir.listdir() == [path]
+
+
+def test_flush_policy(tmpdir):
+    path = tmpdir.join('out')
+    sink = OutputSink(str(path), flush='line')
+    sink.write('no newline yet')
+    assert not path.exists()
+    sink.write('\n')
+    assert path.read() == 'no newline yet\n'
+    sink.close()
+
+    path = tmpdir.join('sized')
+    sink = OutputSink(str(path), flush=10)
+    sink.write('12345')
+    assert not path.exists()
+    sink.write('67890')
+    assert path.read() == '1234567890'
+    sink.close()
+
+
+def test_gzip(tmpdir):
+    path = str(tmpdir.join('out.gz'))
+    for i in range(2):
+        with OutputSink(path, compress=True) as sink:
+            print('run {0}'.format(i), file=sink)
+    with gzip.open(path, 'rt') as f:
+        assert f.read() == 'run 0\nrun 1\n'
+
+
+def test_output_file_opened_once(fake_salt_api, tmpdir):
+    def route(req):
+        low = json.loads(req.body.decode())[0]
+        if low['client'] == 'local_async':
+            return 200, {}, {'return': [{'jid': JID, 'minions': MINIONS}]}
+        result = dict((minion, {'return': True, 'retcode': 0}) for minion in MINIONS)
+        return 200, {}, {'return': [{'jid': JID, 'Result': result}]}
+
+    fake_salt_api.routes['/'] = route
+    path = tmpdir.join('out.gz')
+    sys.argv = ['pepper', '-u', fake_salt_api.url, '--fail-if-incomplete', '--out', 'ndjson',
+                '--output-file', str(path), '--output-file-gzip', '--output-file-replace', '*', 'test.ping']
+    cli = pepper.cli.PepperCli()
+
+    def login(api):
+        api.auth = cli.auth = {'token': 'faketoken'}
+
+    with patch.object(cli, 'login', login), \
+            patch('pepper.sink.gzip.open', side_effect=gzip.open) as opened:
+        assert pepper.script.Pepper(cli)() == 0
+
+    assert opened.call_count == 1
+    with gzip.open(str(path), 'rt') as f:
+        assert sorted(list(json.loads(line))[0] for line in f) == MINIONS
+    assert os.listdir(str(tmpdir)) == ['out.gz']
+
+
+def _failing_run(tmpdir, path, *args):
+    '''
+    Render a run which fails after its first return
+    '''
+    def results():
+        yield None, [{'m0': True}]
+        raise PepperException('salt-api went away')
+
+    sys.argv = ['pepper', '--out', 'json', '--output-file', str(path)] + list(args) + ['*', 'test.ping']
+    output = pepper.script.Pepper(stderr=io.StringIO())
+    with patch('pepper.script.HAS_SALT', False):
+        return output.render(results())
+
+
+def test_failed_run_does_not_replace_output(tmpdir):
+    path = tmpdir.join('out.json')
+    path.write('{"m0": true, "m1": true}\n')
+    assert _failing_run(tmpdir, path, '--output-file-replace') == 1
+    assert path.read() == '{"m0": true, "m1": true}\n'
+    assert tmpdir.listdir() == [path]
+
+    # appended output is kept as it was printed
+    assert _failing_run(tmpdir, path) == 1
+    assert json.loads(path.read().split('\n', 1)[1]) == [{'m0': True}]
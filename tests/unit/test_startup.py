@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import json
+import subprocess
+import sys
+
+# Import Pepper Libraries
+import pepper.script
+
+from mock import patch, MagicMock
+
+PAYLOAD = {
+    "return": [
+        {
+            "ms-0": {"jid": "20180414193904158892", "ret": {"häj": [1, 2]}, "retcode": 0},
+            "ms-1": {"jid": "20180414193904158892", "ret": True, "retcode": 0},
+        }
+    ]
+}
+
+
+def test_import_is_lazy():
+    code = 'import sys, pepper.script; print(" ".join(sys.modules))'
+    modules = subprocess.check_output([sys.executable, '-c', code], universal_newlines=True).split()
+    assert 'pepper.script' in modules
+    eager = [name for name in modules if name.split('.')[0] in ('salt', 'pkg_resources')]
+    assert eager == []
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_json_out_without_salt_config(tmpdir, capsys):
+    sys.argv = ['pepper', '-m', str(tmpdir.join('master')), '--out', 'json', '*', 'test.ping']
+    with patch('salt.config.client_config') as client_config, \
+            patch('salt.output.display_output') as display_output:
+        assert pepper.script.Pepper()() == 0
+    assert not client_config.called
+    assert not display_output.called
+
+    # one document per minion, formatted like the Salt json outputter
+    out = capsys.readouterr().out
+    assert out == ''.join(
+        json.dumps({minion: ret['ret']}, indent=4, ensure_ascii=False) + '\n'
+        for minion, ret in PAYLOAD['return'][0].items()
+    )
+
+
+@patch('pepper.cli.PepperCli.login', MagicMock(side_effect=lambda arg: None))
+@patch('pepper.cli.PepperCli.low', MagicMock(side_effect=lambda api, load: PAYLOAD))
+def test_json_out_with_salt_config(tmpdir):
+    master = tmpdir.join('master')
+    master.write('output_indent: pretty\n')
+    sys.argv = ['pepper', '-m', str(master), '--out', 'json', '*', 'test.ping']
+    with patch('salt.output.display_output') as display_output:
+        assert pepper.script.Pepper()() == 0
+    assert display_output.call_count == 2
+    assert display_output.call_args[1]['opts']['output_indent'] == 'pretty'
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import ssl
+
+try:
+    from urllib.error import URLError
+except ImportError:
+    from urllib2 import URLError
+
+# Import Pepper Libraries
+import pepper
+from pepper.exceptions import PepperException
+from pepper.retry import RetryPolicy
+from pepper.transport import create_ssl_context
+
+# Import Testing Libraries
+import pytest
+from mock import patch
+
+PING = [{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]
+
+
+def _closing_route(resumed):
+    '''
+    Echo the lowstate on a connection closed afterwards, recording whether
+    its TLS session was resumed
+    '''
+    def route(req):
+        resumed.append(req.connection.session_reused)
+        return 200, {'Connection': 'close'}, {'return': ['ok']}
+    return route
+
+
+def test_create_ssl_context(tls_certificates):
+    context = create_ssl_context(ca_bundle=tls_certificates['server'], client_cert=tls_certificates['client'])
+    assert context.verify_mode == ssl.CERT_REQUIRED
+    assert context.check_hostname
+    assert create_ssl_context(verify=False).verify_mode == ssl.CERT_NONE
+
+
+def test_sessions_are_resumed(fake_salt_api_tls, tls_certificates):
+    resumed = []
+    fake_salt_api_tls.routes['/'] = _closing_route(resumed)
+    login = fake_salt_api_tls.routes['/login']
+
+    def closing_login(req):
+        status, headers, body = login(req)
+        return status, dict(headers, Connection='close'), body
+
+    fake_salt_api_tls.routes['/login'] = closing_login
+    api = pepper.Pepper(fake_salt_api_tls.url, ca_bundle=tls_certificates['server'])
+    api.login('pepper', 'pepper', 'sharedsecret')
+    context = api._pool.ssl_context
+    for _ in range(3):
+        assert api.low(PING) == {'return': ['ok']}
+    # every request needed a new connection, which resumed the TLS session
+    assert fake_salt_api_tls.connections == 4
+    assert resumed == [True, True, True]
+    assert api._pool.ssl_context is context
+    api.close()
+
+
+def test_unknown_certificate_is_rejected(fake_salt_api_tls, tls_certificates):
+    api = pepper.Pepper(fake_salt_api_tls.url, ca_bundle=tls_certificates['other'])
+    with patch.object(api.retry, 'sleep') as sleep:
+        with pytest.raises(URLError) as exc:
+            api.login('pepper', 'pepper', 'sharedsecret')
+    assert isinstance(exc.value.reason, ssl.SSLCertVerificationError)
+    # retrying would not help
+    assert not sleep.called
+
+    api = pepper.Pepper(fake_salt_api_tls.url, ignore_ssl_errors=True)
+    assert api.login('pepper', 'pepper', 'sharedsecret')['token'] == 'faketoken'
+
+
+def test_client_certificate(fake_salt_api_tls, tls_certificates):
+    certificates = []
+
+    def index(req):
+        certificates.append(req.connection.getpeercert())
+        return 200, {}, {'return': 'Welcome'}
+
+    fake_salt_api_tls.routes['/keys'] = index
+    api = pepper.Pepper(fake_salt_api_tls.url, ca_bundle=tls_certificates['server'],
+                        client_cert=tls_certificates['client'])
+    api.login('pepper', 'pepper', 'sharedsecret')
+    # the requests session presents the certificate too
+    assert api.req_get('/keys') == {'return': 'Welcome'}
+    assert certificates[0]['subject'] == ((('commonName', 'localhost'),),)
+    api.close()
+
+    api = pepper.Pepper(fake_salt_api_tls.url, ca_bundle=tls_certificates['server'])
+    api.login('pepper', 'pepper', 'sharedsecret')
+    assert api.req_get('/keys') == {'return': 'Welcome'}
+    assert certificates[1] is None
+
+
+def test_requests_session_verifies(fake_salt_api_tls, tls_certificates):
+    api = pepper.Pepper(fake_salt_api_tls.url, ca_bundle=tls_certificates['other'], retry=RetryPolicy(retries=0))
+    api.auth = {'token': 'faketoken'}
+    with pytest.raises(PepperException):
+        api.req_get('/keys')
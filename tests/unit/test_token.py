@@ -1,36 +1,61 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 import json
+import time
 import sys
 
 # Import Pepper Libraries
 import pepper.cli
 
 # Import Testing Libraries
-from mock import patch, mock_open, MagicMock
+from mock import patch, MagicMock
 
 
-def test_token():
+def test_token(tmpdir):
     sys.argv = ['pepper', '*', 'test.ping']
     client = pepper.cli.PepperCli()
     client.options.mktoken = True
+    client.options.cache = str(tmpdir.join('.peppercache'))
     mock_data = (
         '{"perms": [".*", "@runner", "@wheel", "@jobs"], "start": 1529967752.516165, '
         '"token": "7130faa1e17f935d5f2702465cafdc73212d64d0", "expire": 1529968905.1131861, '
         '"user": "pepper", "eauth": "pam"}\n'
     )
-    mock_api = MagicMock()
-    mock_api.login = MagicMock(return_value=mock_data)
-    with patch('pepper.cli.open', mock_open(read_data=mock_data)), \
-            patch('pepper.cli.PepperCli.get_login_details', MagicMock(return_value=mock_data)), \
-            patch('pepper.cli.PepperCli.parse_login', MagicMock(return_value={})), \
-            patch('os.remove', MagicMock(return_value=None)), \
-            patch('json.dump', MagicMock(side_effect=Exception('Test Error'))):
+    mock_api = MagicMock(auth={}, token_manager=None)
+    mock_api.login = MagicMock(side_effect=lambda **kwargs: json.loads(mock_data))
+    with patch('pepper.cli.PepperCli.parse_login', MagicMock(return_value={})):
+        # the cached token expired
+        tmpdir.join('.peppercache').write(mock_data)
         ret1 = client.login(mock_api)
-        with patch('os.path.isfile', MagicMock(return_value=False)):
-            ret2 = client.login(mock_api)
+        # no cached token
+        tmpdir.join('.peppercache').remove()
+        mock_api.auth = {}
+        ret2 = client.login(mock_api)
+        # the cached token is still valid
+        mock_api.auth = {}
         with patch('time.time', MagicMock(return_value=1529968044.133632)):
             ret3 = client.login(mock_api)
-    assert json.loads(ret1) == json.loads(mock_data)
-    assert json.loads(ret2) == json.loads(mock_data)
+    mock_api.token_manager.close()
+    assert ret1 == json.loads(mock_data)
+    assert ret2 == json.loads(mock_data)
     assert ret3 == json.loads(mock_data)
+    assert json.loads(tmpdir.join('.peppercache').read()) == json.loads(mock_data)
+
+
+def test_token_cache_cannot_be_written(tmpdir):
+    sys.argv = ['pepper', '*', 'test.ping']
+    client = pepper.cli.PepperCli()
+    client.options.mktoken = True
+    # the parent of the cache is a regular file
+    tmpdir.join('notadir').write('')
+    client.options.cache = str(tmpdir.join('notadir', '.peppercache'))
+    auth = {'token': '7130faa1e17f935d5f2702465cafdc73212d64d0', 'start': time.time(),
+            'expire': time.time() + 3600, 'user': 'pepper', 'eauth': 'pam'}
+    mock_api = MagicMock(auth={}, token_manager=None)
+    mock_api.login = MagicMock(return_value=auth)
+    with patch('pepper.cli.PepperCli.parse_login', MagicMock(return_value={})):
+        ret = client.login(mock_api)
+    mock_api.token_manager.close()
+    # the login still succeeds, without caching the token
+    assert ret == auth
+    assert tmpdir.listdir() == [tmpdir.join('notadir')]
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import print_function, unicode_literals, absolute_import
+import itertools
+import json
+import multiprocessing
+import os
+import stat
+import threading
+import time
+
+# Import Pepper Libraries
+from pepper import Pepper, PepperException, TokenManager
+
+# Import Testing Libraries
+import pytest
+
+CREDENTIALS = {'username': 'saltdev', 'password': 'saltdev', 'eauth': 'pam'}
+
+
+def _logins(fake_salt_api):
+    return len([req for req in fake_salt_api.requests if req.path == '/login'])
+
+
+def _issue_tokens(fake_salt_api, lifetime=3600, delay=0):
+    counter = itertools.count(1)
+
+    def login(req):
+        time.sleep(delay)
+        now = time.time()
+        token = 'token-{0}'.format(next(counter))
+        return 200, {}, {'return': [{'token': token, 'start': now, 'expire': now + lifetime}]}
+
+    fake_salt_api.routes['/login'] = login
+
+
+def _get_token(url, cache):
+    api = Pepper(url)
+    TokenManager(api, CREDENTIALS, cache=cache, background=False).get()
+    api.close()
+
+
+def test_concurrent_threads_login_once(fake_salt_api, tmpdir):
+    _issue_tokens(fake_salt_api, delay=0.2)
+    cache = str(tmpdir.join('cache', 'token'))
+    tokens = []
+
+    def get():
+        api = Pepper(fake_salt_api.url)
+        tokens.append(TokenManager(api, CREDENTIALS, cache=cache, background=False).get()['token'])
+        api.close()
+
+    threads = [threading.Thread(target=get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert _logins(fake_salt_api) == 1
+    assert tokens == ['token-1'] * 8
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_concurrent_processes_login_once(fake_salt_api, tmpdir):
+    _issue_tokens(fake_salt_api, delay=0.2)
+    cache = str(tmpdir.join('token'))
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_get_token, args=(fake_salt_api.url, cache)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(10)
+
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert _logins(fake_salt_api) == 1
+    with open(cache) as f:
+        assert json.load(f)['token'] == 'token-1'
+
+
+def test_cache_is_private(fake_salt_api, tmpdir):
+    _issue_tokens(fake_salt_api)
+    cache = str(tmpdir.join('token'))
+    _get_token(fake_salt_api.url, cache)
+    assert stat.S_IMODE(os.stat(cache).st_mode) == 0o600
+
+
+def test_fresh_cache_is_reused(fake_salt_api, tmpdir):
+    _issue_tokens(fake_salt_api)
+    cache = str(tmpdir.join('token'))
+    _get_token(fake_salt_api.url, cache)
+    _get_token(fake_salt_api.url, cache)
+    assert _logins(fake_salt_api) == 1
+
+
+def test_relogin_on_401(fake_salt_api):
+    _issue_tokens(fake_salt_api)
+
+    def run(req):
+        if req.headers.get('X-Auth-Token') != 'token-2':
+            return 401, {}, {}
+        return 200, {}, {'return': [{'ms-0': True}]}
+
+    fake_salt_api.routes['/'] = run
+    api = Pepper(fake_salt_api.url)
+    TokenManager(api, CREDENTIALS, background=False).get()
+
+    assert api.local('*', 'test.ping') == {'return': [{'ms-0': True}]}
+    assert api.auth['token'] == 'token-2'
+    assert _logins(fake_salt_api) == 2
+
+
+def test_relogin_once(fake_salt_api):
+    _issue_tokens(fake_salt_api)
+    fake_salt_api.routes['/'] = lambda req: (401, {}, {})
+    api = Pepper(fake_salt_api.url)
+    TokenManager(api, CREDENTIALS, background=False).get()
+
+    with pytest.raises(PepperException):
+        api.local('*', 'test.ping')
+    assert _logins(fake_salt_api) == 2
+
+
+def test_background_refresh(fake_salt_api):
+    _issue_tokens(fake_salt_api, lifetime=1)
+    api = Pepper(fake_salt_api.url)
+    first = TokenManager(api, CREDENTIALS).get()
+    assert first['token'] == 'token-1'
+
+    deadline = time.time() + 5
+    while api.auth['token'] == 'token-1' and time.time() < deadline:
+        time.sleep(0.05)
+    refreshed = time.time()
+    api.close()
+
+    assert api.auth['token'] != 'token-1'
+    assert refreshed < first['expire']
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import http.client as httplib
+import time
+
+try:
+    import urllib.request as urllib_request
+except ImportError:
+    import urllib2 as urllib_request
+
+# Import Pepper Libraries
+import pepper
+from pepper.transport import ConnectionPool
+
+# Import Testing Libraries
+import pytest
+
+
+def test_req_reuses_connection(fake_salt_api):
+    api = pepper.Pepper(fake_salt_api.url)
+    api.login('pepper', 'pepper', 'sharedsecret')
+    for _ in range(5):
+        ret = api.low([{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}])
+        assert ret == {'return': [[{'client': 'local', 'tgt': '*', 'fun': 'test.ping'}]]}
+    assert fake_salt_api.connections == 1
+    assert fake_salt_api.requests[-1].headers['X-Auth-Token'] == 'faketoken'
+    api.close()
+
+
+def test_req_does_not_install_opener(fake_salt_api):
+    opener = urllib_request._opener
+    pepper.Pepper(fake_salt_api.url).login('pepper', 'pepper', 'sharedsecret')
+    assert urllib_request._opener is opener
+
+
+def test_pool_is_bounded(fake_salt_api):
+    pool = ConnectionPool(maxsize=2)
+    responses = [pool.urlopen('POST', fake_salt_api.url + 'login', b'{}') for _ in range(4)]
+    for resp in responses:
+        resp.read()
+    assert fake_salt_api.connections == 4
+    assert len(pool._idle.popitem()[1]) == 2
+
+
+def test_pool_evicts_idle_connections(fake_salt_api):
+    pool = ConnectionPool(idle_timeout=0.1)
+    pool.urlopen('POST', fake_salt_api.url + 'login', b'{}').read()
+    time.sleep(0.2)
+    pool.urlopen('POST', fake_salt_api.url + 'login', b'{}').read()
+    assert fake_salt_api.connections == 2
+
+
+def test_pool_discards_unread_response(fake_salt_api):
+    pool = ConnectionPool()
+    pool.urlopen('POST', fake_salt_api.url + 'login', b'{}').close()
+    pool.urlopen('POST', fake_salt_api.url + 'login', b'{}').read()
+    assert fake_salt_api.connections == 2
+
+
+def _dropping_route(fake_salt_api):
+    '''
+    Answer the first request, then drop the connection after reading the next
+    '''
+    calls = []
+
+    def route(req):
+        calls.append(req.command)
+        if len(calls) == 2:
+            req.close_connection = True
+            return None
+        return 200, {}, {'return': ['ok']}
+
+    fake_salt_api.routes['/'] = route
+    return calls
+
+
+def test_pool_does_not_resend_sent_request(fake_salt_api):
+    calls = _dropping_route(fake_salt_api)
+    pool = ConnectionPool()
+    pool.urlopen('POST', fake_salt_api.url, b'{}').read()
+    with pytest.raises(httplib.RemoteDisconnected):
+        pool.urlopen('POST', fake_salt_api.url, b'{}')
+    # salt-api may have run the request, it was only sent once
+    assert calls == ['POST', 'POST']
+
+
+def test_pool_resends_idempotent_request(fake_salt_api):
+    calls = _dropping_route(fake_salt_api)
+    pool = ConnectionPool()
+    pool.urlopen('GET', fake_salt_api.url).read()
+    assert pool.urlopen('GET', fake_salt_api.url).read() == b'{"return": ["ok"]}'
+    assert pool.urlopen('POST', fake_salt_api.url, b'{}', idempotent=True).read() == b'{"return": ["ok"]}'
+    assert calls == ['GET', 'GET', 'GET', 'POST']
+    assert fake_salt_api.connections == 2
+
+
+def test_pool_skips_connection_closed_by_server(fake_salt_api):
+    def route(req):
+        req.close_connection = True
+        return 200, {}, {'return': ['ok']}
+
+    fake_salt_api.routes['/'] = route
+    pool = ConnectionPool()
+    pool.urlopen('POST', fake_salt_api.url, b'{}').read()
+    time.sleep(0.1)
+    key = next(iter(pool._idle))
+    conn, reused = pool._get_conn(key)
+    conn.close()
+    assert not reused
+    assert not pool._idle[key]
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Import Python Libraries
+from __future__ import absolute_import
+import asyncio
+import base64
+import hashlib
+import json
+import struct
+import threading
+
+# Import Pepper Libraries
+import pepper
+from pepper.aio import AsyncPepper
+from pepper.exceptions import PepperException
+from pepper.retry import RetryPolicy
+from pepper.websocket import OP_PING, OP_TEXT, WebSocketProtocol, encode_frame
+
+# Import Testing Libraries
+import pytest
+
+JID = '20180414193904158892'
+EVENTS = [
+    {'tag': 'salt/job/{0}/new'.format(JID), 'data': {'jid': JID, 'minions': ['ms-0']}},
+    {'tag': 'salt/job/{0}/ret/ms-0'.format(JID), 'data': {'id': 'ms-0', 'return': 'häj' * 30000}},
+    {'tag': 'salt/auth', 'data': {'id': 'ms-1', 'act': 'accept'}},
+]
+
+
+def _frame(opcode, payload=b'', fin=True):
+    '''
+    An unmasked server frame
+    '''
+    if isinstance(payload, str):
+        payload = payload.encode('utf-8')
+    head = bytes([(0x80 if fin else 0) | opcode])
+    if len(payload) < 126:
+        head += bytes([len(payload)])
+    elif len(payload) < 0x10000:
+        head += bytes([126]) + struct.pack('!H', len(payload))
+    else:
+        head += bytes([127]) + struct.pack('!Q', len(payload))
+    return head + payload
+
+
+def _read_frame(rfile):
+    '''
+    Read a masked client frame
+    '''
+    first, second = rfile.read(2)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', rfile.read(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', rfile.read(8))[0]
+    assert second & 0x80
+    key = rfile.read(4)
+    payload = bytes(byte ^ key[i % 4] for i, byte in enumerate(rfile.read(length)))
+    return first & 0x0F, payload
+
+
+def _ws_route(*scripts):
+    '''
+    Upgrade the connection and run the next script with the handler once
+    the client is ready
+    '''
+    scripts = list(scripts)
+    received = []
+    finished = threading.Event()
+
+    def route(req):
+        if req.headers.get('X-Auth-Token') != 'faketoken':
+            return 401, {}, {}
+        assert req.headers['Upgrade'] == 'websocket'
+        accept = base64.b64encode(hashlib.sha1(
+            req.headers['Sec-WebSocket-Key'].encode() + b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11').digest())
+        req.send_response(101)
+        req.send_header('Upgrade', 'websocket')
+        req.send_header('Connection', 'Upgrade')
+        req.send_header('Sec-WebSocket-Accept', accept.decode())
+        req.end_headers()
+        req.wfile.flush()
+        received.append(_read_frame(req.rfile))
+        try:
+            scripts.pop(0)(req)
+        except (IOError, OSError):
+            pass
+        finally:
+            finished.set()
+        req.close_connection = True
+
+    route.received = received
+    route.finished = finished
+    return route
+
+
+def _send_events(req, events):
+    for event in events:
+        req.wfile.write(_frame(OP_TEXT, 'data: {0}\n\n'.format(json.dumps(event))))
+    req.wfile.flush()
+
+
+def _api(fake_salt_api):
+    api = pepper.Pepper(fake_salt_api.url, retry=RetryPolicy(initial=0.01, maximum=0.05))
+    api.auth = {'token': 'faketoken'}
+    return api
+
+
+def test_protocol():
+    protocol = WebSocketProtocol()
+    # a fragmented message with a ping in between
+    stream = _frame(OP_TEXT, 'hä', fin=False) + _frame(OP_PING, b'hi') + _frame(0, 'j')
+    assert [message for i in range(len(stream)) for message in protocol.receive(stream[i:i + 1])] == ['häj']
+    assert protocol.data_to_send()[0] == 0x8A
+
+    large = b'x' * 70000
+    assert protocol.receive(_frame(0x2, large) + _frame(0x8, struct.pack('!H', 1001))) == [large]
+    assert protocol.closed and protocol.close_code == 1001
+
+    # a large message arriving in small reads
+    protocol = WebSocketProtocol()
+    stream = _frame(OP_TEXT, 'häj' * 100000) + _frame(OP_TEXT, 'next')
+    messages = [message for i in range(0, len(stream), 4096) for message in protocol.receive(stream[i:i + 4096])]
+    assert messages == ['häj' * 100000, 'next'] and not protocol._buffer
+
+    # the closing frame answering ours is not answered again
+    protocol = WebSocketProtocol()
+    protocol.close()
+    assert protocol.data_to_send()[0] == 0x88
+    protocol.close()
+    assert protocol.receive(_frame(0x8, struct.pack('!H', 1000))) == []
+    assert protocol.closed and protocol.data_to_send() == b''
+
+    # client frames are masked
+    frame = encode_frame(OP_TEXT, 'websocket client ready')
+    assert frame[1] & 0x80 and b'ready' not in frame
+    assert WebSocketProtocol().receive(frame) == ['websocket client ready']
+
+
+def test_events_ws(fake_salt_api):
+    pongs = []
+
+    def script(req):
+        req.wfile.write(_frame(OP_PING, b'keepalive'))
+        req.wfile.flush()
+        pongs.append(_read_frame(req.rfile))
+        _send_events(req, EVENTS)
+        req.wfile.write(_frame(0x8, struct.pack('!H', 1000)))
+        req.wfile.flush()
+        # the client replies to the closing frame
+        pongs.append(_read_frame(req.rfile))
+
+    route = fake_salt_api.routes['/ws'] = _ws_route(script)
+    api = _api(fake_salt_api)
+    assert list(api.events_ws(reconnect=False)) == EVENTS
+    assert route.finished.wait(5)
+    assert route.received == [(OP_TEXT, b'websocket client ready')]
+    assert pongs == [(0xA, b'keepalive'), (0x8, struct.pack('!H', 1000))]
+
+
+def test_tags_and_reconnect(fake_salt_api):
+    done = threading.Event()
+
+    def dropped(req):
+        _send_events(req, EVENTS[:2])
+
+    def second(req):
+        _send_events(req, [EVENTS[1]])
+        done.wait(5)
+
+    fake_salt_api.routes['/ws'] = _ws_route(dropped, second)
+    api = _api(fake_salt_api)
+    events = api.events_ws(tags='salt/job/*/ret/*')
+    assert [next(events), next(events)] == [EVENTS[1], EVENTS[1]]
+    events.close()
+    done.set()
+    assert len([req for req in fake_salt_api.requests if req.path == '/ws']) == 2
+
+
+def test_dead_connection_is_detected(fake_salt_api):
+    pings = []
+
+    def silent(req):
+        pings.append(_read_frame(req.rfile))
+        # never answer the ping
+        pings.append(_read_frame(req.rfile))
+
+    route = fake_salt_api.routes['/ws'] = _ws_route(silent)
+    api = _api(fake_salt_api)
+    assert list(api.events_ws(ping_interval=0.1, reconnect=False)) == []
+    assert route.finished.wait(5)
+    assert pings[0][0] == OP_PING
+    # the connection was closed after the second silent interval
+    assert pings[1][0] == 0x8
+
+
+def test_auth_denied(fake_salt_api):
+    fake_salt_api.routes['/ws'] = _ws_route()
+    api = _api(fake_salt_api)
+    api.auth = {'token': 'expired'}
+    with pytest.raises(PepperException) as exc:
+        api.events_ws()
+    assert 'Authentication denied' in str(exc.value)
+
+
+def test_async_events_ws(fake_salt_api):
+    def script(req):
+        _send_events(req, EVENTS)
+        req.wfile.write(_frame(0x8, struct.pack('!H', 1000)))
+
+    fake_salt_api.routes['/ws'] = _ws_route(script)
+
+    async def run():
+        async with AsyncPepper(fake_salt_api.url) as api:
+            await api.login('pepper', 'pepper', 'sharedsecret')
+            return [event async for event in api.events_ws(tags=['salt/auth', 'salt/job/*/new'], reconnect=False)]
+
+    assert asyncio.run(run()) == [EVENTS[0], EVENTS[2]]